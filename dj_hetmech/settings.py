@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/2.1/ref/settings/
 """
 
 import os
+import tempfile
 
 import yaml
 
@@ -104,6 +105,64 @@ DATABASES = {
 }
 
 
+# Caches
+# https://docs.djangoproject.com/en/2.1/topics/cache/
+# API responses are cached in RESPONSE_CACHE_ALIAS, keyed by the dataset version,
+# so entries never expire but are no longer read after populate_database runs.
+# Responses are stored compressed. ByteLimitedLocMemCache is per process and evicts
+# the least recently used entries beyond MAX_ENTRIES or MAX_BYTES of pickled values.
+# Its hit and miss counters are per process too. Set response_cache in secrets.yml
+# to use a file-based or shared backend instead, which shares entries and counters
+# between processes. Set RESPONSE_CACHE_ALIAS to None to disable response caching.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'responses': secrets.get('response_cache', {
+        'BACKEND': 'dj_hetmech_app.utils.cache.ByteLimitedLocMemCache',
+        'LOCATION': 'responses',
+        'TIMEOUT': None,
+        'OPTIONS': {'MAX_ENTRIES': 100_000, 'MAX_BYTES': 64 * 2**20},
+    }),
+}
+RESPONSE_CACHE_ALIAS = 'responses'
+# Seconds that a process reuses the dataset version before checking the database
+DATASET_VERSION_TTL = 60
+# Seconds that browsers and proxies may reuse data endpoint responses without
+# revalidating their ETag. Set to None to send no ETag or Cache-Control headers.
+HTTP_CACHE_MAX_AGE = 60 * 60
+
+
+# Serve node searches from an in-memory index built once per process rather than
+# pg_trgm queries. Ties in similarity are ordered by name in code point order.
+NODE_SEARCH_INDEX = True
+
+
+# Enumerate paths for the paths endpoint with 'neo4j', which queries the Hetionet
+# Neo4j database, or 'hetmat', which enumerates paths in process on the hetmat
+# at HETMAT_PATH, as downloaded by populate_database.
+PATHS_ENGINE = secrets.get('PATHS_ENGINE', 'neo4j')
+HETMAT_PATH = secrets.get('HETMAT_PATH', os.path.join(
+    BASE_DIR, 'dj_hetmech_app', 'management', 'commands', 'downloads', 'hetionet-v1.0.hetmat'))
+
+# Paths endpoint results are cached per dataset version in an in-process LRU of
+# up to PATHS_CACHE_MAX_BYTES of compressed JSON, backed by an SQLite database at
+# PATHS_CACHE_PATH that processes share and that keeps up to
+# PATHS_CACHE_MAX_DISK_BYTES, evicting the least recently used results. Set
+# PATHS_CACHE_PATH to None to only cache in process, PATHS_CACHE_MAX_BYTES to 0
+# to only cache on disk, and PATHS_CACHE_MAX_DISK_BYTES to None to not bound the disk.
+PATHS_CACHE_MAX_BYTES = 64 * 2**20
+PATHS_CACHE_PATH = secrets.get('PATHS_CACHE_PATH', os.path.join(tempfile.gettempdir(), 'hetmech-path-cache.sqlite3'))
+PATHS_CACHE_MAX_DISK_BYTES = secrets.get('PATHS_CACHE_MAX_DISK_BYTES', 2 * 2**30)
+
+# populate_database saves the arrays that random node pairs are sampled from to a
+# directory per dataset version in NODE_PAIR_SAMPLER_PATH, which processes
+# memory-map. Set to None to build the sampler from the database in each process.
+NODE_PAIR_SAMPLER_PATH = secrets.get('NODE_PAIR_SAMPLER_PATH', os.path.join(
+    BASE_DIR, 'dj_hetmech_app', 'management', 'commands', 'downloads', 'node-pair-sampler'))
+
+
 # Password validation
 # https://docs.djangoproject.com/en/2.1/ref/settings/#auth-password-validators
 
@@ -146,4 +205,4 @@ STATIC_URL = '/static/'
 # https://pypi.org/project/django-cors-headers/
 CORS_ORIGIN_ALLOW_ALL = True
 CORS_URLS_REGEX = r'^/v1/.*$'
-CORS_ALLOW_METHODS = ('GET', )
+CORS_ALLOW_METHODS = ('GET', 'POST', )
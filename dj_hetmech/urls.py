@@ -27,5 +27,8 @@ urlpatterns = [
     path('v1/random-node-pair/', views.RandomNodePairView.as_view(), name="random-node-pair"),
     path('v1/metapaths/source/<int:source>/target/<int:target>/', views.QueryMetapathsView.as_view(), name="metapaths"),
     path('v1/metapaths/random-nodes/', views.QueryMetapathsRandomNodesView.as_view(), name="metapaths-random-nodes"),
+    path('v1/metapaths/batch/', views.QueryMetapathsBatchView.as_view(), name="metapaths-batch"),
     path('v1/paths/source/<int:source>/target/<int:target>/metapath/<str:metapath>/', views.QueryPathsView.as_view(), name="paths"),
+    path('v1/connections/node/<int:node>/', views.QueryConnectionsView.as_view(), name="connections"),
+    path('v1/export/metapath/<str:metapath>/', views.ExportPathCountsView.as_view(), name="export"),
 ]
@@ -0,0 +1,114 @@
+"""
+Benchmark node search with the in-memory index against the pg_trgm SQL query.
+
+```
+python manage.py benchmark_node_search --n-queries=200
+python manage.py benchmark_node_search --queries=queries.txt --output=search-bench.tsv
+```
+
+Without --queries, queries are random prefixes of node names and identifiers,
+like the partial strings typed into the frontend autocomplete. Each query
+requests the first page of results and the result count, as the nodes
+endpoint does. Reports latency percentiles for both paths and the fraction of
+queries whose first page of node ids agree.
+"""
+
+import random
+import time
+
+import pandas
+from django.core.management.base import BaseCommand
+
+from dj_hetmech_app.models import Node
+from dj_hetmech_app.utils.search import NodeSearchIndex
+from dj_hetmech_app.views import search_node_queryset
+
+
+class Command(BaseCommand):
+
+    help = 'Benchmark node search with the in-memory index against the pg_trgm SQL query.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--queries',
+            help='file with one search string per line (default generates queries from node names).',
+        )
+        parser.add_argument(
+            '--n-queries', type=int, default=100,
+            help='number of queries to generate when --queries is not specified (default 100).',
+        )
+        parser.add_argument(
+            '--limit', type=int, default=25,
+            help='number of results per query, as with the limit parameter of the nodes endpoint (default 25).',
+        )
+        parser.add_argument(
+            '--similarity', type=float, default=0.3,
+            help='trigram similarity threshold (default 0.3).',
+        )
+        parser.add_argument(
+            '--seed', type=int, default=0,
+            help='random seed for generating queries.',
+        )
+        parser.add_argument(
+            '--output',
+            help='path to write per-query timings as a TSV.',
+        )
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        index = NodeSearchIndex.from_database()
+        print(f'built index of {len(index):,} nodes in {time.perf_counter() - start:.2f} seconds')
+        if options['queries']:
+            with open(options['queries']) as read_file:
+                queries = [line.rstrip('\n') for line in read_file if line.strip()]
+        else:
+            queries = generate_queries(options['n_queries'], options['seed'])
+
+        limit, similarity = options['limit'], options['similarity']
+        results = list()
+        for query in queries:
+            start = time.perf_counter()
+            index_results = index.search(query, similarity)
+            index_ids = index_results.get_ids(0, limit)
+            index_count = len(index_results)
+            index_seconds = time.perf_counter() - start
+
+            start = time.perf_counter()
+            queryset = search_node_queryset(Node.objects.all(), query, similarity)
+            sql_ids = list(queryset[:limit].values_list('id', flat=True))
+            sql_count = queryset.count()
+            sql_seconds = time.perf_counter() - start
+
+            results.append({
+                'query': query,
+                'count': sql_count,
+                'index_ms': 1_000 * index_seconds,
+                'sql_ms': 1_000 * sql_seconds,
+                'counts_agree': index_count == sql_count,
+                'ids_agree': index_ids == sql_ids,
+            })
+
+        results_df = pandas.DataFrame(results)
+        summary_df = results_df[['index_ms', 'sql_ms']].quantile([0.5, 0.9, 0.99]).rename_axis('quantile')
+        print(summary_df.to_string(float_format='{:.3f}'.format))
+        print(
+            f"{results_df.counts_agree.mean():.1%} of {len(results_df):,} queries agree on the result count, "
+            f"{results_df.ids_agree.mean():.1%} on the first {limit} node ids"
+        )
+        if options['output']:
+            results_df.to_csv(options['output'], sep='\t', index=False, float_format='%.4g')
+
+
+def generate_queries(n_queries, seed=0):
+    """
+    Return random prefixes, of one to ten characters, of node names and identifiers.
+    """
+    rng = random.Random(seed)
+    strings = [
+        string for pair in Node.objects.values_list('name', 'identifier')
+        for string in pair
+    ]
+    queries = list()
+    for string in rng.sample(strings, min(n_queries, len(strings))):
+        queries.append(string[:rng.randint(1, 10)])
+    return queries
@@ -0,0 +1,444 @@
+"""
+Benchmark populate_database stages on a synthetic hetmat.
+
+```
+python manage.py benchmark_populate_database --flush --node-scale=0.02 --max-metapath-length=2
+python manage.py benchmark_populate_database --flush --loader=copy --workers=4 --output=bench.tsv
+```
+
+A synthetic hetmat with Hetionet's metagraph is generated along with the
+metanode, metapath statistics, degree-grouped permutation, and DWPC files that
+populate_database otherwise downloads from GitHub and Zenodo. Each stage is
+then run against the configured PostgreSQL database, reporting rows written,
+wall time, rows per second, and peak resident memory. The benchmark wipes the
+database, so --flush is required.
+"""
+
+import collections
+import io
+import os
+import pathlib
+import resource
+import tempfile
+import threading
+import time
+import zipfile
+
+import hetmatpy.degree_group
+import hetmatpy.degree_weight
+import hetmatpy.hetmat
+import numpy
+import pandas
+import scipy.sparse
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+
+import dj_hetmech_app.models as hetmech_models
+from dj_hetmech_app.management.commands.populate_database import Command as PopulateCommand
+from dj_hetmech_app.utils import get_hetionet_metagraph
+
+
+# Number of nodes per metanode in Hetionet v1.0
+hetionet_node_counts = {
+    'Anatomy': 402,
+    'Biological Process': 11381,
+    'Cellular Component': 1391,
+    'Compound': 1552,
+    'Disease': 137,
+    'Gene': 20945,
+    'Molecular Function': 2884,
+    'Pathway': 1822,
+    'Pharmacologic Class': 345,
+    'Side Effect': 5734,
+    'Symptom': 438,
+}
+
+
+class Command(BaseCommand):
+
+    help = 'Benchmark populate_database stages on a synthetic hetmat.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--flush', action='store_true',
+            help='required confirmation that the database will be flushed before the benchmark.',
+        )
+        parser.add_argument(
+            '--node-scale', type=float, default=0.02,
+            help='number of synthetic nodes per metanode as a fraction of Hetionet (default 0.02)',
+        )
+        parser.add_argument(
+            '--density', type=float, default=0.02,
+            help='fraction of possible edges present for each metaedge (default 0.02)',
+        )
+        parser.add_argument(
+            '--max-metapath-length', type=int, default=2,
+            help='max metapath length to generate and load (default 2)',
+        )
+        parser.add_argument(
+            '--reduced-metapaths', action='store_true',
+            help='only load the reduced set of metapaths, as in populate_database.',
+        )
+        parser.add_argument(
+            '--seed', type=int, default=0,
+            help='random seed for generating the synthetic hetmat (default 0)',
+        )
+        parser.add_argument(
+            '--data-dir', type=pathlib.Path,
+            help='directory for the synthetic files. Defaults to a temporary directory. '
+                 'Existing synthetic files in this directory are reused.',
+        )
+        parser.add_argument(
+            '--output', type=pathlib.Path,
+            help='path to write the per-stage results as a TSV',
+        )
+        # Options passed through to populate_database
+        parser.add_argument('--batch-size', type=int, default=5_000)
+        parser.add_argument('--loader', choices=['bulk_create', 'copy'], default='bulk_create')
+        parser.add_argument('--workers', type=int, default=1)
+        parser.add_argument('--read-archives-in-place', action='store_true')
+        parser.add_argument('--defer-constraints', action='store_true')
+
+    def handle(self, *args, **options):
+        if not options['flush']:
+            raise CommandError('benchmark_populate_database wipes the database. Pass --flush to confirm.')
+        if options['data_dir'] is None:
+            with tempfile.TemporaryDirectory() as data_dir:
+                self._benchmark(pathlib.Path(data_dir), options)
+        else:
+            self._benchmark(options['data_dir'], options)
+
+    def _benchmark(self, data_dir, options):
+        generator = SyntheticHetionet(
+            directory=data_dir,
+            node_scale=options['node_scale'],
+            density=options['density'],
+            max_length=options['max_metapath_length'],
+            seed=options['seed'],
+        )
+        start = time.perf_counter()
+        generator.generate()
+        print(f'generated synthetic hetmat in {time.perf_counter() - start:.1f} seconds')
+
+        call_command('flush', interactive=False)
+        command = SyntheticPopulateCommand()
+        command.download_dir = data_dir
+        command.hetmat_path = generator.hetmat.directory
+        command.options = {
+            'max_metapath_length': options['max_metapath_length'],
+            'reduced_metapaths': options['reduced_metapaths'],
+            'batch_size': options['batch_size'],
+            'loader': options['loader'],
+            'workers': options['workers'],
+            'resume': False,
+            'node_source': 'hetnet',
+            'node_id_map': None,
+            'read_archives_in_place': options['read_archives_in_place'],
+            'download_threads': 1,
+            'defer_constraints': options['defer_constraints'],
+        }
+        command._throughput = collections.defaultdict(collections.Counter)
+
+        stages = [
+            ('metanodes', hetmech_models.Metanode, command._populate_metanode_table),
+            ('nodes', hetmech_models.Node, command._populate_node_table),
+            ('metapaths', hetmech_models.Metapath, command._populate_metapath_table),
+        ]
+        for length in range(1, 1 + options['max_metapath_length']):
+            stages.append((f'download_path_counts_length-{length}', None, lambda length=length: command._download_path_counts(length)))
+            stages.append((f'dgp_length-{length}', hetmech_models.DegreeGroupedPermutation, lambda length=length: command._populate_degree_grouped_permutation_table(length)))
+        if options['defer_constraints']:
+            stages.append(('defer_constraints', None, lambda: command._defer_constraints(hetmech_models.PathCount)))
+        stages.append(('path_counts', hetmech_models.PathCount, command._populate_path_count_table))
+        if options['defer_constraints']:
+            stages.append(('restore_constraints', None, lambda: command._restore_constraints(hetmech_models.PathCount)))
+        stages.append(('node_pair_metapaths', hetmech_models.NodePairMetapaths, command._populate_node_pair_metapaths_table))
+        stages.append(('node_connections', hetmech_models.NodeConnection, command._populate_node_connection_table))
+
+        results = list()
+        for stage, model, func in stages:
+            results.append(measure_stage(stage, model, func))
+            print(format_result(results[-1]))
+
+        results_df = pandas.DataFrame(results)
+        print(results_df.to_string(index=False))
+        if options['output']:
+            results_df.to_csv(options['output'], sep='\t', index=False, float_format='%.4g')
+
+
+class SyntheticPopulateCommand(PopulateCommand):
+    """
+    populate_database Command that reads the files generated by SyntheticHetionet
+    rather than downloading them. download_dir and hetmat_path must be set to
+    the SyntheticHetionet directory and hetmat.
+    """
+
+    def _download_hetionet_hetmat(self):
+        pass
+
+    def github_download(self, repo, commit, path):
+        return self.download_dir.joinpath('github', pathlib.Path(path).name)
+
+    def zenodo_download(self, record_id, filename):
+        return self.download_dir.joinpath('zenodo', str(record_id), filename)
+
+    def _iter_hetnet_node_rows(self):
+        neo4j_ids = self._get_neo4j_node_id_map()
+        hetmat = self._hetionet_hetmat
+        for metanode in hetmat.metagraph.get_nodes():
+            node_df = pandas.read_csv(hetmat.get_nodes_path(metanode), sep='\t', dtype={'identifier': str})
+            for row in node_df.itertuples():
+                yield dict(
+                    id=neo4j_ids[metanode.identifier, row.identifier],
+                    metanode_id=metanode.identifier,
+                    identifier=row.identifier,
+                    identifier_type='int' if metanode.identifier == 'Gene' else 'str',
+                    name=row.name,
+                    properties={'source': 'synthetic'},
+                )
+
+
+class SyntheticHetionet:
+    """
+    Generate a random hetmat with Hetionet's metagraph, plus the metanode table,
+    metapath statistics, neo4j node id map, and Zenodo-style degree-grouped
+    permutation and DWPC archives that populate_database reads.
+    """
+
+    def __init__(self, directory, node_scale=0.02, density=0.02, max_length=2, seed=0):
+        self.directory = pathlib.Path(directory)
+        self.node_scale = node_scale
+        self.density = density
+        self.max_length = max_length
+        self.random = numpy.random.RandomState(seed)
+        self.metagraph = get_hetionet_metagraph()
+        self.hetmat = hetmatpy.hetmat.HetMat(self.directory.joinpath('synthetic.hetmat'))
+
+    def generate(self):
+        if self.hetmat.directory.exists():
+            return
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.hetmat.initialize()
+        self.hetmat.metagraph = self.metagraph
+        self._generate_nodes()
+        self._generate_edges()
+        self._generate_path_counts()
+
+    def _generate_nodes(self):
+        metanode_rows = list()
+        id_rows = list()
+        for metanode in sorted(self.metagraph.get_nodes(), key=lambda x: x.identifier):
+            n_nodes = max(5, round(hetionet_node_counts[metanode.identifier] * self.node_scale))
+            if metanode.identifier == 'Gene':
+                identifiers = [str(i) for i in range(1, n_nodes + 1)]
+            else:
+                identifiers = [f'{metanode.abbrev}:{i:07d}' for i in range(n_nodes)]
+            node_df = pandas.DataFrame({
+                'position': range(n_nodes),
+                'identifier': identifiers,
+                'name': [f'{metanode.identifier} {i}' for i in range(n_nodes)],
+            })
+            node_df.to_csv(self.hetmat.get_nodes_path(metanode), sep='\t', index=False)
+            metanode_rows.append((metanode.identifier, metanode.abbrev, n_nodes))
+            for identifier in identifiers:
+                id_rows.append((len(id_rows), metanode.identifier, identifier))
+        github_dir = self.directory.joinpath('github')
+        github_dir.mkdir(parents=True, exist_ok=True)
+        pandas.DataFrame(metanode_rows, columns=['metanode', 'abbreviation', 'nodes']).to_csv(
+            github_dir.joinpath('metanodes.tsv'), sep='\t', index=False)
+        pandas.DataFrame(id_rows, columns=['neo4j_id', 'metanode', 'identifier']).to_csv(
+            self.directory.joinpath('hetionet-v1.0_neo4j-node-ids.tsv'), sep='\t', index=False)
+
+    def _generate_edges(self):
+        for metaedge in self.metagraph.get_edges(exclude_inverts=True):
+            shape = (
+                self.hetmat.count_nodes(metaedge.source),
+                self.hetmat.count_nodes(metaedge.target),
+            )
+            matrix = scipy.sparse.random(
+                *shape, density=self.density, format='csr',
+                random_state=self.random, data_rvs=numpy.ones,
+            )
+            if metaedge.source == metaedge.target and metaedge.direction == 'both':
+                matrix = scipy.sparse.triu(matrix, k=1)
+                matrix = (matrix + matrix.T).tocsr()
+                matrix.data[:] = 1
+            path = self.hetmat.get_edges_path(metaedge, file_format=None)
+            hetmatpy.hetmat.save_matrix(matrix.astype(bool), path)
+
+    def _generate_path_counts(self):
+        zenodo_dir = self.directory.joinpath('zenodo', '1435834')
+        zenodo_dir.mkdir(parents=True, exist_ok=True)
+        metapaths = self.metagraph.extract_all_metapaths(self.max_length, exclude_inverts=True)
+        stats_rows = list()
+        for length in range(1, 1 + self.max_length):
+            archives = {
+                name: zipfile.ZipFile(zenodo_dir.joinpath(name), mode='w', compression=zipfile.ZIP_STORED)
+                for name in PopulateCommand._path_count_archives(length)
+            }
+            dgp_zip, pc_zip, dwpc_zip = archives.values()
+            for metapath in metapaths:
+                if len(metapath) != length:
+                    continue
+                _, _, path_counts = hetmatpy.degree_weight.dwpc(self.hetmat, metapath, damping=0.0)
+                if not path_counts.max():
+                    # DWPCs are scaled by their mean, so metapaths without paths are omitted
+                    continue
+                _, _, dwpcs = hetmatpy.degree_weight.dwpc(self.hetmat, metapath, damping=0.5)
+                self._write_matrix(pc_zip, metapath, 0.0, path_counts)
+                self._write_matrix(dwpc_zip, metapath, 0.5, dwpcs)
+                dwpc_mean = dwpcs.mean()
+                self._write_dgp(dgp_zip, metapath, dwpcs, dwpc_mean)
+                n_pairs = numpy.prod(path_counts.shape)
+                nnz = path_counts.nnz if scipy.sparse.issparse(path_counts) else numpy.count_nonzero(path_counts)
+                stats_rows.append({
+                    'metapath': metapath.abbrev,
+                    'length': length,
+                    'n_pairs': n_pairs,
+                    'pc_density': nnz / n_pairs,
+                    'pc_mean': path_counts.mean(),
+                    'pc_max': path_counts.max(),
+                    'dwpc-0.5_raw_mean': dwpc_mean,
+                })
+            for zip_file in archives.values():
+                zip_file.close()
+        pandas.DataFrame(stats_rows).to_csv(
+            self.directory.joinpath('github', 'metapath-dwpc-stats.tsv'), sep='\t', index=False)
+
+    def _write_matrix(self, zip_file, metapath, damping, matrix):
+        path = self.hetmat.get_path_counts_path(metapath, 'dwpc', damping, file_format=None)
+        member = path.relative_to(self.hetmat.directory).as_posix()
+        buffer = io.BytesIO()
+        if scipy.sparse.issparse(matrix):
+            scipy.sparse.save_npz(buffer, matrix, compressed=False)
+            member += '.sparse.npz'
+        else:
+            numpy.save(buffer, matrix)
+            member += '.npy'
+        zip_file.writestr(member, buffer.getvalue())
+
+    def _write_dgp(self, zip_file, metapath, dwpcs, dwpc_mean):
+        """
+        Write degree-grouped statistics, using the DWPC matrix itself in place of
+        the permuted hetmats, which share its degree distributions.
+        """
+        source_degree_to_ind, target_degree_to_ind = hetmatpy.degree_group.metapath_to_degree_dicts(
+            self.hetmat, metapath)
+        rows = hetmatpy.degree_group.generate_degree_group_stats(
+            source_degree_to_ind, target_degree_to_ind, dwpcs, scale=True, scaler=dwpc_mean)
+        dgp_df = pandas.DataFrame(rows)
+        path = self.hetmat.get_running_degree_group_path(metapath, 'dwpc', 0.5, extension='.tsv.gz')
+        member = path.relative_to(self.hetmat.directory).as_posix()
+        buffer = io.BytesIO()
+        dgp_df.to_csv(buffer, sep='\t', index=False, compression='gzip')
+        zip_file.writestr(member, buffer.getvalue())
+
+
+def measure_stage(stage, model, func):
+    """
+    Run func and return a dictionary with the number of rows it added to the
+    table for model, the wall time, and the peak resident memory of this
+    process and of its largest worker process during the stage in megabytes.
+    """
+    n_rows_before = model.objects.count() if model else 0
+    reset_peak_rss()
+    start = time.perf_counter()
+    with WorkerRSSMonitor() as worker_rss:
+        func()
+    seconds = time.perf_counter() - start
+    n_rows = (model.objects.count() - n_rows_before) if model else 0
+    return {
+        'stage': stage,
+        'rows': n_rows,
+        'seconds': seconds,
+        'rows_per_second': n_rows / seconds if seconds else float('nan'),
+        'peak_rss_mb': get_peak_rss() / 1024,
+        'peak_worker_rss_mb': worker_rss.peak_rss / 1024,
+    }
+
+
+def format_result(result):
+    return (
+        f"{result['stage']}: {result['rows']:,} rows in {result['seconds']:.2f} seconds "
+        f"({result['rows_per_second']:,.0f} rows/s), peak RSS {result['peak_rss_mb']:,.0f} MB"
+    )
+
+
+def reset_peak_rss():
+    """
+    Reset the peak resident set size of this process (Linux only), so
+    get_peak_rss measures the peak since the reset rather than since startup.
+    """
+    try:
+        pathlib.Path('/proc/self/clear_refs').write_text('5')
+    except OSError:
+        pass
+
+
+def get_peak_rss(pid='self'):
+    """
+    Return the peak resident set size of a process, by default this one, in
+    kilobytes. Other processes are only supported on Linux and report 0 once
+    they exit.
+    """
+    try:
+        for line in pathlib.Path(f'/proc/{pid}/status').read_text().splitlines():
+            if line.startswith('VmHWM:'):
+                return int(line.split()[1])
+    except OSError:
+        pass
+    if pid != 'self':
+        return 0
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+class WorkerRSSMonitor:
+    """
+    Context manager that samples the peak resident set size of the child
+    processes of this process (Linux only) from a background thread. Workers
+    report their peak since they started, and populate_database starts a new
+    pool for each stage, so the largest peak sampled is that of the stage.
+    Workers that exit between samples are missed. peak_rss is in kilobytes,
+    0 without workers, and NaN where /proc is unavailable.
+    """
+
+    def __init__(self, interval=0.1):
+        self.interval = interval
+        self.peak_rss = 0 if pathlib.Path('/proc/self/status').exists() else float('nan')
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while True:
+            self.sample()
+            if self._stop.wait(self.interval):
+                return
+
+    def sample(self):
+        for pid in get_child_pids():
+            self.peak_rss = max(self.peak_rss, get_peak_rss(pid))
+
+
+def get_child_pids():
+    """
+    Return the ids of the child processes of this process (Linux only).
+    """
+    parent = str(os.getpid())
+    pids = list()
+    for stat_path in pathlib.Path('/proc').glob('[0-9]*/stat'):
+        try:
+            # The parent id follows the parenthesized command name, which may contain spaces
+            fields = stat_path.read_text().rsplit(')', 1)[1].split()
+        except OSError:
+            continue
+        if fields[1] == parent:
+            pids.append(int(stat_path.parent.name))
+    return pids
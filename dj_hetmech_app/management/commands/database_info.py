@@ -4,6 +4,14 @@ import django.apps
 from django.core.management.base import BaseCommand
 import pandas
 
+from dj_hetmech_app.utils.cache import (
+    get_dataset_version,
+    get_response_cache,
+    get_response_cache_stats,
+    is_shared_cache,
+)
+from dj_hetmech_app.utils.path_cache import get_path_cache
+
 
 class Command(BaseCommand):
 
@@ -24,4 +32,23 @@ class Command(BaseCommand):
         total_metapaths = dj_hetmech_app.models['metapath'].objects.count()
         complete_metapaths = dj_hetmech_app.models['pathcount'].objects.values('metapath').distinct()
         print(f'{len(complete_metapaths):,} completed metapaths of {total_metapaths:,} total metapaths')
-
+        # Output dataset version and response cache counters
+        stats = get_response_cache_stats()
+        print(
+            f'dataset version {get_dataset_version()}: '
+            f"response cache {stats['hits']:,} hits, {stats['misses']:,} misses"
+        )
+        cache = get_response_cache()
+        if cache is not None and not is_shared_cache(cache):
+            print(
+                'The response cache backend is per process, so these counters only cover this command. '
+                'Set response_cache in secrets.yml to a shared backend to count server requests.'
+            )
+        # Output paths cache counters and the entries on disk
+        stats = get_path_cache().get_stats()
+        hit_rate = 'no requests' if stats['hit_rate'] is None else f"{stats['hit_rate']:.1%} hit rate"
+        print(
+            f"paths cache {stats['memory_hits']:,} memory hits, {stats['disk_hits']:,} disk hits, "
+            f"{stats['misses']:,} misses ({hit_rate}), "
+            f"{stats['disk_entries']:,} entries ({stats['disk_bytes']:,} bytes) on disk"
+        )
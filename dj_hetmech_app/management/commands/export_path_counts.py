@@ -0,0 +1,68 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from dj_hetmech_app.models import Metapath
+from dj_hetmech_app.utils.exports import content_types, format_export_rows, get_export_rows, get_stored_metapath
+
+
+class Command(BaseCommand):
+
+    help = 'Export the PathCount rows for a metapath as newline-delimited JSON, CSV, or TSV.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'metapath',
+            help='metapath abbreviation, like CbGaD. Rows run from source to target in this orientation.',
+        )
+        parser.add_argument(
+            '--output-format', choices=list(content_types), default='tsv',
+            help='format of the export (default tsv).',
+        )
+        parser.add_argument(
+            '--path', default='-',
+            help='file to write the export to (default - writes to stdout).',
+        )
+        parser.add_argument(
+            '--max-adjusted-p-value', type=float,
+            help='only export rows whose adjusted p-value is at most this cutoff.',
+        )
+        parser.add_argument(
+            '--after', type=lambda x: tuple(map(int, x.split('-'))),
+            help='resume an export after the row with this <source_id>-<target_id>.',
+        )
+        parser.add_argument(
+            '--limit', type=int,
+            help='maximum number of rows to export (default exports all rows).',
+        )
+        parser.add_argument(
+            '--chunk-size', type=int, default=5_000,
+            help='number of rows fetched per round trip of the server-side cursor (default 5,000).',
+        )
+
+    def handle(self, *args, **options):
+        # Validate before opening the output, which would truncate an existing file
+        try:
+            get_stored_metapath(options['metapath'])
+        except (ValueError, Metapath.DoesNotExist) as error:
+            raise CommandError(str(error))
+        if options['after'] is not None and len(options['after']) != 2:
+            raise CommandError('--after must be <source_id>-<target_id>')
+        for option in 'limit', 'chunk_size':
+            if options[option] is not None and options[option] < 1:
+                raise CommandError(f"--{option.replace('_', '-')} must be positive")
+        rows = get_export_rows(
+            options['metapath'],
+            max_adjusted_p_value=options['max_adjusted_p_value'],
+            after=options['after'],
+            limit=options['limit'],
+            chunk_size=options['chunk_size'],
+        )
+        chunks = format_export_rows(rows, options['output_format'], chunk_size=options['chunk_size'])
+        write_file = sys.stdout if options['path'] == '-' else open(options['path'], 'w', newline='')
+        try:
+            for chunk in chunks:
+                write_file.write(chunk)
+        finally:
+            if write_file is not sys.stdout:
+                write_file.close()
@@ -6,13 +6,44 @@ python manage.py flush --no-input
 python manage.py populate_database --max-metapath-length=3 --reduced-metapaths --batch-size=12000
 python manage.py database_info
 ```
+
+Use `--loader=copy` to write the Node, DegreeGroupedPermutation, and PathCount
+tables with PostgreSQL's `COPY ... FROM STDIN` rather than Django's bulk_create.
+
+Completed units of the load are recorded in the LoadProgress table.
+If a run is interrupted, rerun with `--resume` to skip completed units rather than
+flushing the database.
+
+Use `--defer-constraints` to build the PathCount indexes and constraints once
+after the load rather than maintaining them for every inserted row.
+
+Use `--node-source=hetnet` to load nodes from the Hetionet JSON rather than neo4j.
+Node ids are taken from a neo4j id map, passed with `--node-id-map` or written
+to the downloads directory by an earlier load from neo4j.
+
+Use `--read-archives-in-place` to read DWPC matrices and degree-grouped
+permutations from the Zenodo archives without extracting them to disk.
+
+After PathCount is loaded, the NodePairMetapaths table is built from it to
+serve the metapaths endpoint with a single read per node pair. The NodeConnection
+table ranks the nodes connected to each node for the connections endpoint.
+
+Each completed load records a new DatasetVersion, which retires API responses
+cached for the previous data, and saves the random node pair sampler for that
+version to NODE_PAIR_SAMPLER_PATH. Run warm_response_cache afterwards to prefill
+the cache with popular URLs.
 """
 
+import collections
+import concurrent.futures
 import functools
 import hashlib
+import itertools
+import json
+import multiprocessing
 import pathlib
+import time
 import zipfile
-from urllib.request import urlretrieve
 from typing import Dict, NamedTuple, Iterable, Tuple
 
 import hetnetpy.readwrite
@@ -20,7 +51,8 @@ import hetmatpy.hetmat
 import hetmatpy.pipeline
 import pandas
 import requests
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, transaction
 from hetmatpy.hetmat.archive import load_archive
 
 import dj_hetmech_app.models as hetmech_models
@@ -28,11 +60,26 @@ from dj_hetmech_app.utils import (
     get_neo4j_driver,
     timed,
 )
+from dj_hetmech_app.utils.archives import ZipHetMat
+from dj_hetmech_app.utils.cache import bump_dataset_version
+from dj_hetmech_app.utils.downloads import download_file, download_files
+from dj_hetmech_app.utils.loading import (
+    bulk_create_rows,
+    copy_dataframe,
+    copy_rows,
+    drop_constraints,
+    get_deferrable_constraints,
+    report_throughput,
+    restore_constraints,
+)
+from dj_hetmech_app.utils.sampling import save_node_pair_sampler
 
 
 class Command(BaseCommand):
 
     help = 'Populate the database with Hetionet information'
+    zenodo_url = 'https://zenodo.org'
+    github_url = 'https://github.com'
     download_dir = pathlib.Path(__file__).parent.joinpath('downloads')
     hetmat_path = download_dir / 'hetionet-v1.0.hetmat'
 
@@ -54,6 +101,13 @@ class Command(BaseCommand):
     def _hetionet_hetmat(self):
         if not self.hetmat_path.exists():
             self._download_hetionet_hetmat()
+        if self.options.get('read_archives_in_place'):
+            archive_paths = [
+                self.download_dir.joinpath('zenodo', '1435834', archive)
+                for length in range(1, 1 + self.options['max_metapath_length'])
+                for archive in self._path_count_archives(length)
+            ]
+            return ZipHetMat(self.hetmat_path, archive_paths)
         return hetmatpy.hetmat.HetMat(self.hetmat_path)
 
     @property
@@ -74,15 +128,16 @@ class Command(BaseCommand):
         """
         return hetmech_models.Metanode.objects.get(identifier=identifier)
 
-    @functools.lru_cache(maxsize=10_000)
-    def _get_node(self, metanode, identifier):
+    @functools.lru_cache()
+    def _get_node_id_map(self, metanode):
         """
-        Return the Django node object.
+        Return a pandas.Series from node identifier to Node.id for a metanode.
         """
-        return hetmech_models.Node.objects.get(
-            metanode=self._get_metanode(metanode),
-            identifier=str(identifier),
+        node_df = pandas.DataFrame.from_records(
+            hetmech_models.Node.objects.filter(metanode=metanode).values_list('identifier', 'id'),
+            columns=['identifier', 'id'],
         )
+        return node_df.set_index('identifier')['id']
 
     @functools.lru_cache(maxsize=10_000)
     def _get_metapath(self, abbreviation):
@@ -91,17 +146,96 @@ class Command(BaseCommand):
         """
         return hetmech_models.Metapath.objects.get(abbreviation=abbreviation)
 
-    @functools.lru_cache(maxsize=10_000)
-    def _get_dgp(self, metapath, source_degree, target_degree):
+    def _get_dgp_id_df(self, metapath):
         """
-        Return the Django metapath object.
+        Return a DataFrame with source_degree, target_degree, and dgp_id columns
+        for the DegreeGroupedPermutation rows of a metapath.
         """
-        return hetmech_models.DegreeGroupedPermutation.objects.get(
-            metapath=self._get_metapath(str(metapath)),
-            source_degree=source_degree,
-            target_degree=target_degree,
+        return pandas.DataFrame.from_records(
+            hetmech_models.DegreeGroupedPermutation.objects
+            .filter(metapath=metapath)
+            .values_list('source_degree', 'target_degree', 'id'),
+            columns=['source_degree', 'target_degree', 'dgp_id'],
         )
 
+    def _run_stage(self, stage, func, *args, cleanup=None):
+        """
+        Run func(*args) as a unit of the load inside a transaction and record
+        its completion in the LoadProgress table. With --resume, completed stages
+        are skipped and cleanup (if specified) is called inside the transaction
+        to remove rows left by an earlier partial run. Returns the result of func,
+        or None if the stage was skipped.
+        """
+        if self.options['resume'] and hetmech_models.LoadProgress.objects.filter(stage=stage).exists():
+            print(f'skipping completed stage {stage}')
+            return None
+        with transaction.atomic():
+            if self.options['resume'] and cleanup is not None:
+                cleanup()
+            result = func(*args)
+            hetmech_models.LoadProgress.objects.update_or_create(stage=stage)
+        return result
+
+    def _write_rows(self, model, rows):
+        """
+        Write rows, which are dictionaries keyed by field attname, to the table
+        for model using the loader specified by --loader. Returns the number of
+        rows written and records throughput for the end-of-run report.
+        """
+        writer = copy_rows if self.options['loader'] == 'copy' else bulk_create_rows
+        start = time.perf_counter()
+        n_rows = writer(model, rows, batch_size=self.options['batch_size'])
+        self._throughput[model.__name__] += collections.Counter(
+            rows=n_rows, seconds=time.perf_counter() - start)
+        return n_rows
+
+    def _write_dataframe(self, model, df):
+        """
+        Write a DataFrame, whose columns are field attnames, to the table for
+        model using the loader specified by --loader. Missing values become
+        NULL for nullable fields and stay NaN otherwise, as with copy_dataframe.
+        """
+        if self.options['loader'] == 'copy':
+            start = time.perf_counter()
+            n_rows = copy_dataframe(model, df)
+            self._throughput[model.__name__] += collections.Counter(
+                rows=n_rows, seconds=time.perf_counter() - start)
+            return n_rows
+        nullable = [name for name in df.columns if model._meta.get_field(name).null]
+        df = df.astype({name: object for name in nullable})
+        df[nullable] = df[nullable].where(df[nullable].notna(), None)
+        return self._write_rows(model, df.to_dict(orient='records'))
+
+    def _defer_constraints(self, model):
+        """
+        Drop the indexes and unique and foreign key constraints of the table
+        for model before a bulk load. Their definitions are saved to a manifest,
+        so they can be rebuilt by a --resume run if this run is interrupted.
+        """
+        manifest_path = self.download_dir.joinpath(f'deferred-constraints_{model._meta.db_table}.json')
+        if manifest_path.exists():
+            return
+        constraints = get_deferrable_constraints(model)
+        manifest_path.parent.mkdir(parents=True, exist_ok=True)
+        manifest_path.write_text(json.dumps(constraints, indent=2))
+        drop_constraints(model, constraints)
+
+    def _restore_constraints(self, model):
+        """
+        Rebuild the indexes and constraints dropped by _defer_constraints.
+        """
+        manifest_path = self.download_dir.joinpath(f'deferred-constraints_{model._meta.db_table}.json')
+        if not manifest_path.exists():
+            return
+        constraints = json.loads(manifest_path.read_text())
+        restore_constraints(model, constraints)
+        manifest_path.unlink()
+
+    def _report_throughput(self):
+        loader = self.options['loader']
+        for table, counter in self._throughput.items():
+            report_throughput(f'{table} ({loader})', counter['rows'], counter['seconds'])
+
     def _populate_metanode_table(self):
         path = self.github_download(
             repo='hetio/hetionet',
@@ -198,7 +332,25 @@ class Command(BaseCommand):
 
     def _populate_node_table(self):
         """
-        Pulls nodes from neo4j as per https://github.com/greenelab/connectivity-search-backend/issues/36
+        Populate node table from the source specified by --node-source. Node ids
+        are neo4j ids as per https://github.com/greenelab/connectivity-search-backend/issues/36.
+        After loading, the neo4j id map is written for subsequent offline loads.
+        """
+        if self.options['node_source'] == 'hetnet':
+            rows = self._iter_hetnet_node_rows()
+        else:
+            rows = self._iter_neo4j_node_rows()
+        self._write_rows(hetmech_models.Node, rows)
+        if not self.neo4j_node_id_map_path.exists():
+            node_id_df = pandas.DataFrame.from_records(
+                hetmech_models.Node.objects.order_by('id').values_list('id', 'metanode', 'identifier'),
+                columns=['neo4j_id', 'metanode', 'identifier'],
+            )
+            node_id_df.to_csv(self.neo4j_node_id_map_path, sep='\t', index=False)
+
+    def _iter_neo4j_node_rows(self):
+        """
+        Stream node rows from neo4j.
         """
         metagraph = self._hetionet_metagraph
         query = '''
@@ -211,69 +363,111 @@ class Command(BaseCommand):
         '''
         driver = get_neo4j_driver()
         with driver.session() as session:
-            results = session.run(query)
-            results = [dict(result) for result in results]
-            objs = list()
-            for result in results:
-                properties = result['node_properties']
+            for result in session.run(query):
+                properties = dict(result['node_properties'])
                 identifier = properties.pop('identifier')
                 metanode = metagraph.get_metanode(result['node_label'])
-                objs.append(hetmech_models.Node(
+                yield dict(
                     id=result['neo4j_id'],
-                    metanode=self._get_metanode(metanode.identifier),
+                    metanode_id=metanode.identifier,
                     identifier=str(identifier),
                     identifier_type=identifier.__class__.__name__,
                     name=properties.pop('name'),
                     properties=properties,
-                ))
-                if len(objs) >= self.options['batch_size']:
-                    hetmech_models.Node.objects.bulk_create(objs)
-                    objs = list()
-        hetmech_models.Node.objects.bulk_create(objs)
+                )
+
+    def _iter_hetnet_node_rows(self):
+        """
+        Stream node rows from the Hetionet JSON without contacting neo4j.
+        Node properties are the node data from the JSON, which is what the
+        Hetionet neo4j database was built from.
+        """
+        neo4j_ids = self._get_neo4j_node_id_map()
+        for node in self._hetionet_graph.get_nodes():
+            metanode = node.metanode.identifier
+            identifier = node.identifier
+            yield dict(
+                id=neo4j_ids[metanode, str(identifier)],
+                metanode_id=metanode,
+                identifier=str(identifier),
+                identifier_type=identifier.__class__.__name__,
+                name=node.name,
+                properties=dict(node.data),
+            )
+
+    @property
+    def neo4j_node_id_map_path(self):
+        return self.options['node_id_map'] or self.download_dir.joinpath('hetionet-v1.0_neo4j-node-ids.tsv')
+
+    def _get_neo4j_node_id_map(self):
+        """
+        Return a dictionary of (metanode, identifier) to neo4j node id. The map
+        is read from a TSV with neo4j_id, metanode, and identifier columns,
+        which --node-source=hetnet requires so that it never contacts neo4j.
+        """
+        path = self.neo4j_node_id_map_path
+        if not path.exists():
+            raise CommandError(
+                f'--node-source=hetnet requires the neo4j node id map at {path}. '
+                'Pass it with --node-id-map, or run a load with --node-source=neo4j, which writes it.'
+            )
+        node_id_df = pandas.read_csv(path, sep='\t', dtype={'identifier': str})
+        return dict(zip(zip(node_id_df.metanode, node_id_df.identifier), node_id_df.neo4j_id))
 
     def _populate_degree_grouped_permutation_table(self, length):
         """
         Populate DGP table from https://zenodo.org/record/1435834
+        Zip members are parsed by --workers processes and each metapath's
+        DataFrame is written to the database without per-row python objects.
         """
         assert isinstance(length, int)
         filename = f'degree-grouped-perms_length-{length}_damping-0.5.zip'
         path = self.zenodo_download('1435834', filename)
         with zipfile.ZipFile(path) as zip_file:
-            for zip_path in zip_file.namelist():
-                metapath, _ = pathlib.Path(zip_path).name.split('.', 1)
-                if not self._keep_metapath(metapath):
-                    continue
-                metapath_key = self._get_metapath(metapath)
-                with zip_file.open(zip_path) as tsv_file:
-                    dgp_df = pandas.read_csv(tsv_file, sep='\t', compression='gzip')
-                dgp_df = hetmatpy.pipeline.add_gamma_hurdle_to_dgp_df(dgp_df)
-                objs = list()
-                for row in dgp_df.itertuples():
-                    objs.append(hetmech_models.DegreeGroupedPermutation(
-                        metapath=metapath_key,
-                        source_degree=row.source_degree,
-                        target_degree=row.target_degree,
-                        n_dwpcs=row.n,
-                        n_nonzero_dwpcs=row.nnz,
-                        nonzero_mean=row.mean_nz,
-                        nonzero_sd=row.sd_nz,
-                    ))
-                    if len(objs) >= self.options['batch_size']:
-                        hetmech_models.DegreeGroupedPermutation.objects.bulk_create(objs)
-                        objs = list()
-                hetmech_models.DegreeGroupedPermutation.objects.bulk_create(objs)
+            zip_paths = [
+                zip_path for zip_path in zip_file.namelist()
+                if self._keep_metapath(pathlib.Path(zip_path).name.split('.', 1)[0])
+            ]
+        n_workers = min(self.options['workers'], len(zip_paths))
+        if n_workers <= 1:
+            dgp_dfs = map(read_degree_grouped_permutations, itertools.repeat(path), zip_paths)
+            self._write_degree_grouped_permutations(zip_paths, dgp_dfs)
+            return
+        # Workers only parse archive members, so the parent keeps its connection
+        # and open transaction and performs all writes.
+        with concurrent.futures.ProcessPoolExecutor(
+                max_workers=n_workers,
+                mp_context=multiprocessing.get_context('fork')) as executor:
+            dgp_dfs = executor.map(read_degree_grouped_permutations, itertools.repeat(path), zip_paths)
+            self._write_degree_grouped_permutations(zip_paths, dgp_dfs)
 
-    def _download_path_counts(self, length):
+    def _write_degree_grouped_permutations(self, zip_paths, dgp_dfs):
+        for zip_path, dgp_df in zip(zip_paths, dgp_dfs):
+            metapath, _ = pathlib.Path(zip_path).name.split('.', 1)
+            dgp_df.insert(0, 'metapath_id', self._get_metapath(metapath).pk)
+            self._write_dataframe(hetmech_models.DegreeGroupedPermutation, dgp_df)
+
+    @staticmethod
+    def _path_count_archives(length):
         """
-        Populate path count table from https://zenodo.org/record/1435834
+        Return the filenames of the Zenodo archives with path count information
+        for metapaths of the specified length.
         """
-        archives = [
+        return [
             f'degree-grouped-perms_length-{length}_damping-0.5.zip',
             f'dwpcs_length-{length}_damping-0.0.zip',
             f'dwpcs_length-{length}_damping-0.5.zip',
         ]
-        for archive in archives:
+
+    def _download_path_counts(self, length):
+        """
+        Populate path count table from https://zenodo.org/record/1435834
+        With --read-archives-in-place, archives are downloaded but not extracted.
+        """
+        for archive in self._path_count_archives(length):
             path = self.zenodo_download('1435834', archive)
+            if self.options['read_archives_in_place']:
+                continue
             with zipfile.ZipFile(path) as zip_file:
                 members = zip_file.namelist()
             source_paths = list()
@@ -285,10 +479,12 @@ class Command(BaseCommand):
 
     def _populate_path_count_table(self):
         """
-        Populate path count table.
+        Populate path count table. With --workers greater than 1, metapaths are
+        spread over a pool of worker processes, each with its own database
+        connection and hetmat. Metapaths are scheduled in order of decreasing
+        path count density, so the slowest metapaths start first.
         """
-        hetmat = self._hetionet_hetmat
-        metapaths = (
+        metapaths_with_dgp = (
             hetmech_models
             .DegreeGroupedPermutation
             .objects
@@ -296,31 +492,192 @@ class Command(BaseCommand):
             .distinct()
             .order_by()
         )
-        for metapath in metapaths:
-            metapath = self._hetionet_metagraph.metapath_from_abbrev(metapath)
-            metapath_record = self._get_metapath(metapath)
-            rows = hetmatpy.pipeline.combine_dwpc_dgp(
-                graph=hetmat,
-                metapath=metapath,
-                damping=0.5,
-                ignore_zeros=True,
-                max_p_value=metapath_record.p_threshold,
+        metapaths = list(
+            hetmech_models.Metapath.objects
+            .filter(abbreviation__in=metapaths_with_dgp)
+            .order_by('-path_count_density')
+            .values_list('abbreviation', flat=True)
+        )
+        if self.options['resume']:
+            completed = set(
+                hetmech_models.LoadProgress.objects
+                .filter(stage__startswith='path_counts_')
+                .values_list('stage', flat=True)
+            )
+            metapaths = [x for x in metapaths if f'path_counts_{x}' not in completed]
+            # Remove rows of unfinished metapaths with a single statement, since
+            # the metapath index may be dropped by --defer-constraints
+            (
+                hetmech_models.PathCount.objects
+                .filter(metapath__in=metapaths)
+                .delete()
+            )
+        n_workers = self.options['workers']
+        if n_workers <= 1:
+            for metapath in metapaths:
+                self._populate_path_count_unit(metapath)
+            return
+        # Close connections before forking so workers do not share the parent's socket
+        connections.close_all()
+        start = time.perf_counter()
+        n_rows = 0
+        with concurrent.futures.ProcessPoolExecutor(
+                max_workers=n_workers,
+                mp_context=multiprocessing.get_context('fork'),
+                initializer=_initialize_worker,
+                initargs=(type(self), self._get_worker_attributes())) as executor:
+            for n_metapath_rows in executor.map(_populate_path_count_unit, metapaths):
+                n_rows += n_metapath_rows or 0
+        self._throughput['PathCount'] += collections.Counter(
+            rows=n_rows, seconds=time.perf_counter() - start)
+
+    def _get_worker_attributes(self):
+        """
+        Return the attributes that configure a worker's Command.
+        """
+        return {
+            'options': self.options,
+            'download_dir': self.download_dir,
+            'hetmat_path': self.hetmat_path,
+        }
+
+    def _populate_path_count_unit(self, metapath):
+        """
+        Populate path count table for a single metapath as a resumable stage.
+        Rows left by an earlier partial run are removed by _populate_path_count_table.
+        """
+        return self._run_stage(f'path_counts_{metapath}', self._populate_path_count_metapath, metapath)
+
+    def _populate_path_count_metapath(self, metapath):
+        """
+        Populate path count table for a single metapath.
+        Rows are stored by canonical node pair, with inverted set when the
+        metapath runs from node_high to node_low. Returns the number of rows written.
+        """
+        metapath = self._hetionet_metagraph.metapath_from_abbrev(metapath)
+        metapath_record = self._get_metapath(metapath)
+        rows = hetmatpy.pipeline.combine_dwpc_dgp(
+            graph=self._hetionet_hetmat,
+            metapath=metapath,
+            damping=0.5,
+            ignore_zeros=True,
+            max_p_value=metapath_record.p_threshold,
+        )
+        source_ids = self._get_node_id_map(metapath.source().identifier)
+        target_ids = self._get_node_id_map(metapath.target().identifier)
+        dgp_id_df = self._get_dgp_id_df(metapath_record)
+        columns = [
+            'metapath_id', 'node_low_id', 'node_high_id', 'inverted', 'dgp_id',
+            'path_count', 'dwpc', 'p_value', 'adjusted_p_value',
+        ]
+        n_rows = 0
+        chunks = iter(lambda: list(itertools.islice(rows, self.options['batch_size'])), [])
+        for chunk in chunks:
+            df = pandas.DataFrame.from_records(chunk)
+            df['metapath_id'] = metapath_record.pk
+            df['source_id'] = df.source_id.astype(str).map(source_ids)
+            df['target_id'] = df.target_id.astype(str).map(target_ids)
+            df = df.merge(dgp_id_df, how='left', on=['source_degree', 'target_degree'])
+            missing = df[['source_id', 'target_id', 'dgp_id']].isna().any(axis=1)
+            if missing.any():
+                raise ValueError(
+                    f'{missing.sum():,} {metapath} rows could not be matched to '
+                    f'Node or DegreeGroupedPermutation ids:\n{df[missing].head()}'
+                )
+            for column in 'source_id', 'target_id', 'dgp_id':
+                df[column] = df[column].astype(int)
+            df['inverted'] = df.source_id > df.target_id
+            df['node_low_id'] = df[['source_id', 'target_id']].min(axis=1)
+            df['node_high_id'] = df[['source_id', 'target_id']].max(axis=1)
+            df['adjusted_p_value'] = (df.p_value * metapath_record.n_similar).clip(upper=1.0)
+            n_rows += self._write_dataframe(hetmech_models.PathCount, df[columns])
+        return n_rows
+
+    def _populate_node_pair_metapaths_table(self):
+        """
+        Populate NodePairMetapaths from the PathCount table with a single
+        INSERT ... SELECT that aggregates the PathCount values of each node
+        pair, in the order of node_pair_metapath_lookups, into a JSON array
+        sorted by adjusted p-value, p-value, and metapath.
+        """
+        from django.db import connection
+        from dj_hetmech_app.serializers import node_pair_metapath_lookups
+        quote = connection.ops.quote_name
+        pathcount_table = quote(hetmech_models.PathCount._meta.db_table)
+        dgp_table = quote(hetmech_models.DegreeGroupedPermutation._meta.db_table)
+        pair_table = quote(hetmech_models.NodePairMetapaths._meta.db_table)
+        columns = []
+        for lookup in node_pair_metapath_lookups:
+            model, alias, name = hetmech_models.PathCount, 'pathcount', lookup.split('__')[0]
+            if lookup.startswith('dgp__'):
+                model, alias, name = hetmech_models.DegreeGroupedPermutation, 'dgp', lookup[len('dgp__'):]
+            column = f'{alias}.{quote(model._meta.get_field(name).column)}'
+            if lookup in {'dgp__nonzero_mean', 'dgp__nonzero_sd'}:
+                # Replace nan with null. https://github.com/greenelab/connectivity-search-backend/issues/63
+                column = f"NULLIF({column}, 'NaN')"
+            columns.append(column)
+        sql = f"""
+        INSERT INTO {pair_table} (node_low_id, node_high_id, n_metapaths, metapaths)
+        SELECT
+            pathcount.node_low_id,
+            pathcount.node_high_id,
+            count(*),
+            jsonb_agg(
+                jsonb_build_array({', '.join(columns)})
+                ORDER BY pathcount.adjusted_p_value, pathcount.p_value, pathcount.metapath_id
             )
-            objs = list()
-            for row in rows:
-                objs.append(hetmech_models.PathCount(
-                    metapath=metapath_record,
-                    source=self._get_node(metapath.source().identifier, row['source_id']),
-                    target=self._get_node(metapath.target().identifier, row['target_id']),
-                    dgp=self._get_dgp(str(metapath), row['source_degree'], row['target_degree']),
-                    path_count=row['path_count'],
-                    dwpc=row['dwpc'],
-                    p_value=row['p_value'],
-                ))
-                if len(objs) >= self.options['batch_size']:
-                    hetmech_models.PathCount.objects.bulk_create(objs)
-                    objs = list()
-            hetmech_models.PathCount.objects.bulk_create(objs)
+        FROM {pathcount_table} AS pathcount
+        JOIN {dgp_table} AS dgp ON dgp.id = pathcount.dgp_id
+        GROUP BY pathcount.node_low_id, pathcount.node_high_id
+        """
+        start = time.perf_counter()
+        with transaction.atomic(), connection.cursor() as cursor:
+            # Convert floats to JSON without losing precision on PostgreSQL 11 and earlier
+            cursor.execute('SET LOCAL extra_float_digits = 3')
+            cursor.execute(sql)
+            n_rows = cursor.rowcount
+        self._throughput['NodePairMetapaths'] += collections.Counter(
+            rows=n_rows, seconds=time.perf_counter() - start)
+
+    def _populate_node_connection_table(self):
+        """
+        Populate NodeConnection from the PathCount table with a single
+        INSERT ... SELECT that aggregates each node pair once and writes it
+        from both of its nodes.
+        """
+        from django.db import connection
+        quote = connection.ops.quote_name
+        pathcount_table = quote(hetmech_models.PathCount._meta.db_table)
+        node_table = quote(hetmech_models.Node._meta.db_table)
+        connection_table = quote(hetmech_models.NodeConnection._meta.db_table)
+        sql = f"""
+        INSERT INTO {connection_table}
+            (node_id, other_node_id, other_metanode_id, n_metapaths, min_adjusted_p_value, score)
+        WITH pairs AS (
+            SELECT
+                node_low_id,
+                node_high_id,
+                count(*) AS n_metapaths,
+                min(adjusted_p_value) AS min_adjusted_p_value,
+                coalesce(sum(-log(greatest(adjusted_p_value, 1e-300))), 0) AS score
+            FROM {pathcount_table}
+            GROUP BY node_low_id, node_high_id
+        )
+        SELECT pairs.node_low_id, pairs.node_high_id, node.metanode_id,
+            n_metapaths, min_adjusted_p_value, score
+        FROM pairs JOIN {node_table} AS node ON node.id = pairs.node_high_id
+        UNION ALL
+        SELECT pairs.node_high_id, pairs.node_low_id, node.metanode_id,
+            n_metapaths, min_adjusted_p_value, score
+        FROM pairs JOIN {node_table} AS node ON node.id = pairs.node_low_id
+        WHERE pairs.node_low_id <> pairs.node_high_id
+        """
+        start = time.perf_counter()
+        with connection.cursor() as cursor:
+            cursor.execute(sql)
+            n_rows = cursor.rowcount
+        self._throughput['NodeConnection'] += collections.Counter(
+            rows=n_rows, seconds=time.perf_counter() - start)
 
     def add_arguments(self, parser):
         parser.add_argument(
@@ -337,53 +694,117 @@ class Command(BaseCommand):
             help='max number of objects to write to the database at a time '
                  '(default 5000)',
         )
+        parser.add_argument(
+            '--loader', choices=['bulk_create', 'copy'], default='bulk_create',
+            help='method for writing the Node, DegreeGroupedPermutation, and PathCount tables. '
+                 'bulk_create (default) uses the Django ORM. '
+                 'copy streams CSV to PostgreSQL with COPY ... FROM STDIN.',
+        )
+        parser.add_argument(
+            '--workers', type=int, default=1,
+            help='number of worker processes for populating the PathCount table, '
+                 'which computes metapaths in parallel, and for parsing '
+                 'degree-grouped permutation archives (default 1)',
+        )
+        parser.add_argument(
+            '--resume', action='store_true',
+            help='skip stages recorded as complete in the LoadProgress table by a previous run. '
+                 'Path counts for a partially loaded metapath are deleted and reloaded.',
+        )
+        parser.add_argument(
+            '--node-source', choices=['neo4j', 'hetnet'], default='neo4j',
+            help='source for the Node table. neo4j (default) queries the Hetionet neo4j database. '
+                 'hetnet reads the Hetionet JSON and takes node ids from the neo4j id map.',
+        )
+        parser.add_argument(
+            '--node-id-map', type=pathlib.Path,
+            help='TSV with neo4j_id, metanode, and identifier columns for --node-source=hetnet. '
+                 'Defaults to a file in the downloads directory, which is written by loads with --node-source=neo4j.',
+        )
+        parser.add_argument(
+            '--read-archives-in-place', action='store_true',
+            help='read DWPC matrices and degree-grouped permutations directly from the Zenodo archives '
+                 'rather than extracting them into the hetmat directory.',
+        )
+        parser.add_argument(
+            '--download-threads', type=int, default=4,
+            help='number of Zenodo archives to download concurrently (default 4)',
+        )
+        parser.add_argument(
+            '--defer-constraints', action='store_true',
+            help='drop the indexes and unique and foreign key constraints of the PathCount table '
+                 'before loading it and rebuild them afterwards, followed by ANALYZE.',
+        )
 
     def handle(self, *args, **options):
         # Load configuration
         self.options = options
-        # Download hetmat
+        self._throughput = collections.defaultdict(collections.Counter)
+        if options['node_source'] == 'hetnet' and not self.neo4j_node_id_map_path.exists():
+            # Fail before downloading rather than when the node table is loaded
+            self._get_neo4j_node_id_map()
+        # Download hetmat and path count archives
         self._download_hetionet_hetmat()
         self._hetionet_metagraph
+        timed(self._prefetch_path_count_archives)()
         # Populate tables
-        timed(self._populate_metanode_table)()
-        timed(self._populate_node_table)()
-        timed(self._populate_metapath_table)()
+        self._run_stage('metanodes', timed(self._populate_metanode_table))
+        self._run_stage('nodes', timed(self._populate_node_table))
+        self._run_stage('metapaths', timed(self._populate_metapath_table))
         for length in range(1, 1 + options['max_metapath_length']):
-            timed(self._download_path_counts)(length)
-            timed(self._populate_degree_grouped_permutation_table)(length)
+            self._run_stage(f'download_path_counts_length-{length}', timed(self._download_path_counts), length)
+            self._run_stage(f'dgp_length-{length}', timed(self._populate_degree_grouped_permutation_table), length)
+        if options['defer_constraints']:
+            self._defer_constraints(hetmech_models.PathCount)
         timed(self._populate_path_count_table)()
+        self._restore_constraints(hetmech_models.PathCount)
+        self._run_stage(
+            'node_pair_metapaths', timed(self._populate_node_pair_metapaths_table),
+            cleanup=hetmech_models.NodePairMetapaths.objects.all().delete,
+        )
+        self._run_stage(
+            'node_connections', timed(self._populate_node_connection_table),
+            cleanup=hetmech_models.NodeConnection.objects.all().delete,
+        )
+        self._report_throughput()
+        # Retire API responses cached for the previous data
+        version = bump_dataset_version()
+        print(f'dataset version {version}')
+        timed(save_node_pair_sampler)(version)
 
-    @staticmethod
+    @classmethod
     @functools.lru_cache()
-    def zenodo_checksums(record_id: str) -> Dict[str, str]:
+    def zenodo_checksums(cls, record_id: str) -> Dict[str, str]:
         """
         Return a dictionary of filename to md5 checksum for a zenodo record.
         Values are like 'md5:81043d9c041c7a98364f398139a01edf'.
         """
-        url = f"https://zenodo.org/api/records/{record_id}"
+        url = f"{cls.zenodo_url}/api/records/{record_id}"
         response = requests.get(url)
         response.raise_for_status()
         results = response.json()
         return {info["key"]: info["checksum"] for info in results["files"]}
 
+    @functools.lru_cache()
     def zenodo_download(self, record_id, filename):
         """
         Download a file from a Zenodo record and return the path to the
         download location. If a file already exists at the specified path,
         do not re-download. Even if file exists, verify its integrity via
-        its md5 checksum.
-        Note this can fail with a ContentTooShortError on a poor connection
+        its md5 checksum. Downloads compute the checksum while streaming and
+        resume after a failure, such as a ContentTooShortError on a poor connection
         https://github.com/greenelab/connectivity-search-backend/issues/77
+        Results are cached, so each file is verified once per run.
         """
         record_id = str(record_id)
         checksums = self.zenodo_checksums(record_id)
         path = self.download_dir.joinpath('zenodo', record_id, filename)
-        if not path.exists():
-            path.parent.mkdir(parents=True, exist_ok=True)
-            url = f'https://zenodo.org/record/{record_id}/files/{filename}'
-            urlretrieve(url, path)
-        checksum = f"md5:{self.md5_hex_digest(path)}"
         expected = checksums[filename]
+        if path.exists():
+            checksum = f"md5:{self.md5_hex_digest(path)}"
+        else:
+            url = f'{self.zenodo_url}/record/{record_id}/files/{filename}'
+            checksum = f"md5:{download_file(url, path)}"
         if checksum != expected:
             raise ValueError(
                 f"Expected checksum of {expected}, calculated {checksum}. "
@@ -399,7 +820,7 @@ class Command(BaseCommand):
         """
         with path.open(mode="rb") as read_file:
             file_hash = hashlib.md5()
-            while chunk := read_file.read(8192):
+            while chunk := read_file.read(2 ** 20):
                 file_hash.update(chunk)
         return file_hash.hexdigest()
 
@@ -418,7 +839,65 @@ class Command(BaseCommand):
             *path.split('/'),
         )
         if not local_path.exists():
-            local_path.parent.mkdir(parents=True, exist_ok=True)
-            url = f'https://github.com/{repo}/raw/{commit}/{path}'
-            urlretrieve(url, local_path)
+            url = f'{self.github_url}/{repo}/raw/{commit}/{path}'
+            download_file(url, local_path)
         return local_path
+
+    def _prefetch_path_count_archives(self):
+        """
+        Download the Zenodo archives for every metapath length concurrently,
+        using --download-threads threads.
+        """
+        args_list = [
+            ('1435834', archive)
+            for length in range(1, 1 + self.options['max_metapath_length'])
+            for archive in self._path_count_archives(length)
+        ]
+        download_files(self.zenodo_download, args_list, n_threads=self.options['download_threads'])
+
+
+def read_degree_grouped_permutations(path, zip_path):
+    """
+    Read a degree-grouped permutation table from a zip archive member and
+    return a DataFrame whose columns are DegreeGroupedPermutation attnames
+    (except metapath_id). Computes the same nonzero mean and standard deviation
+    as hetmatpy.pipeline.add_gamma_hurdle_to_dgp_df, but with column operations
+    rather than a row-wise apply. Degree groups with fewer than two nonzero
+    DWPCs have a missing standard deviation.
+    """
+    with zipfile.ZipFile(path) as zip_file, zip_file.open(zip_path) as tsv_file:
+        dgp_df = pandas.read_csv(tsv_file, sep='\t', compression='gzip')
+    nnz = dgp_df['nnz'].astype(float)
+    mean_nz = dgp_df['sum'] / nnz
+    squared_deviations = dgp_df['sum_of_squares'] - dgp_df['sum'] ** 2 / nnz
+    squared_deviations = squared_deviations.mask(
+        squared_deviations.abs() < hetmatpy.pipeline.FLOAT_ERROR_TOLERANCE, 0.0)
+    sd_nz = (squared_deviations / (nnz - 1)).pow(0.5).where(nnz >= 2)
+    return pandas.DataFrame({
+        'source_degree': dgp_df['source_degree'],
+        'target_degree': dgp_df['target_degree'],
+        'n_dwpcs': dgp_df['n'],
+        'n_nonzero_dwpcs': dgp_df['nnz'],
+        'nonzero_mean': mean_nz,
+        'nonzero_sd': sd_nz,
+    })
+
+
+# Command instance for a PathCount worker process, set by _initialize_worker
+_worker_command = None
+
+
+def _initialize_worker(command_class, attributes):
+    """
+    Initialize a worker process for populating the PathCount table. Each worker
+    has its own Command and therefore its own hetmat handle and lookup caches.
+    Database connections are opened lazily per process.
+    """
+    global _worker_command
+    _worker_command = command_class()
+    vars(_worker_command).update(attributes)
+    _worker_command._throughput = collections.defaultdict(collections.Counter)
+
+
+def _populate_path_count_unit(metapath):
+    return _worker_command._populate_path_count_unit(metapath)
@@ -14,6 +14,12 @@ class Command(BaseCommand):
 
     help = 'Call dj_hetmech_app.utils.paths.get_paths for prototyping purposes.'
 
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--engine', choices=['neo4j', 'hetmat'],
+            help='path engine to use (default settings.PATHS_ENGINE).',
+        )
+
     def handle(self, *args, **options):
         source_node = Node.objects.get(metanode='Compound', identifier='DB01156')  # Bupropion
         target_node = Node.objects.get(metanode='Disease', identifier='DOID:0050742')  # nicotine dependency
@@ -23,6 +29,7 @@ class Command(BaseCommand):
             source_id=source_node.id, 
             target_id=target_node.id,  
             limit=100,
+            engine=options['engine'],
         )
         json_str = json.dumps(json_obj, indent=2)
         print(json_str)
@@ -0,0 +1,79 @@
+import sys
+import time
+import urllib.parse
+
+import requests
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client
+
+from dj_hetmech_app.utils.cache import get_response_cache, get_response_cache_stats, is_shared_cache
+
+
+class Command(BaseCommand):
+
+    help = (
+        'Prefill the API response cache by requesting a list of URLs, '
+        'such as the most popular URLs from the server access logs.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'url_file',
+            help='file with one URL path per line, like /v1/metapaths/source/17054/target/6602/. '
+                 'Use - to read from stdin. Blank lines and lines starting with # are ignored.',
+        )
+        parser.add_argument(
+            '--base-url',
+            help='request URLs from a running server, such as http://localhost:8000, '
+                 'rather than in this process. Required for per-process cache backends, '
+                 'such as the default ByteLimitedLocMemCache, to warm the server processes.',
+        )
+
+    def handle(self, *args, **options):
+        cache = get_response_cache()
+        if options['base_url'] is None and cache is None:
+            raise CommandError('response caching is disabled by RESPONSE_CACHE_ALIAS')
+        if options['base_url'] is None and not is_shared_cache(cache):
+            self.stderr.write(
+                'The response cache backend is per process, so responses cached by this command '
+                'are not served by the server processes, and its counters only cover this command. '
+                'Use --base-url or set response_cache in secrets.yml to a shared backend.'
+            )
+        if options['url_file'] == '-':
+            lines = sys.stdin.read().splitlines()
+        else:
+            with open(options['url_file']) as read_file:
+                lines = read_file.read().splitlines()
+        paths = [line.strip() for line in lines if line.strip() and not line.startswith('#')]
+        fetch = self._get_fetcher(options['base_url'])
+        start = time.perf_counter()
+        for path in paths:
+            status_code, cache_status = fetch(path)
+            print(f'{status_code} {cache_status} {path}')
+        seconds = time.perf_counter() - start
+        print(f'requested {len(paths):,} URLs in {seconds:.1f} seconds')
+        if options['base_url'] is None:
+            stats = get_response_cache_stats()
+            print(f"response cache: {stats['hits']:,} hits, {stats['misses']:,} misses")
+
+    @staticmethod
+    def _get_fetcher(base_url):
+        """
+        Return a function that requests a URL path and returns the status code
+        and X-Response-Cache header of the response, or its X-Paths-Cache
+        header for the paths endpoint.
+        """
+        if base_url is None:
+            client = Client(SERVER_NAME='localhost')
+
+            def fetch(path):
+                response = client.get(path)
+                return response.status_code, response.get('X-Response-Cache', response.get('X-Paths-Cache', '-'))
+        else:
+            session = requests.Session()
+
+            def fetch(path):
+                response = session.get(urllib.parse.urljoin(base_url, path))
+                headers = response.headers
+                return response.status_code, headers.get('X-Response-Cache', headers.get('X-Paths-Cache', '-'))
+        return fetch
@@ -0,0 +1,164 @@
+# Generated by Django 3.2.25 on 2026-10-17 03:26
+
+import django.contrib.postgres.fields.jsonb
+from django.db import migrations, models
+import django.db.models.deletion
+import django.db.models.expressions
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DatasetVersion',
+            fields=[
+                ('token', models.CharField(max_length=32, primary_key=True, serialize=False)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='DegreeGroupedPermutation',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('source_degree', models.PositiveIntegerField()),
+                ('target_degree', models.PositiveIntegerField()),
+                ('n_dwpcs', models.BigIntegerField()),
+                ('n_nonzero_dwpcs', models.BigIntegerField()),
+                ('nonzero_mean', models.FloatField()),
+                ('nonzero_sd', models.FloatField()),
+            ],
+        ),
+        migrations.CreateModel(
+            name='LoadProgress',
+            fields=[
+                ('stage', models.CharField(max_length=100, primary_key=True, serialize=False)),
+                ('completed', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Metanode',
+            fields=[
+                ('identifier', models.CharField(max_length=50, primary_key=True, serialize=False)),
+                ('abbreviation', models.CharField(max_length=10)),
+                ('n_nodes', models.PositiveIntegerField()),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Metapath',
+            fields=[
+                ('abbreviation', models.CharField(max_length=20, primary_key=True, serialize=False)),
+                ('name', models.CharField(max_length=200)),
+                ('length', models.PositiveSmallIntegerField()),
+                ('path_count_density', models.FloatField()),
+                ('path_count_mean', models.FloatField()),
+                ('path_count_max', models.PositiveIntegerField()),
+                ('dwpc_raw_mean', models.FloatField()),
+                ('n_similar', models.PositiveIntegerField()),
+                ('p_threshold', models.FloatField()),
+                ('source', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='metapath_source', to='dj_hetmech_app.metanode')),
+                ('target', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='metapath_target', to='dj_hetmech_app.metanode')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Node',
+            fields=[
+                ('id', models.IntegerField(primary_key=True, serialize=False)),
+                ('identifier', models.CharField(max_length=50)),
+                ('identifier_type', models.CharField(choices=[('str', 'string'), ('int', 'integer')], max_length=50)),
+                ('name', models.CharField(max_length=200)),
+                ('properties', django.contrib.postgres.fields.jsonb.JSONField(db_column='data')),
+                ('metanode', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, to='dj_hetmech_app.metanode')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='PathCount',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('inverted', models.BooleanField()),
+                ('path_count', models.PositiveIntegerField()),
+                ('dwpc', models.FloatField(verbose_name='degree-weighted path count with damping exponent of 0.5')),
+                ('p_value', models.FloatField(null=True)),
+                ('adjusted_p_value', models.FloatField(null=True, verbose_name='Bonferroni adjusted p-value, computed at load time')),
+                ('dgp', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, to='dj_hetmech_app.degreegroupedpermutation')),
+                ('metapath', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, to='dj_hetmech_app.metapath')),
+                ('node_high', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='path_high', to='dj_hetmech_app.node')),
+                ('node_low', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='path_low', to='dj_hetmech_app.node')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='NodePairMetapaths',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('n_metapaths', models.PositiveIntegerField()),
+                ('metapaths', django.contrib.postgres.fields.jsonb.JSONField()),
+                ('node_high', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='pair_high', to='dj_hetmech_app.node')),
+                ('node_low', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='pair_low', to='dj_hetmech_app.node')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='NodeConnection',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('n_metapaths', models.PositiveIntegerField()),
+                ('min_adjusted_p_value', models.FloatField(null=True)),
+                ('score', models.FloatField()),
+                ('node', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='connections', to='dj_hetmech_app.node')),
+                ('other_metanode', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='+', to='dj_hetmech_app.metanode')),
+                ('other_node', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='+', to='dj_hetmech_app.node')),
+            ],
+        ),
+        migrations.AddField(
+            model_name='degreegroupedpermutation',
+            name='metapath',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, to='dj_hetmech_app.metapath'),
+        ),
+        migrations.AddIndex(
+            model_name='pathcount',
+            index=models.Index(fields=['node_low', 'node_high', 'adjusted_p_value'], name='dj_hetmech__node_lo_7f5650_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='pathcount',
+            index=models.Index(fields=['node_high', 'node_low'], name='dj_hetmech__node_hi_a9b2dc_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='pathcount',
+            constraint=models.CheckConstraint(check=models.Q(('node_low__lte', django.db.models.expressions.F('node_high'))), name='pathcount_canonical_pair'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='pathcount',
+            unique_together={('metapath', 'node_low', 'node_high', 'inverted')},
+        ),
+        migrations.AlterUniqueTogether(
+            name='nodepairmetapaths',
+            unique_together={('node_low', 'node_high')},
+        ),
+        migrations.AddIndex(
+            model_name='nodeconnection',
+            index=models.Index(fields=['node', 'min_adjusted_p_value'], name='dj_hetmech__node_id_4aea5f_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='nodeconnection',
+            index=models.Index(fields=['node', '-score'], name='dj_hetmech__node_id_d14968_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='nodeconnection',
+            index=models.Index(fields=['other_node', '-n_metapaths', 'node'], name='dj_hetmech__other_n_e040a5_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='nodeconnection',
+            unique_together={('node', 'other_node')},
+        ),
+        migrations.AlterUniqueTogether(
+            name='node',
+            unique_together={('metanode', 'identifier')},
+        ),
+        migrations.AlterUniqueTogether(
+            name='degreegroupedpermutation',
+            unique_together={('metapath', 'source_degree', 'target_degree')},
+        ),
+    ]
@@ -75,22 +75,112 @@ class DegreeGroupedPermutation(models.Model):
 
 
 class PathCount(models.Model):
+    """
+    Path count information for a metapath between an unordered pair of nodes.
+    Pairs are stored in a canonical orientation, such that node_low has the
+    lower id. The metapath runs from node_low to node_high, unless inverted is
+    true, in which case it runs from node_high to node_low.
+    """
     metapath = models.ForeignKey(to='Metapath', on_delete=models.PROTECT)
-    source = models.ForeignKey(to='Node', on_delete=models.PROTECT, related_name='path_source')
-    target = models.ForeignKey(to='Node', on_delete=models.PROTECT, related_name='path_target')
+    node_low = models.ForeignKey(to='Node', on_delete=models.PROTECT, related_name='path_low')
+    node_high = models.ForeignKey(to='Node', on_delete=models.PROTECT, related_name='path_high')
+    inverted = models.BooleanField()
     dgp = models.ForeignKey(to='DegreeGroupedPermutation', on_delete=models.PROTECT)
     path_count = models.PositiveIntegerField()
     dwpc = models.FloatField(
         verbose_name='degree-weighted path count with damping exponent of 0.5'
     )
     p_value = models.FloatField(null=True)
+    adjusted_p_value = models.FloatField(
+        null=True,
+        verbose_name='Bonferroni adjusted p-value, computed at load time',
+    )
 
     class Meta:
-        unique_together = ('metapath', 'source', 'target')
+        # Asymmetric metapaths between nodes of the same metanode have distinct
+        # path counts in each orientation, so inverted is part of the unique key.
+        # Symmetric metapaths are written in a single orientation per pair.
+        unique_together = ('metapath', 'node_low', 'node_high', 'inverted')
         indexes = [
-            models.Index(fields=['source', 'target']),
+            # Serves pair lookups ordered by adjusted_p_value
+            models.Index(fields=['node_low', 'node_high', 'adjusted_p_value']),
+            models.Index(fields=['node_high', 'node_low']),
+        ]
+        constraints = [
+            models.CheckConstraint(check=models.Q(node_low__lte=models.F('node_high')), name='pathcount_canonical_pair'),
         ]
 
+    @property
+    def source_id(self):
+        return self.node_high_id if self.inverted else self.node_low_id
+
+    @property
+    def target_id(self):
+        return self.node_low_id if self.inverted else self.node_high_id
+
+    @property
+    def source(self):
+        return self.node_high if self.inverted else self.node_low
+
+    @property
+    def target(self):
+        return self.node_low if self.inverted else self.node_high
+
     def get_adjusted_p_value(self):
         """Return Bonferroni adjusted p-value."""
         return min(1.0, self.p_value * self.metapath.n_similar)
+
+
+class NodePairMetapaths(models.Model):
+    """
+    PathCount values for each node pair with PathCount rows, to serve the
+    metapaths endpoint with a single read. metapaths is an array of arrays of
+    the values in serializers.node_pair_metapath_lookups, sorted by adjusted
+    p-value, p-value, and metapath, where inverted is relative to node_low.
+    Metapath values are added when rows are served. Built at the end of
+    populate_database.
+    """
+    node_low = models.ForeignKey(to='Node', on_delete=models.PROTECT, related_name='pair_low')
+    node_high = models.ForeignKey(to='Node', on_delete=models.PROTECT, related_name='pair_high')
+    n_metapaths = models.PositiveIntegerField()
+    metapaths = JSONField()
+
+    class Meta:
+        unique_together = ('node_low', 'node_high')
+
+
+class NodeConnection(models.Model):
+    """
+    Summary of the PathCount rows between a node and each other node, stored
+    once from each node of a pair, to rank the nodes most connected to a node.
+    score is the sum of -log10(adjusted p-value) across metapaths.
+    Built at the end of populate_database.
+    """
+    node = models.ForeignKey(to='Node', on_delete=models.PROTECT, related_name='connections')
+    other_node = models.ForeignKey(to='Node', on_delete=models.PROTECT, related_name='+')
+    other_metanode = models.ForeignKey(to='Metanode', on_delete=models.PROTECT, related_name='+')
+    n_metapaths = models.PositiveIntegerField()
+    min_adjusted_p_value = models.FloatField(null=True)
+    score = models.FloatField()
+
+    class Meta:
+        unique_together = ('node', 'other_node')
+        indexes = [
+            # Top-k queries read the leading entries for a node in ranking order
+            models.Index(fields=['node', 'min_adjusted_p_value']),
+            models.Index(fields=['node', '-score']),
+            # Serves nodes ordered by their number of metapaths to another node
+            models.Index(fields=['other_node', '-n_metapaths', 'node']),
+        ]
+
+
+class DatasetVersion(models.Model):
+    """Token identifying the loaded data, replaced by each populate_database run."""
+    token = models.CharField(primary_key=True, max_length=32)
+    created = models.DateTimeField(auto_now_add=True)
+
+
+class LoadProgress(models.Model):
+    """Completed units of populate_database, used by --resume."""
+    stage = models.CharField(primary_key=True, max_length=100)
+    completed = models.DateTimeField(auto_now=True)
@@ -1,3 +1,5 @@
+import functools
+
 from rest_framework import serializers
 from .models import (
     Node,
@@ -24,11 +26,10 @@ class NodeSerializer(serializers.ModelSerializer):
     def get_metapath_count(self, record):
         """
         Get the number of metapaths in the PathCounts database table from
-        this node to the node specified by the count_metapaths_to request parameter.
+        this node to the node specified by the other-node request parameter,
+        which NodeViewSet sets as the metapath_count attribute of records.
         """
-        if "metapath_counts" not in self.context:
-            return None
-        return self.context['metapath_counts'][record.id]
+        return vars(record).get('metapath_count')
 
 
 class DgpSerializer(serializers.ModelSerializer):
@@ -80,8 +81,10 @@ class PathCountDgpSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = PathCount
-        fields = '__all__'
+        exclude = ('node_low', 'node_high', 'inverted')
 
+    source = serializers.IntegerField(source='source_id', read_only=True)
+    target = serializers.IntegerField(source='target_id', read_only=True)
     dgp = DgpSerializer()
     metapath = MetapathSerializer()
     adjusted_p_value = serializers.SerializerMethodField()
@@ -97,25 +100,121 @@ class PathCountDgpSerializer(serializers.ModelSerializer):
         data['reversed'] = reversed_
         data.update(data.pop('metapath'))
         data.update(data.pop('dgp'))
-        data['cypher_query'] = self.get_cypher(instance)
+        if self.context.get('cypher_query', True):
+            data['cypher_query'] = self.get_cypher(instance)
         return data
 
     def get_cypher(self, instance):
-        metapath = instance.metapath.oriented_metapath
         source = instance.source
         target = instance.target
         if vars(instance).get('reversed'):
             source, target = target, source
-        from hetnetpy.neo4j import construct_pdp_query
-        cypher_query = (
-            construct_pdp_query(metapath, property='identifier', path_style='string')
-            .replace('{ source }', f"{source.get_cast_identifier().__repr__()} // {source.name}")
-            .replace('{ target }', f"{target.get_cast_identifier().__repr__()} // {target.name}")
-            .replace('{ w }', '0.5')
-            .replace('RETURN', 'RETURN\n  path AS neo4j_path,')
-            + '\nLIMIT 10'
+        return get_cypher_query(instance.metapath.oriented_metapath.abbrev, source, target)
+
+
+def get_cypher_query(metapath, source, target):
+    """
+    Return a Cypher query for the Hetionet Neo4j Browser that returns paths
+    for `metapath`, an abbreviation, from `source` to `target`, which are Node records.
+    """
+    return (
+        get_cypher_template(metapath)
+        .replace('{ source }', f"{source.get_cast_identifier().__repr__()} // {source.name}")
+        .replace('{ target }', f"{target.get_cast_identifier().__repr__()} // {target.name}")
+    )
+
+
+@functools.lru_cache(maxsize=10_000)
+def get_cypher_template(metapath):
+    """
+    Return the Cypher query for a metapath abbreviation with `{ source }` and
+    `{ target }` placeholders for the node identifiers.
+    """
+    from hetnetpy.neo4j import construct_pdp_query
+    from dj_hetmech_app.utils import metapath_from_abbrev
+    return (
+        construct_pdp_query(metapath_from_abbrev(metapath), property='identifier', path_style='string')
+        .replace('{ w }', '0.5')
+        .replace('RETURN', 'RETURN\n  path AS neo4j_path,')
+        + '\nLIMIT 10'
+    )
+
+
+metapath_value_fields = [
+    'abbreviation', 'name', 'length', 'path_count_density', 'path_count_mean',
+    'path_count_max', 'dwpc_raw_mean', 'n_similar', 'p_threshold',
+]
+dgp_value_fields = [
+    'id', 'source_degree', 'target_degree', 'n_dwpcs', 'n_nonzero_dwpcs',
+    'nonzero_mean', 'nonzero_sd',
+]
+pathcount_value_lookups = [
+    'id', 'adjusted_p_value', 'path_count', 'dwpc', 'p_value', 'reversed',
+    *(f'metapath__{field}' for field in metapath_value_fields),
+    *(f'dgp__{field}' for field in dgp_value_fields),
+]
+
+# PathCount values that vary by node pair, as stored in NodePairMetapaths arrays.
+# Metapath values are read from get_metapath_values when rows are served.
+node_pair_metapath_lookups = [
+    'id', 'metapath__abbreviation', 'inverted', 'path_count', 'dwpc', 'p_value', 'adjusted_p_value',
+    *(f'dgp__{field}' for field in dgp_value_fields),
+]
+
+
+def serialize_pathcount_values(values):
+    """
+    Flat equivalent of PathCountDgpSerializer for the metapaths endpoint.
+    `values` is a dictionary from a PathCount queryset with a reversed annotation,
+    such as `queryset.values(*pathcount_value_lookups)`. Returns the same data
+    as PathCountDgpSerializer without source, target, metapath_source,
+    metapath_target, and cypher_query, without further database queries.
+    """
+    import math
+    reversed_ = values['reversed']
+    data = {
+        'id': values['id'],
+        'adjusted_p_value': values['adjusted_p_value'],
+        'path_count': values['path_count'],
+        'dwpc': values['dwpc'],
+        'p_value': values['p_value'],
+        'reversed': reversed_,
+    }
+    for field in metapath_value_fields:
+        data[f'metapath_{field}'] = values[f'metapath__{field}']
+    abbreviation, name, metaedges = get_oriented_metapath_fields(values['metapath__abbreviation'], reversed_)
+    data['metapath_abbreviation'] = abbreviation
+    if reversed_:
+        data['metapath_name'] = name
+    data['metapath_id'] = values['metapath__abbreviation']
+    data['metapath_reversed'] = reversed_
+    data['metapath_metaedges'] = metaedges
+    for field in dgp_value_fields:
+        data[f'dgp_{field}'] = values[f'dgp__{field}']
+    # Replace nan with None. https://github.com/greenelab/connectivity-search-backend/issues/63
+    for key in 'dgp_nonzero_mean', 'dgp_nonzero_sd':
+        if data[key] is not None and math.isnan(data[key]):
+            data[key] = None
+    if reversed_:
+        data['dgp_source_degree'], data['dgp_target_degree'] = (
+            data['dgp_target_degree'], data['dgp_source_degree']
         )
-        return cypher_query
+    data['dgp_reversed'] = reversed_
+    return data
+
+
+@functools.lru_cache(maxsize=10_000)
+def get_oriented_metapath_fields(abbreviation, reversed_):
+    """
+    Return the abbreviation, name, and metaedges of a stored metapath in the
+    requested orientation, as serialized by MetapathSerializer.
+    """
+    from dj_hetmech_app.utils import metapath_from_abbrev
+    metapath = metapath_from_abbrev(abbreviation)
+    if reversed_:
+        metapath = metapath.inverse
+    metaedges = [metaedge.get_id() for metaedge in metapath]
+    return metapath.abbrev, metapath.get_unicode_str(), metaedges
 
 
 def serialize_record(record, include=[], exclude=[], key_formatter=None):
@@ -1,3 +1,1007 @@
-from django.test import TestCase
+import collections
+import contextlib
+import hashlib
+import http.server
+import io
+import pathlib
+import tempfile
+import threading
 
-# Create your tests here.
+from django.core.cache import caches
+from django.test import SimpleTestCase, TestCase, override_settings
+
+from dj_hetmech_app import models
+from dj_hetmech_app.utils.cache import (
+    bump_dataset_version,
+    get_response_cache_stats,
+    reset_response_cache_stats,
+)
+from dj_hetmech_app.utils.downloads import download_file
+
+
+def get_populate_command(**options):
+    """
+    Return a populate_database Command with the options and throughput
+    counters that handle sets, for calling its stages directly.
+    """
+    from dj_hetmech_app.management.commands.populate_database import Command
+    command = Command()
+    command.options = {'loader': 'bulk_create', 'batch_size': 100, 'resume': False, 'workers': 1, **options}
+    command._throughput = collections.defaultdict(collections.Counter)
+    return command
+
+
+def create_test_hetmat(directory):
+    """
+    Create a hetmat in `directory` with the Hetionet metagraph, two compounds,
+    three genes, and two diseases, whose identifiers and names are integers,
+    and CbG and GaD edges. Returns the HetMat and the node identifiers by metanode.
+    """
+    import hetmatpy.hetmat
+    import pandas
+    import scipy.sparse
+    from dj_hetmech_app.utils import get_hetionet_metagraph
+    hetmat = hetmatpy.hetmat.HetMat(pathlib.Path(directory).joinpath('test.hetmat'), initialize=True)
+    hetmat.metagraph = get_hetionet_metagraph()
+    node_ids = {'Compound': [10, 11], 'Gene': [20, 21, 22], 'Disease': [30, 31]}
+    for metanode, ids in node_ids.items():
+        node_df = pandas.DataFrame({'position': range(len(ids)), 'identifier': ids, 'name': ids})
+        node_df.to_csv(hetmat.get_nodes_path(metanode), sep='\t', index=False)
+    for metaedge, edges, shape in [
+        ('CbG', [(0, 0), (0, 1), (1, 0)], (2, 3)),
+        ('GaD', [(0, 0), (0, 1), (1, 0), (1, 1), (2, 0)], (3, 2)),
+    ]:
+        rows, cols = zip(*edges)
+        matrix = scipy.sparse.csc_matrix(([True] * len(edges), (rows, cols)), shape=shape)
+        hetmatpy.hetmat.save_matrix(matrix, hetmat.get_edges_path(metaedge, file_format=None))
+    return hetmat, node_ids
+
+
+class RangeRequestHandler(http.server.BaseHTTPRequestHandler):
+    """
+    Serve `content` for any path, honoring `Range: bytes=<start>-` headers
+    like Zenodo and GitHub do.
+    """
+    content = bytes(range(256)) * 4_000
+
+    def do_GET(self):
+        start = 0
+        range_header = self.headers.get('Range')
+        if range_header:
+            start = int(range_header.split('=')[1].rstrip('-'))
+            if start >= len(self.content):
+                self.send_response(416)
+                self.end_headers()
+                return
+            self.send_response(206)
+        else:
+            self.send_response(200)
+        body = self.content[start:]
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class DownloadFileTests(SimpleTestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = http.server.ThreadingHTTPServer(('localhost', 0), RangeRequestHandler)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.url = f'http://localhost:{cls.server.server_port}/record/1/files/archive.zip'
+        cls.md5 = hashlib.md5(RangeRequestHandler.content).hexdigest()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        super().tearDownClass()
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = pathlib.Path(self.directory.name).joinpath('archive.zip')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_download_file(self):
+        checksum = download_file(self.url, self.path, expected_md5=self.md5)
+        self.assertEqual(checksum, self.md5)
+        self.assertEqual(self.path.read_bytes(), RangeRequestHandler.content)
+
+    def test_download_file_resumes_partial_download(self):
+        part_path = self.path.with_name(self.path.name + '.part')
+        part_path.write_bytes(RangeRequestHandler.content[:12_345])
+        checksum = download_file(self.url, self.path, expected_md5=self.md5)
+        self.assertEqual(checksum, self.md5)
+        self.assertEqual(self.path.read_bytes(), RangeRequestHandler.content)
+        self.assertFalse(part_path.exists())
+
+    def test_download_file_complete_partial_download(self):
+        part_path = self.path.with_name(self.path.name + '.part')
+        part_path.write_bytes(RangeRequestHandler.content)
+        checksum = download_file(self.url, self.path, expected_md5=self.md5)
+        self.assertEqual(checksum, self.md5)
+
+    def test_download_file_checksum_mismatch(self):
+        with self.assertRaises(ValueError):
+            download_file(self.url, self.path, expected_md5='0' * 32)
+        self.assertFalse(self.path.exists())
+
+
+@override_settings(RESPONSE_CACHE_ALIAS=None, HTTP_CACHE_MAX_AGE=None, NODE_PAIR_SAMPLER_PATH=None)
+class QueryMetapathsViewTests(TestCase):
+    """
+    The metapaths endpoint should use a constant number of SQL queries,
+    regardless of the number of metapaths between the nodes.
+    """
+    metapaths = ['CtD', 'CpD', 'CrCtD', 'CrCpD', 'CbGaD', 'CuGaD']
+
+    @classmethod
+    def setUpTestData(cls):
+        compound = models.Metanode.objects.create(identifier='Compound', abbreviation='C', n_nodes=1)
+        disease = models.Metanode.objects.create(identifier='Disease', abbreviation='D', n_nodes=2)
+        for id_, metanode, identifier in [(1, compound, 'DB00997'), (2, disease, 'DOID:363'), (3, disease, 'DOID:1324')]:
+            models.Node.objects.create(
+                id=id_, metanode=metanode, identifier=identifier, identifier_type='str',
+                name=identifier, properties={},
+            )
+        for i, abbreviation in enumerate(cls.metapaths):
+            metapath = models.Metapath.objects.create(
+                abbreviation=abbreviation, name=abbreviation, source=compound, target=disease,
+                length=len(abbreviation) // 2, path_count_density=0.1, path_count_mean=1.0,
+                path_count_max=10, dwpc_raw_mean=0.01, n_similar=i + 1, p_threshold=1.0,
+            )
+            dgp = models.DegreeGroupedPermutation.objects.create(
+                metapath=metapath, source_degree=3, target_degree=5, n_dwpcs=100,
+                n_nonzero_dwpcs=10, nonzero_mean=1.0, nonzero_sd=0.5,
+            )
+            # Node 3 shares a single metapath with node 1
+            for target in [2, 3] if abbreviation == 'CtD' else [2]:
+                models.PathCount.objects.create(
+                    metapath=metapath, node_low_id=1, node_high_id=target, inverted=False,
+                    dgp=dgp, path_count=i + 1, dwpc=1.5, p_value=0.001 * (i + 1),
+                    adjusted_p_value=min(1.0, 0.001 * (i + 1) ** 2),
+                )
+
+    def setUp(self):
+        from dj_hetmech_app.utils.paths import get_metapath_values
+        # Read the Metapath table before counting queries, as a running server would have
+        get_metapath_values.cache_clear()
+        get_metapath_values()
+
+    def get_path_counts(self, source, target, n_queries, params=''):
+        with self.assertNumQueries(n_queries):
+            response = self.client.get(f'/v1/metapaths/source/{source}/target/{target}/{params}')
+        self.assertEqual(response.status_code, 200)
+        return response.json()['path_counts']
+
+    def test_metapaths_query_count(self):
+        # Two node lookups, the NodePairMetapaths lookup, and the PathCount query
+        self.assertEqual(len(self.get_path_counts(1, 3, n_queries=4)), 1)
+        path_counts = self.get_path_counts(1, 2, n_queries=4)
+        self.assertEqual(len(path_counts), len(self.metapaths))
+        self.assertEqual(path_counts[0]['metapath_abbreviation'], 'CtD')
+        self.assertEqual(path_counts[1]['adjusted_p_value'], 0.004)
+
+    def test_metapaths_reversed(self):
+        path_counts = self.get_path_counts(2, 1, n_queries=4)
+        self.assertEqual(path_counts[0]['metapath_abbreviation'], 'DtC')
+        self.assertTrue(path_counts[0]['reversed'])
+        self.assertEqual(path_counts[0]['dgp_source_degree'], 5)
+
+    def test_metapaths_limit_complete(self):
+        # Path counts fill the limit, so metapaths without path counts are not queried
+        path_counts = self.get_path_counts(1, 2, n_queries=4, params='?limit=2&complete')
+        self.assertEqual([x['metapath_abbreviation'] for x in path_counts], ['CtD', 'CpD'])
+        path_counts = self.get_path_counts(1, 3, n_queries=5, params='?limit=3&complete')
+        self.assertEqual(len(path_counts), 3)
+        self.assertEqual(path_counts[0]['metapath_abbreviation'], 'CtD')
+        self.assertNotIn('CtD', {x['metapath_abbreviation'] for x in path_counts[1:]})
+
+    def test_metapaths_cypher_query(self):
+        path_counts = self.get_path_counts(2, 1, n_queries=4)
+        self.assertNotIn('cypher_query', path_counts[0])
+        path_counts = self.get_path_counts(2, 1, n_queries=4, params='?include=cypher_query')
+        cypher_query = path_counts[0]['cypher_query']
+        self.assertIn("'DOID:363' // DOID:363", cypher_query)
+        self.assertIn("'DB00997' // DB00997", cypher_query)
+        self.assertTrue(cypher_query.endswith('LIMIT 10'))
+
+    def test_node_pair_metapaths(self):
+        live = {(source, target): self.get_path_counts(source, target, n_queries=4) for source, target in [(1, 2), (2, 1)]}
+        get_populate_command()._populate_node_pair_metapaths_table()
+        for (source, target), path_counts in live.items():
+            self.assertEqual(self.get_path_counts(source, target, n_queries=3), path_counts)
+            self.assertEqual(self.get_path_counts(source, target, n_queries=3, params='?limit=2'), path_counts[:2])
+            self.assertEqual(self.get_path_counts(source, target, n_queries=3, params='?limit=0'), [])
+        results = self.get_batch(2, params='?limit=2&pairs=1-2,2-1')
+        self.assertEqual([x['path_counts'] for x in results], [live[1, 2][:2], live[2, 1][:2]])
+
+    def get_batch(self, n_queries, params='', data=None):
+        import json
+        with self.assertNumQueries(n_queries):
+            if data is None:
+                response = self.client.get(f'/v1/metapaths/batch/{params}')
+            else:
+                response = self.client.post(f'/v1/metapaths/batch/{params}', data, content_type='application/json')
+            lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(response.status_code, 200)
+        return [json.loads(line) for line in lines]
+
+    def test_metapaths_batch(self):
+        pairs = [(1, 2), (2, 1), (1, 3), (3, 1), (2, 3)]
+        live = {pair: self.get_path_counts(*pair, n_queries=4) for pair in pairs}
+        # Node lookup, the NodePairMetapaths lookup, and the PathCount query for pairs without a stored row
+        results = self.get_batch(3, params='?pairs=' + ','.join(f'{s}-{t}' for s, t in pairs))
+        self.assertEqual([(x['source']['id'], x['target']['id']) for x in results], pairs)
+        self.assertEqual([x['path_counts'] for x in results], [live[pair] for pair in pairs])
+        results = self.get_batch(3, params='?limit=2', data={'sources': [1], 'targets': [2, 3]})
+        self.assertEqual([x['path_counts'] for x in results], [live[1, 2][:2], live[1, 3]])
+        response = self.client.get('/v1/metapaths/batch/?pairs=1-4')
+        self.assertEqual(response.status_code, 404)
+
+    def test_filter_node_pairs(self):
+        from dj_hetmech_app.utils.paths import filter_node_pairs
+        queryset = models.PathCount.objects.all()
+        for pairs in [(1, 3)], [(1, 3), (2, 3)], [(1, 2), (1, 3)]:
+            # An OR of conditions and a subquery of unnested arrays
+            counts = [filter_node_pairs(queryset, pairs, max_q_pairs=n).count() for n in (len(pairs), 0)]
+            self.assertEqual(counts, [queryset.filter(node_high__in=[y for x, y in pairs if x == 1]).count()] * 2)
+        self.assertEqual(filter_node_pairs(queryset, []).count(), 0)
+
+    def test_random_node_pair(self):
+        import random
+        from dj_hetmech_app.utils.sampling import NodePairSampler, get_node_pair_sampler
+        # Without NodePairMetapaths rows, pairs are read from PathCount
+        sampler = NodePairSampler.from_database()
+        self.assertEqual(len(sampler), 2)
+        rng = random.Random(0)
+        samples = collections.Counter(sampler.sample(rng) for _ in range(7_000))
+        self.assertEqual({(min(s, t), max(s, t), n) for s, t, n in samples}, {(1, 2, 6), (1, 3, 1)})
+        self.assertAlmostEqual(samples[1, 2, 6] / sum(samples.values()), 3 / 7, delta=0.03)
+        get_node_pair_sampler.cache_clear()
+        self.client.get('/v1/random-node-pair/')
+        # The sampler is built once, so later requests do not query the database
+        with self.assertNumQueries(0):
+            info = self.client.get('/v1/random-node-pair/').json()
+        self.assertIn((info['source_id'], info['target_id'], info['n_metapaths']), samples)
+        with self.assertNumQueries(4):
+            response = self.client.get('/v1/metapaths/random-nodes/')
+        self.assertEqual(len(response.json()['path_counts']), response.json()['n_metapaths'])
+        get_node_pair_sampler.cache_clear()
+        self.assertEqual(len(NodePairSampler([], [], [])), 0)
+        with self.assertRaises(ValueError):
+            NodePairSampler([], [], []).sample()
+
+    def test_saved_node_pair_sampler(self):
+        import numpy
+        from dj_hetmech_app.utils.sampling import NodePairSampler, get_node_pair_sampler, save_node_pair_sampler
+        with tempfile.TemporaryDirectory() as directory, self.settings(NODE_PAIR_SAMPLER_PATH=directory):
+            save_node_pair_sampler('old')
+            # Other files and samplers being saved are kept
+            pathlib.Path(directory).joinpath('README').write_text('')
+            pathlib.Path(directory).joinpath('other.tmp').mkdir()
+            pathlib.Path(directory).joinpath('other').mkdir()
+            version = bump_dataset_version()
+            path = save_node_pair_sampler(version)
+            # Arrays for other dataset versions are removed
+            self.assertEqual(
+                sorted(x.name for x in pathlib.Path(directory).iterdir()),
+                sorted(['README', 'other.tmp', 'other', version]),
+            )
+            sampler = NodePairSampler.load(path)
+            self.assertIsInstance(sampler.cumulative, numpy.memmap)
+            self.assertEqual(sampler.cumulative.tolist(), NodePairSampler.from_database().cumulative.tolist())
+            # Loading the saved arrays takes only the dataset version lookup
+            get_node_pair_sampler.cache_clear()
+            with self.assertNumQueries(1):
+                sampler = get_node_pair_sampler()
+            self.assertIsInstance(sampler.node_low, numpy.memmap)
+            source_id, target_id, n_metapaths = sampler.sample()
+            self.assertIn((min(source_id, target_id), max(source_id, target_id), n_metapaths), {(1, 2, 6), (1, 3, 1)})
+            get_node_pair_sampler.cache_clear()
+
+    def test_node_connections(self):
+        get_populate_command()._populate_node_connection_table()
+        # Node lookup and the NodeConnection query
+        with self.assertNumQueries(2):
+            response = self.client.get('/v1/connections/node/1/?metanodes=D')
+        connections = response.json()['connections']
+        self.assertEqual([x['other_node']['id'] for x in connections], [2, 3])
+        self.assertEqual([x['n_metapaths'] for x in connections], [len(self.metapaths), 1])
+        self.assertEqual(connections[1]['min_adjusted_p_value'], 0.001)
+        self.assertAlmostEqual(connections[1]['score'], 3.0)
+        connections = self.client.get('/v1/connections/node/3/?sort=score').json()['connections']
+        self.assertEqual([x['other_node']['id'] for x in connections], [1])
+        self.assertEqual(self.client.get('/v1/connections/node/1/?metanodes=C').json()['connections'], [])
+
+    def test_nodes_other_node(self):
+        from dj_hetmech_app.utils import search
+        get_populate_command()._populate_node_connection_table()
+        # Count and page queries, ordered by metapath count in SQL
+        with self.assertNumQueries(2):
+            results = self.client.get('/v1/nodes/?other-node=1').json()['results']
+        self.assertEqual([(x['id'], x['metapath_count']) for x in results], [(2, len(self.metapaths)), (3, 1)])
+        results = self.client.get('/v1/nodes/?other-node=2&metanodes=D').json()['results']
+        self.assertEqual(results, [])
+        self.assertEqual(self.client.get('/v1/node/3?other-node=1').json()['metapath_count'], 1)
+        # Searches return nodes without metapaths to other-node
+        search.get_node_search_index.cache_clear()
+        results = self.client.get('/v1/nodes/?search=DOID&other-node=3').json()['results']
+        self.assertEqual({x['id']: x['metapath_count'] for x in results}, {2: 0, 3: 0})
+        self.assertEqual(self.client.get('/v1/nodes/?other-node=x').status_code, 400)
+
+    def test_export_path_counts(self):
+        import json
+        response = self.client.get('/v1/export/metapath/CtD/')
+        rows = [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+        self.assertEqual([(x['source_id'], x['target_id']) for x in rows], [(1, 2), (1, 3)])
+        self.assertEqual(rows[0]['target_identifier'], 'DOID:363')
+        response = self.client.get('/v1/export/metapath/DtC/?output=tsv&after=2-1')
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines[0].split('\t')[:4], ['source_id', 'source_identifier', 'source_name', 'target_id'])
+        self.assertEqual([line.split('\t')[3] for line in lines[1:]], ['1'])
+        response = self.client.get('/v1/export/metapath/CpD/?output=csv&max_adjusted_p_value=0.001')
+        self.assertEqual(len(b''.join(response.streaming_content).decode().splitlines()), 1)
+        self.assertEqual(self.client.get('/v1/export/metapath/CpDpCtD/').status_code, 404)
+        self.assertEqual(self.client.get('/v1/export/metapath/CiD/').status_code, 400)
+
+    def test_export_path_counts_command(self):
+        import json
+        from django.core.management import call_command, CommandError
+        compound = models.Metanode.objects.get(abbreviation='C')
+        models.Node.objects.create(
+            id=4, metanode=compound, identifier='DB00014', identifier_type='str', name='DB00014', properties={})
+        metapath = models.Metapath.objects.create(
+            abbreviation='CbGbCrC', name='CbGbCrC', source=compound, target=compound, length=3,
+            path_count_density=0.1, path_count_mean=1.0, path_count_max=10, dwpc_raw_mean=0.01,
+            n_similar=1, p_threshold=1.0,
+        )
+        dgp = models.DegreeGroupedPermutation.objects.get(metapath='CtD')
+        for node_high, inverted in (1, False), (4, False), (4, True):
+            models.PathCount.objects.create(
+                metapath=metapath, node_low_id=1, node_high_id=node_high, inverted=inverted,
+                dgp=dgp, path_count=1, dwpc=1.0, p_value=0.01, adjusted_p_value=0.01,
+            )
+        with tempfile.TemporaryDirectory() as directory:
+            path = pathlib.Path(directory).joinpath('export.ndjson')
+
+            def export(metapath, **options):
+                call_command('export_path_counts', metapath, output_format='ndjson', path=str(path), **options)
+                return [(x['source_id'], x['target_id']) for x in map(json.loads, path.read_text().splitlines())]
+
+            # CrCbGbC runs opposite to the stored CbGbCrC, and the self-pair resumes after its only row
+            self.assertEqual(export('CrCbGbC'), [(1, 1), (4, 1), (1, 4)])
+            self.assertEqual(export('CrCbGbC', after=(1, 1)), [(4, 1), (1, 4)])
+            self.assertEqual(export('CbGbCrC', after=(1, 1)), [(1, 4), (4, 1)])
+            self.assertEqual(export('CbGbCrC', after=(1, 4)), [(4, 1)])
+            # Invalid commands fail before the existing export is truncated
+            for metapath, options in ('CpDpCtD', {}), ('CiD', {}), ('CtD', {'after': (1, 2, 3)}), ('CtD', {'limit': 0}):
+                with self.assertRaises(CommandError):
+                    export(metapath, **options)
+                self.assertEqual(len(path.read_text().splitlines()), 1)
+
+
+@override_settings(DATASET_VERSION_TTL=0, HTTP_CACHE_MAX_AGE=3600)
+class ResponseCacheTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        compound = models.Metanode.objects.create(identifier='Compound', abbreviation='C', n_nodes=1)
+        models.Node.objects.create(
+            id=1, metanode=compound, identifier='DB00997', identifier_type='str',
+            name='Doxorubicin', properties={},
+        )
+
+    def setUp(self):
+        caches['responses'].clear()
+        reset_response_cache_stats()
+
+    def get_node(self, cache_status, n_queries, **headers):
+        with self.assertNumQueries(n_queries):
+            response = self.client.get('/v1/node/1', HTTP_ACCEPT='application/json', **headers)
+        if cache_status == 'not-modified':
+            self.assertEqual(response.status_code, 304)
+            return response
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['X-Response-Cache'], cache_status)
+        self.assertEqual(response['Cache-Control'], 'public, max-age=3600')
+        return response
+
+    def test_response_cache(self):
+        # Dataset version lookup, followed by the node query on a miss
+        node = self.get_node('miss', n_queries=2).json()
+        self.assertEqual(self.get_node('hit', n_queries=1).json(), node)
+        self.assertEqual(get_response_cache_stats(), {'hits': 1, 'misses': 1})
+        # Evicting and clearing responses does not reset the counters
+        caches['responses'].clear()
+        self.assertEqual(get_response_cache_stats(), {'hits': 1, 'misses': 1})
+        self.assertEqual(self.get_node('miss', n_queries=2).json(), node)
+        models.Node.objects.filter(pk=1).update(name='Adriamycin')
+        self.assertEqual(self.get_node('hit', n_queries=1).json()['name'], 'Doxorubicin')
+        bump_dataset_version()
+        self.assertEqual(self.get_node('miss', n_queries=2).json()['name'], 'Adriamycin')
+
+    def test_byte_limited_cache(self):
+        import pickle
+        from dj_hetmech_app.utils.cache import ByteLimitedLocMemCache, is_shared_cache
+        size = len(pickle.dumps(b'x' * 1_000, pickle.HIGHEST_PROTOCOL))
+        cache = ByteLimitedLocMemCache('test-byte-limited', {'OPTIONS': {'MAX_BYTES': 3 * size}})
+        cache.clear()
+        for key in 'abc':
+            cache.set(key, b'x' * 1_000)
+        self.assertEqual(cache.get_n_bytes(), 3 * size)
+        # Reading a refreshes it, so b is the least recently used entry when d is added
+        cache.get('a')
+        cache.set('d', b'x' * 1_000)
+        self.assertEqual([key for key in 'abcd' if cache.get(key) is not None], ['a', 'c', 'd'])
+        cache.delete('a')
+        cache.set('c', b'x' * 500)
+        self.assertEqual(cache.get_n_bytes(), size + len(pickle.dumps(b'x' * 500, pickle.HIGHEST_PROTOCOL)))
+        # Values larger than MAX_BYTES are not kept
+        cache.set('e', b'x' * 5_000)
+        self.assertIsNone(cache.get('e'))
+        self.assertFalse(is_shared_cache(cache))
+
+    def test_conditional_get(self):
+        etag = self.get_node('miss', n_queries=2)['ETag']
+        response = self.get_node('not-modified', n_queries=1, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response['ETag'], etag)
+        bump_dataset_version()
+        response = self.get_node('miss', n_queries=2, HTTP_IF_NONE_MATCH=etag)
+        self.assertNotEqual(response['ETag'], etag)
+
+
+class NodeSearchIndexTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        compound = models.Metanode.objects.create(identifier='Compound', abbreviation='C', n_nodes=2)
+        disease = models.Metanode.objects.create(identifier='Disease', abbreviation='D', n_nodes=3)
+        for id_, metanode, identifier, name in [
+            (1, compound, 'DB00997', 'Doxorubicin'),
+            (2, disease, 'DOID:363', 'uterine cancer'),
+            (3, disease, 'DOID:1324', 'lung cancer'),
+            (4, compound, 'DB01234', 'Dexamethasone'),
+            (5, disease, 'DOID:9970', 'obesity'),
+        ]:
+            models.Node.objects.create(
+                id=id_, metanode=metanode, identifier=identifier, identifier_type='str',
+                name=name, properties={},
+            )
+
+    def setUp(self):
+        from dj_hetmech_app.utils import search
+        search.get_node_search_index.cache_clear()
+        self.index = search.NodeSearchIndex.from_database()
+
+    def search(self, *args, **kwargs):
+        return self.index.search(*args, **kwargs).get_ids()
+
+    def test_node_search_index(self):
+        # Both names share the '  d' trigram, so the shorter name is more similar
+        self.assertEqual(self.search('db0'), [1, 4])
+        # 'lung cancer' shares 7 of 12 trigrams with 'cancer', 'uterine cancer' 7 of 15
+        self.assertEqual(self.search('cancer'), [3, 2])
+        similarities = dict(zip(self.index.ids.tolist(), self.index.similarities('cancer').tolist()))
+        self.assertAlmostEqual(similarities[3], 7 / 12, places=6)
+        self.assertEqual(self.search('lung cancr'), [3])
+        self.assertEqual(self.search('lung cancr', similarity=0.1), [3, 2])
+        self.assertEqual(self.search('d', metanodes=['C']), [1, 4])
+        # Ties in similarity are ordered by name
+        self.assertEqual(self.search('DOID:', similarity=1.0), [3, 5, 2])
+        self.assertEqual(self.search('xyz'), [])
+
+    def test_node_search_index_name_collation(self):
+        from dj_hetmech_app.utils import search
+        compound = models.Metanode.objects.get(abbreviation='C')
+        for id_, name in enumerate(['beta-Blocker', 'Beta blocker', 'BETA_BLOCKER', 'beta blocker', 'Beta-blocker'], 6):
+            models.Node.objects.create(
+                id=id_, metanode=compound, identifier=f'DB9{id_}', identifier_type='str', name=name, properties={})
+        index = search.NodeSearchIndex.from_database()
+        # Names with the same trigrams tie in similarity and are ordered by the database collation
+        similarities = index.similarities('blocker')[index.ids >= 6]
+        self.assertEqual(len(set(similarities.tolist())), 1)
+        name_order = list(models.Node.objects.filter(id__gte=6).order_by('name', 'id').values_list('id', flat=True))
+        self.assertEqual(index.search('blocker').get_ids(), name_order)
+
+    def test_nodes_search_endpoint(self):
+        response = self.client.get('/v1/nodes/?search=cancer&limit=1')
+        self.assertEqual(response.json()['count'], 2)
+        self.assertEqual([x['id'] for x in response.json()['results']], [3])
+        response = self.client.get('/v1/nodes/?search=cancer&limit=1&offset=1')
+        self.assertEqual([x['id'] for x in response.json()['results']], [2])
+
+
+class HetmatPathEngineTests(SimpleTestCase):
+
+    def setUp(self):
+        from dj_hetmech_app.utils.hetmat_paths import HetmatPathEngine
+        self.directory = tempfile.TemporaryDirectory()
+        hetmat, node_ids = create_test_hetmat(self.directory.name)
+        self.engine = HetmatPathEngine(hetmat, node_ids, chunk_size=1)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_get_pdp_rows(self):
+        # Source and target degrees of compound 10 to gene 21 to disease 30 are 2, 1, 2, and 3
+        rows, path_count, dwpc = self.engine.get_pdp_rows('CbGaD', 10, 30)
+        self.assertEqual(path_count, 2)
+        self.assertAlmostEqual(dwpc, 12 ** -0.5 + 24 ** -0.5)
+        self.assertEqual([row['node_ids'] for row in rows], [[10, 21, 30], [10, 20, 30]])
+        self.assertAlmostEqual(rows[0]['PDP'], 12 ** -0.5)
+        self.assertAlmostEqual(sum(row['percent_of_DWPC'] for row in rows), 100)
+        self.assertEqual(rows[0]['rel_ids'], ['10:BINDS_CbG:21', '30:ASSOCIATES_DaG:21'])
+        # The limit does not change path_count or dwpc
+        self.assertEqual(self.engine.get_pdp_rows('CbGaD', 10, 30, limit=1), (rows[:1], path_count, dwpc))
+        self.assertEqual(self.engine.get_pdp_rows('CbGaD', 10, 30, limit=0), ([], path_count, dwpc))
+        # Paths do not repeat nodes
+        self.assertEqual(self.engine.get_pdp_rows('CbGbC', 10, 11)[1], 1)
+        self.assertEqual(self.engine.get_pdp_rows('CbGbC', 10, 10)[1], 0)
+        # Nodes of other metanodes have no paths
+        self.assertEqual(self.engine.get_pdp_rows('DaGbC', 10, 11), ([], 0, 0.0))
+        self.assertEqual(self.engine.get_node_degree(30, 'DaG'), 3)
+        rel_info = self.engine.get_rel_info(rows[0]['rel_ids'])
+        self.assertEqual(rel_info['30:ASSOCIATES_DaG:21']['source_neo4j_id'], 30)
+        self.assertEqual(rel_info['30:ASSOCIATES_DaG:21']['kind'], 'associates')
+
+    def test_get_pdp_rows_stored_dwpc(self):
+        import hetmatpy.degree_weight
+        import numpy
+        hetmat = self.engine.hetmat
+        summed = {(source_id, limit): self.engine.get_pdp_rows('CbGaD', source_id, 30, limit=limit)
+                  for source_id in (10, 11) for limit in (None, 0, 1)}
+        # Path counts and DWPCs are read from matrices stored for the inverse metapath
+        metapath = self.engine.metagraph.get_metapath('DaGbC')
+        for damping in 0.0, 0.5:
+            _, _, matrix = hetmatpy.degree_weight.dwpc(
+                hetmat, metapath, damping=damping, dense_threshold=1, dwwc_method=hetmatpy.degree_weight.dwwc_chain)
+            path = hetmat.get_path_counts_path(metapath, 'dwpc', damping, 'npy')
+            path.parent.mkdir(parents=True, exist_ok=True)
+            numpy.save(path, matrix.toarray() if hasattr(matrix, 'toarray') else matrix)
+        self.engine.get_path_count_matrix.cache_clear()
+        self.assertTrue(self.engine.get_path_count_matrix('CbGaD', 0.5)[1])
+        for (source_id, limit), (rows, path_count, dwpc) in summed.items():
+            stored = self.engine.get_pdp_rows('CbGaD', source_id, 30, limit=limit)
+            self.assertEqual([(x['node_ids'], x['PDP']) for x in stored[0]], [(x['node_ids'], x['PDP']) for x in rows])
+            for stored_row, row in zip(stored[0], rows):
+                self.assertAlmostEqual(stored_row['percent_of_DWPC'], row['percent_of_DWPC'])
+            self.assertEqual(stored[1], path_count)
+            self.assertAlmostEqual(stored[2], dwpc)
+        # Partial paths that cannot reach the threshold PDP are not extended
+        metapath = self.engine.metagraph.get_metapath('CbGaD')
+        paths = self.engine.iter_paths(metapath, 0, 0, get_threshold=lambda: 12 ** -0.5)
+        self.assertEqual([x.tolist() for x, _ in paths], [[[0, 1, 0]]])
+
+
+class PathResultCacheTests(SimpleTestCase):
+
+    def setUp(self):
+        from dj_hetmech_app.utils.path_cache import PathResultCache
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = str(pathlib.Path(self.directory.name).joinpath('paths.sqlite3'))
+        self.cache = PathResultCache(max_bytes=100_000, path=self.path)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    @staticmethod
+    def get_result(n_paths, limit=None):
+        paths = [
+            {'node_ids': [1, 10 + i], 'rel_ids': [f'1:BINDS_CbG:{10 + i}'], 'PDP': 1 / (i + 1)}
+            for i in range(n_paths)
+        ][:limit]
+        return {
+            'query': {'limit': limit},
+            'paths': paths,
+            'nodes': {str(node_id): {} for path in paths for node_id in path['node_ids']},
+            'relationships': {rel_id: {} for path in paths for rel_id in path['rel_ids']},
+        }
+
+    def test_path_result_cache(self):
+        from dj_hetmech_app.utils.path_cache import PathResultCache
+        key = self.cache.get_key('v1', 'hetmat', 'CbG', 1, 2)
+        self.assertEqual(self.cache.get(key, 2), (None, 'miss'))
+        self.cache.set(key, 'v1', self.get_result(5, limit=3), limit=3)
+        # A result for a larger limit answers requests for smaller limits
+        self.assertEqual(self.cache.get(key, 2), (self.get_result(5, limit=2), 'memory'))
+        self.assertEqual(self.cache.get(key, 4), (None, 'miss'))
+        self.assertEqual(self.cache.get(key, None), (None, 'miss'))
+        # A result with fewer paths than its limit has all paths
+        self.cache.set(key, 'v1', self.get_result(5, limit=10), limit=10)
+        self.assertEqual(self.cache.get(key, None), (self.get_result(5), 'memory'))
+        # Other processes read results from disk, and then from memory
+        other = PathResultCache(max_bytes=100_000, path=self.path)
+        self.assertEqual(other.get(key, 100)[1], 'disk')
+        self.assertEqual(other.get(key, 100)[1], 'memory')
+        # Counts are added to the database when a process flushes them
+        self.assertEqual(self.cache.get_stats()['disk_hits'], 0)
+        other.flush_counters()
+        stats = self.cache.get_stats()
+        self.assertEqual((stats['memory_hits'], stats['disk_hits'], stats['misses']), (3, 1, 3))
+        self.assertAlmostEqual(stats['hit_rate'], 4 / 7)
+        self.assertEqual(stats['disk_entries'], 1)
+        # Results for a new dataset version remove earlier results from disk
+        self.cache.set(self.cache.get_key('v2', 'hetmat', 'CbG', 1, 2), 'v2', self.get_result(1), limit=None)
+        self.assertEqual(PathResultCache(max_bytes=0, path=self.path).get(key, 1), (None, 'miss'))
+
+    def test_path_result_cache_eviction(self):
+        from dj_hetmech_app.utils.path_cache import PathResultCache
+        cache = PathResultCache(max_bytes=100_000)
+        cache.set('a', 'v1', self.get_result(5), limit=None)
+        cache.max_bytes = cache.n_bytes
+        cache.set('b', 'v1', self.get_result(5), limit=None)
+        self.assertEqual(list(cache.entries), ['b'])
+        self.assertEqual(cache.get('a', 1), (None, 'miss'))
+        self.assertEqual(cache.get('b', 1)[1], 'memory')
+        self.assertEqual(cache.get_stats()['misses'], 1)
+
+    def test_path_result_cache_disk_eviction(self):
+        from dj_hetmech_app.utils.path_cache import PathResultCache
+        cache = PathResultCache(max_bytes=0, path=self.path)
+        cache.prune_interval = 1
+        cache.set('a', 'v1', self.get_result(5), limit=None)
+        cache.max_disk_bytes = 2 * cache.get_stats()['disk_bytes']
+        cache.set('b', 'v1', self.get_result(5), limit=None)
+        # Reading a from disk marks it as recently used, so b is evicted when c is stored
+        self.assertEqual(cache.get('a', 1)[1], 'disk')
+        cache.set('c', 'v1', self.get_result(5), limit=None)
+        self.assertEqual(cache.get_stats()['disk_entries'], 2)
+        self.assertEqual(cache.get('b', 1), (None, 'miss'))
+        self.assertEqual([cache.get(key, 1)[1] for key in 'ac'], ['disk', 'disk'])
+        # Memory hits do not write to the database
+        cache = PathResultCache(max_bytes=100_000, path=self.path)
+        cache.set('d', 'v1', self.get_result(5), limit=None)
+        connection = cache.get_connection()
+        last_used = connection.execute("SELECT last_used FROM path_results WHERE key = 'd'").fetchone()
+        n_changes = connection.total_changes
+        self.assertEqual(cache.get('d', 1)[1], 'memory')
+        self.assertEqual(connection.total_changes, n_changes)
+        self.assertEqual(connection.execute("SELECT last_used FROM path_results WHERE key = 'd'").fetchone(), last_used)
+
+
+class LoadingTests(TestCase):
+    """
+    The copy loader should write the same values as bulk_create, including
+    empty strings, JSON, missing values, and integers computed as floats.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        compound = models.Metanode.objects.create(identifier='Compound', abbreviation='C', n_nodes=2)
+        disease = models.Metanode.objects.create(identifier='Disease', abbreviation='D', n_nodes=1)
+        cls.metapath = models.Metapath.objects.create(
+            abbreviation='CtD', name='CtD', source=compound, target=disease, length=1,
+            path_count_density=0.1, path_count_mean=1.0, path_count_max=10, dwpc_raw_mean=0.01,
+            n_similar=1, p_threshold=1.0,
+        )
+
+    def test_get_copy_sql(self):
+        from dj_hetmech_app.utils.loading import get_copy_sql
+        fields = [models.Node._meta.get_field(name) for name in ('id', 'identifier', 'name', 'properties')]
+        self.assertEqual(
+            get_copy_sql(models.Node, fields),
+            'COPY "dj_hetmech_app_node" ("id", "identifier", "name", "data") '
+            'FROM STDIN WITH (FORMAT csv, FORCE_NOT_NULL ("identifier", "name"))',
+        )
+        fields = [models.PathCount._meta.get_field(name) for name in ('id', 'p_value')]
+        self.assertEqual(
+            get_copy_sql(models.PathCount, fields),
+            'COPY "dj_hetmech_app_pathcount" ("id", "p_value") FROM STDIN WITH (FORMAT csv)',
+        )
+
+    def test_copy_rows(self):
+        from dj_hetmech_app.utils.loading import copy_rows
+        rows = [
+            {
+                'id': i, 'metanode_id': 'Compound', 'identifier': identifier, 'identifier_type': 'str',
+                'name': name, 'properties': {'source': name, 'ids': [i]},
+            }
+            for i, identifier, name in [(1, '', 'a, "b"'), (2, 'DB00997', 'line\nbreak'), (3, 'DOID:363', 'c')]
+        ]
+        # Rows are written in batches after the first row
+        self.assertEqual(copy_rows(models.Node, iter(rows), batch_size=1), 3)
+        nodes = models.Node.objects.order_by('id').values('id', 'identifier', 'name', 'properties')
+        self.assertEqual(list(nodes), [
+            {key: row[key] for key in ('id', 'identifier', 'name', 'properties')} for row in rows
+        ])
+        self.assertEqual(copy_rows(models.Node, iter([])), 0)
+
+    def test_copy_dataframe(self):
+        import math
+        import pandas
+        from dj_hetmech_app.utils.loading import copy_dataframe
+        dgp_df = pandas.DataFrame({
+            'metapath_id': 'CtD',
+            'source_degree': [1.0, 2.0],
+            'target_degree': [3, 4],
+            'n_dwpcs': [100.0, 100.0],
+            'n_nonzero_dwpcs': [1, 10],
+            'nonzero_mean': [1.5, 2.5],
+            'nonzero_sd': [float('nan'), 0.5],
+        })
+        self.assertEqual(copy_dataframe(models.DegreeGroupedPermutation, dgp_df), 2)
+        dgps = list(models.DegreeGroupedPermutation.objects.order_by('source_degree'))
+        self.assertEqual([(x.source_degree, x.n_dwpcs) for x in dgps], [(1, 100), (2, 100)])
+        # Missing values of non-nullable float fields are stored as NaN
+        self.assertTrue(math.isnan(dgps[0].nonzero_sd))
+        self.assertEqual(dgps[1].nonzero_sd, 0.5)
+        for id_ in 1, 2:
+            models.Node.objects.create(
+                id=id_, metanode_id='Compound', identifier=str(id_), identifier_type='str', name=str(id_), properties={})
+        path_count_df = pandas.DataFrame({
+            'metapath_id': 'CtD',
+            'node_low_id': [1, 1],
+            'node_high_id': [1, 2],
+            'inverted': [False, True],
+            'dgp_id': [dgps[0].id, dgps[1].id],
+            'path_count': [1, 2],
+            'dwpc': [0.5, 1.5],
+            'p_value': [None, 0.01],
+            'adjusted_p_value': [float('nan'), 0.02],
+        })
+        self.assertEqual(copy_dataframe(models.PathCount, path_count_df), 2)
+        # Missing values of nullable fields are stored as NULL
+        rows = models.PathCount.objects.order_by('node_high').values_list('inverted', 'p_value', 'adjusted_p_value')
+        self.assertEqual(list(rows), [(False, None, None), (True, 0.01, 0.02)])
+        self.assertEqual(copy_dataframe(models.PathCount, path_count_df.iloc[:0]), 0)
+
+
+class PopulateDatabaseTests(TestCase):
+    """
+    Stages of populate_database run on their own, with --resume skipping
+    completed units and removing rows left by interrupted ones.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        compound = models.Metanode.objects.create(identifier='Compound', abbreviation='C', n_nodes=1)
+        disease = models.Metanode.objects.create(identifier='Disease', abbreviation='D', n_nodes=1)
+        for id_, metanode, identifier in [(1, compound, 'DB00997'), (2, disease, 'DOID:363')]:
+            models.Node.objects.create(
+                id=id_, metanode=metanode, identifier=identifier, identifier_type='str',
+                name=identifier, properties={},
+            )
+        for density, abbreviation in enumerate(['CtD', 'CpD']):
+            metapath = models.Metapath.objects.create(
+                abbreviation=abbreviation, name=abbreviation, source=compound, target=disease, length=1,
+                path_count_density=density, path_count_mean=1.0, path_count_max=10, dwpc_raw_mean=0.01,
+                n_similar=1, p_threshold=1.0,
+            )
+            dgp = models.DegreeGroupedPermutation.objects.create(
+                metapath=metapath, source_degree=1, target_degree=1, n_dwpcs=100,
+                n_nonzero_dwpcs=10, nonzero_mean=1.0, nonzero_sd=0.5,
+            )
+            models.PathCount.objects.create(
+                metapath=metapath, node_low_id=1, node_high_id=2, inverted=False, dgp=dgp,
+                path_count=1, dwpc=1.5, p_value=0.01, adjusted_p_value=0.01,
+            )
+
+    @staticmethod
+    def add_node(id_, fail=False):
+        models.Node.objects.create(
+            id=id_, metanode_id='Compound', identifier=str(id_), identifier_type='str', name=str(id_), properties={})
+        if fail:
+            raise RuntimeError('interrupted')
+        return id_
+
+    def test_run_stage(self):
+        command = get_populate_command(resume=True)
+        cleanups = list()
+        # An interrupted stage leaves neither rows nor a LoadProgress record
+        with self.assertRaises(RuntimeError):
+            command._run_stage('nodes', self.add_node, 10, True)
+        self.assertFalse(models.Node.objects.filter(id=10).exists())
+        self.assertFalse(models.LoadProgress.objects.filter(stage='nodes').exists())
+        self.assertEqual(command._run_stage('nodes', self.add_node, 10, cleanup=lambda: cleanups.append(1)), 10)
+        self.assertEqual(cleanups, [1])
+        self.assertTrue(models.LoadProgress.objects.filter(stage='nodes').exists())
+        # Completed stages are skipped with --resume and rerun without it
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.assertIsNone(command._run_stage('nodes', self.add_node, 11, cleanup=lambda: cleanups.append(1)))
+        self.assertFalse(models.Node.objects.filter(id=11).exists())
+        command.options['resume'] = False
+        self.assertEqual(command._run_stage('nodes', self.add_node, 11, cleanup=lambda: cleanups.append(1)), 11)
+        self.assertEqual(cleanups, [1])
+
+    def test_resume_path_count_table(self):
+        command = get_populate_command(resume=True)
+        models.LoadProgress.objects.create(stage='path_counts_CtD')
+        scheduled = list()
+        command._populate_path_count_unit = scheduled.append
+        command._populate_path_count_table()
+        # Rows of the unfinished metapath are removed before it is loaded again
+        self.assertEqual(scheduled, ['CpD'])
+        self.assertEqual(list(models.PathCount.objects.values_list('metapath', flat=True)), ['CtD'])
+
+    def test_neo4j_node_id_map(self):
+        from django.core.management import CommandError
+        with tempfile.TemporaryDirectory() as directory:
+            path = pathlib.Path(directory).joinpath('node-ids.tsv')
+            command = get_populate_command(node_source='hetnet', node_id_map=path)
+            # Offline loads do not fall back to querying neo4j
+            with self.assertRaises(CommandError):
+                command._get_neo4j_node_id_map()
+            path.write_text('neo4j_id\tmetanode\tidentifier\n7\tCompound\tDB00997\n8\tGene\t0100\n')
+            self.assertEqual(command._get_neo4j_node_id_map(), {('Compound', 'DB00997'): 7, ('Gene', '0100'): 8})
+
+    def test_defer_constraints(self):
+        from django.db import connection
+        from dj_hetmech_app.utils.loading import get_deferrable_constraints
+        command = get_populate_command(resume=True)
+        # Check the foreign keys of the test data now, as a committed load would have,
+        # since tables with pending checks cannot be altered
+        with connection.cursor() as cursor:
+            cursor.execute('SET CONSTRAINTS ALL IMMEDIATE')
+        constraints = get_deferrable_constraints(models.PathCount)
+        self.assertIn('index', {x['kind'] for x in constraints})
+        self.assertIn('constraint', {x['kind'] for x in constraints})
+        with tempfile.TemporaryDirectory() as directory:
+            command.download_dir = pathlib.Path(directory)
+            manifest_path = command.download_dir.joinpath('deferred-constraints_dj_hetmech_app_pathcount.json')
+            command._defer_constraints(models.PathCount)
+            self.assertEqual(get_deferrable_constraints(models.PathCount), [])
+            # A resumed run keeps the manifest of the interrupted run
+            manifest = manifest_path.read_text()
+            command._defer_constraints(models.PathCount)
+            self.assertEqual(manifest_path.read_text(), manifest)
+            with contextlib.redirect_stdout(io.StringIO()):
+                command._restore_constraints(models.PathCount)
+            self.assertFalse(manifest_path.exists())
+            self.assertEqual(get_deferrable_constraints(models.PathCount), constraints)
+            # Without a manifest, there is nothing to restore
+            command._restore_constraints(models.PathCount)
+
+    def test_read_degree_grouped_permutations(self):
+        import zipfile
+        import hetmatpy.pipeline
+        import pandas
+        from dj_hetmech_app.management.commands.populate_database import read_degree_grouped_permutations
+        # Degree groups without nonzero DWPCs, with one, with equal values, and with distinct values
+        dgp_df = pandas.DataFrame({
+            'source_degree': [1, 1, 2, 3],
+            'target_degree': [1, 2, 2, 5],
+            'n': [10, 10, 20, 40],
+            'nnz': [0, 1, 3, 4],
+            'sum': [0.0, 1.5, 0.3, 10.0],
+            'sum_of_squares': [0.0, 2.25, 0.03, 30.0],
+        })
+        with tempfile.TemporaryDirectory() as directory:
+            path = pathlib.Path(directory).joinpath('degree-grouped-perms_length-2_damping-0.5.zip')
+            zip_path = 'adjusted-path-counts/dwpc-0.5/degree-grouped-permutations/CbGaD.tsv.gz'
+            with zipfile.ZipFile(path, 'w') as zip_file, zip_file.open(zip_path, 'w') as write_file:
+                dgp_df.to_csv(write_file, sep='\t', index=False, compression='gzip')
+            df = read_degree_grouped_permutations(path, zip_path)
+        expected = hetmatpy.pipeline.add_gamma_hurdle_to_dgp_df(dgp_df.copy())
+        self.assertEqual(list(df.columns), [
+            'source_degree', 'target_degree', 'n_dwpcs', 'n_nonzero_dwpcs', 'nonzero_mean', 'nonzero_sd'])
+        self.assertEqual(df.n_dwpcs.tolist(), expected.n.tolist())
+        self.assertEqual(df.n_nonzero_dwpcs.tolist(), expected.nnz.tolist())
+        pandas.testing.assert_series_equal(df.nonzero_mean, expected.mean_nz, check_names=False)
+        pandas.testing.assert_series_equal(
+            df.nonzero_sd, expected.sd_nz.astype(float), check_names=False)
+        self.assertEqual(df.nonzero_sd.isna().tolist(), [True, True, False, False])
+        self.assertEqual(df.nonzero_sd[2], 0.0)
+
+    def test_populate_path_count_metapath(self):
+        import hetmatpy.degree_weight
+        import hetmatpy.hetmat
+        import pandas
+        compound, disease = models.Metanode.objects.order_by('identifier')
+        metapath = models.Metapath.objects.create(
+            abbreviation='CbGaD', name='CbGaD', source=compound, target=disease, length=2,
+            path_count_density=0.5, path_count_mean=1.0, path_count_max=2, dwpc_raw_mean=0.5,
+            n_similar=10, p_threshold=1.0,
+        )
+        # Compound 11 has a larger id than disease 30, so their pair is inverted
+        node_ids = {'10': 5, '11': 40, '30': 20, '31': 50}
+        for identifier, id_ in node_ids.items():
+            models.Node.objects.create(
+                id=id_, metanode=compound if identifier < '30' else disease, identifier=identifier,
+                identifier_type='int', name=identifier, properties={},
+            )
+        dgp_df = pandas.DataFrame({
+            'source_degree': [2, 2, 1, 1],
+            'target_degree': [3, 2, 3, 2],
+            'n': [100] * 4,
+            'nnz': [50, 50, 50, 0],
+            'sum': [50.0, 25.0, 10.0, 0.0],
+            'sum_of_squares': [60.0, 20.0, 5.0, 0.0],
+        })
+        for row in dgp_df.itertuples():
+            models.DegreeGroupedPermutation.objects.create(
+                metapath=metapath, source_degree=row.source_degree, target_degree=row.target_degree,
+                n_dwpcs=row.n, n_nonzero_dwpcs=row.nnz, nonzero_mean=1.0, nonzero_sd=0.5,
+            )
+        with tempfile.TemporaryDirectory() as directory:
+            hetmat, _ = create_test_hetmat(directory)
+            hetmat_metapath = hetmat.metagraph.metapath_from_abbrev('CbGaD')
+            for damping in 0.0, 0.5:
+                _, _, matrix = hetmatpy.degree_weight.dwpc(hetmat, hetmat_metapath, damping=damping)
+                path = hetmat.get_path_counts_path(hetmat_metapath, 'dwpc', damping, None)
+                path.parent.mkdir(parents=True, exist_ok=True)
+                hetmatpy.hetmat.save_matrix(matrix, path)
+            path = hetmat.get_running_degree_group_path(hetmat_metapath, 'dwpc', 0.5)
+            path.parent.mkdir(parents=True)
+            dgp_df.to_csv(path, sep='\t', index=False)
+            command = get_populate_command(read_archives_in_place=False, batch_size=3)
+            command.hetmat_path = hetmat.directory
+            self.assertEqual(command._populate_path_count_metapath('CbGaD'), 4)
+        rows = list(
+            models.PathCount.objects.filter(metapath=metapath)
+            .order_by('node_low', 'node_high')
+            .values_list('node_low', 'node_high', 'inverted', 'path_count', 'p_value', 'adjusted_p_value')
+        )
+        self.assertEqual(
+            [row[:4] for row in rows],
+            [(5, 20, False, 2), (5, 50, False, 2), (20, 40, True, 1), (40, 50, False, 1)],
+        )
+        # Adjusted p-values are clipped at 1
+        for *_, p_value, adjusted_p_value in rows:
+            self.assertAlmostEqual(adjusted_p_value, min(1.0, 10 * p_value))
+        self.assertEqual(rows[0][-1], 1.0)
+        self.assertLess(max(row[-1] for row in rows[1:]), 1.0)
+
+
+class ZipHetMatTests(SimpleTestCase):
+    """
+    Path count matrices should be read from the Zenodo archives as from an
+    extracted hetmat.
+    """
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.hetmat, self.node_ids = create_test_hetmat(self.directory.name)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_read_path_counts(self):
+        import gzip
+        import zipfile
+        import hetmatpy.degree_weight
+        import hetmatpy.hetmat
+        import numpy
+        import scipy.sparse
+        from dj_hetmech_app.utils.archives import ZipHetMat
+        metapath = self.hetmat.metagraph.metapath_from_abbrev('CbGaD')
+        _, _, dwpc = hetmatpy.degree_weight.dwpc(self.hetmat, metapath, damping=0.5)
+        _, _, path_count = hetmatpy.degree_weight.dwpc(self.hetmat, metapath, damping=0.0)
+        archive_path = pathlib.Path(self.directory.name).joinpath('dwpcs.zip')
+        with zipfile.ZipFile(archive_path, 'w') as zip_file:
+            # Stored .npy members are memory mapped
+            with zip_file.open('path-counts/dwpc-0.5/CbGaD.npy', 'w') as write_file:
+                numpy.save(write_file, dwpc)
+            # Members for the metapath are read before members for its inverse
+            with zip_file.open('path-counts/dwpc-0.5/DaGbC.npy', 'w') as write_file:
+                numpy.save(write_file, numpy.zeros_like(dwpc.T))
+            # Matrices are also read from members for the inverse metapath
+            with zip_file.open('path-counts/dwpc-0.0/DaGbC.sparse.npz', 'w') as write_file:
+                scipy.sparse.save_npz(write_file, scipy.sparse.csc_matrix(path_count.T))
+            dgp_member = 'adjusted-path-counts/dwpc-0.5/degree-grouped-permutations/CbGaD.tsv.gz'
+            zip_file.writestr(dgp_member, gzip.compress(b'source_degree\ttarget_degree\n1\t2\n'))
+        zip_hetmat = ZipHetMat(self.hetmat.directory, [archive_path, archive_path.with_name('missing.zip')])
+        row_ids, col_ids, matrix = zip_hetmat.read_path_counts(metapath, 'dwpc', 0.5)
+        self.assertEqual((row_ids, col_ids), (self.node_ids['Compound'], self.node_ids['Disease']))
+        self.assertIsInstance(matrix, numpy.memmap)
+        numpy.testing.assert_array_equal(matrix, dwpc)
+        _, _, matrix = zip_hetmat.read_path_counts(metapath, 'dwpc', 0.0)
+        self.assertTrue(scipy.sparse.issparse(matrix))
+        numpy.testing.assert_array_equal(matrix.toarray(), path_count)
+        # Degree-grouped permutation tables are read into memory
+        dgp_file = zip_hetmat.get_running_degree_group_path(metapath, 'dwpc', 0.5)
+        self.assertIsInstance(dgp_file, io.BytesIO)
+        self.assertEqual(dgp_file.read(), b'source_degree\ttarget_degree\n1\t2\n')
+        # Matrices that are not archive members are read from the hetmat directory
+        metapath = self.hetmat.metagraph.metapath_from_abbrev('CbG')
+        _, _, dwpc = hetmatpy.degree_weight.dwpc(self.hetmat, metapath, damping=0.5)
+        path = self.hetmat.get_path_counts_path(metapath, 'dwpc', 0.5, None)
+        path.parent.mkdir(parents=True)
+        hetmatpy.hetmat.save_matrix(dwpc, path)
+        numpy.testing.assert_array_equal(zip_hetmat.read_path_counts(metapath, 'dwpc', 0.5)[2], dwpc)
@@ -0,0 +1,154 @@
+"""
+Read hetmat path count matrices and degree-grouped permutation tables from the
+Zenodo zip archives without extracting them.
+
+Archive members are paths relative to the hetmat directory, such as
+`path-counts/dwpc-0.5/CbGaD.sparse.npz` or
+`adjusted-path-counts/dwpc-0.5/degree-grouped-permutations/CbGaD.tsv.gz`,
+as written by `hetmatpy.hetmat.archive.create_archive`.
+"""
+
+import functools
+import gzip
+import io
+import itertools
+import pathlib
+import struct
+import zipfile
+
+import hetmatpy.degree_weight
+import hetmatpy.hetmat
+import numpy
+import scipy.sparse
+
+
+class ZipHetMat(hetmatpy.hetmat.HetMat):
+    """
+    HetMat whose path count matrices and degree-grouped permutation tables are
+    read from zip archives. Other files, such as nodes and edges, are read
+    from the hetmat directory. Stored (uncompressed) `.npy` members are memory
+    mapped from the archive. Archives are indexed on first use, so they do not
+    need to exist when the HetMat is created.
+    """
+
+    def __init__(self, directory, archive_paths):
+        super().__init__(directory)
+        self.archive_paths = [pathlib.Path(path) for path in archive_paths]
+
+    @functools.lru_cache()
+    def _get_zip_file(self, archive_path):
+        return zipfile.ZipFile(archive_path)
+
+    @property
+    @functools.lru_cache()
+    def archive_members(self):
+        """
+        Dictionary of member path to (archive path, ZipInfo).
+        """
+        members = dict()
+        for archive_path in self.archive_paths:
+            if not archive_path.exists():
+                continue
+            for info in self._get_zip_file(archive_path).infolist():
+                members[info.filename] = archive_path, info
+        return members
+
+    def get_archive_member(self, path):
+        """
+        Return (archive path, ZipInfo) for a path in the hetmat directory or
+        None if the path is not an archive member.
+        """
+        member = pathlib.Path(path).relative_to(self.directory).as_posix()
+        return self.archive_members.get(member)
+
+    def read_path_counts(self, metapath, metric, damping, file_formats=['sparse.npz', 'npy']):
+        """
+        Read a path count matrix from the archives, using the same search order
+        as HetMat.read_path_counts. Falls back to the hetmat directory for
+        matrices that are not archive members.
+        """
+        metrics = [metric]
+        if hetmatpy.degree_weight.categorize(metapath) == 'no_repeats':
+            metrics.append({'dwpc': 'dwwc', 'dwwc': 'dwpc'}[metric])
+        configurations = itertools.product(file_formats, metrics, (False, True))
+        for file_format, metric_, invert in configurations:
+            path = self.get_path_counts_path(
+                metapath=metapath.inverse if invert else metapath,
+                metric=metric_,
+                damping=damping,
+                file_format=file_format,
+            )
+            member = self.get_archive_member(path)
+            if member is None:
+                continue
+            matrix = self.read_archive_matrix(*member)
+            if invert:
+                matrix = matrix.transpose()
+            row_ids = self.get_node_identifiers(metapath.source())
+            col_ids = self.get_node_identifiers(metapath.target())
+            return row_ids, col_ids, matrix
+        return super().read_path_counts(metapath, metric, damping, file_formats=file_formats)
+
+    def read_archive_matrix(self, archive_path, info):
+        """
+        Read a `.npy` or `.sparse.npz` matrix from an archive member.
+        """
+        if info.filename.endswith('.npy') and info.compress_type == zipfile.ZIP_STORED:
+            return memmap_stored_npy(archive_path, info)
+        zip_file = self._get_zip_file(archive_path)
+        with zip_file.open(info) as read_file:
+            if info.filename.endswith('.sparse.npz'):
+                return scipy.sparse.load_npz(read_file)
+            return numpy.load(read_file)
+
+    def get_running_degree_group_path(self, metapath, metric, damping, extension='.tsv.gz'):
+        """
+        Return an in-memory file with the decompressed contents of a
+        degree-grouped permutation table in the archives, or the hetmat
+        directory path otherwise. `hetmatpy.pipeline.combine_dwpc_dgp` passes
+        the result to `pandas.read_csv`, which accepts either but does not
+        close file objects, so the member is read before returning rather
+        than leaving a handle on the archive open.
+        """
+        path = super().get_running_degree_group_path(metapath, metric, damping, extension=extension)
+        member = self.get_archive_member(path)
+        if member is None:
+            return path
+        archive_path, info = member
+        with self._get_zip_file(archive_path).open(info) as read_file:
+            data = read_file.read()
+        if extension.endswith('.gz'):
+            data = gzip.decompress(data)
+        return io.BytesIO(data)
+
+
+def get_member_data_offset(archive_path, info):
+    """
+    Return the byte offset of a zip member's data in the archive, which
+    follows the member's local file header.
+    """
+    with open(archive_path, 'rb') as read_file:
+        read_file.seek(info.header_offset)
+        header = read_file.read(30)
+    filename_length, extra_length = struct.unpack('<HH', header[26:30])
+    return info.header_offset + 30 + filename_length + extra_length
+
+
+def memmap_stored_npy(archive_path, info):
+    """
+    Memory map a `.npy` member that is stored without compression.
+    """
+    offset = get_member_data_offset(archive_path, info)
+    with open(archive_path, 'rb') as read_file:
+        read_file.seek(offset)
+        version = numpy.lib.format.read_magic(read_file)
+        if version == (1, 0):
+            header = numpy.lib.format.read_array_header_1_0(read_file)
+        else:
+            header = numpy.lib.format.read_array_header_2_0(read_file)
+        shape, fortran_order, dtype = header
+        array_offset = read_file.tell()
+    return numpy.memmap(
+        archive_path, dtype=dtype, mode='r', offset=array_offset,
+        shape=shape, order='F' if fortran_order else 'C',
+    )
@@ -0,0 +1,310 @@
+"""
+Server-side caching of API responses.
+
+Data behind the API only changes when populate_database runs, which replaces
+the DatasetVersion token. Responses are cached under keys that include the
+token, so a new load makes all earlier entries unreachable. ETags are derived
+from the same keys, so clients and proxies revalidate against the current data.
+Responses are stored zlib-compressed, and ByteLimitedLocMemCache bounds the
+memory of a per-process response cache by the size of its entries.
+"""
+
+import collections
+import hashlib
+import threading
+import time
+import urllib.parse
+import zlib
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
+from django.core.cache.backends.locmem import LocMemCache
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils.http import parse_etags
+
+_dataset_version = None
+_dataset_version_checked = None
+
+# Hits and misses of per-process response caches, by counter name
+_counters = collections.Counter()
+_counters_lock = threading.Lock()
+
+
+def get_dataset_version():
+    """
+    Return the current DatasetVersion token, or 'unversioned' for databases
+    loaded without one. The token is reused for DATASET_VERSION_TTL seconds
+    before it is read from the database again.
+    """
+    global _dataset_version, _dataset_version_checked
+    now = time.monotonic()
+    ttl = getattr(settings, 'DATASET_VERSION_TTL', 60)
+    if _dataset_version_checked is None or now - _dataset_version_checked >= ttl:
+        from dj_hetmech_app.models import DatasetVersion
+        latest = DatasetVersion.objects.order_by('-created').values_list('token', flat=True).first()
+        _dataset_version = latest or 'unversioned'
+        _dataset_version_checked = now
+    return _dataset_version
+
+
+def bump_dataset_version():
+    """
+    Record a new DatasetVersion token and return it.
+    """
+    import uuid
+    from dj_hetmech_app.models import DatasetVersion
+    global _dataset_version_checked
+    token = uuid.uuid4().hex
+    DatasetVersion.objects.create(token=token)
+    _dataset_version_checked = None
+    return token
+
+
+def cached_per_dataset_version(func):
+    """
+    Decorator to cache the result of a function without arguments in this
+    process until the dataset version changes. The wrapper's cache_clear
+    method discards the cached result.
+    """
+    import functools
+    cache = {}
+
+    @functools.wraps(func)
+    def wrapper():
+        version = get_dataset_version()
+        if cache.get('version') != version or 'result' not in cache:
+            cache['result'] = func()
+            cache['version'] = version
+        return cache['result']
+    wrapper.cache_clear = cache.clear
+    return wrapper
+
+
+def get_response_cache():
+    """
+    Return the cache for API responses, or None if response caching is disabled.
+    """
+    alias = getattr(settings, 'RESPONSE_CACHE_ALIAS', None)
+    if alias is None:
+        return None
+    return caches[alias]
+
+
+def get_response_cache_key(request, version):
+    """
+    Return the cache key for a GET request. Query parameters are sorted, so
+    `?b=2&a=1` and `?a=1&b=2` share an entry. The Accept header is included,
+    since it selects the renderer.
+    """
+    query = urllib.parse.urlencode(sorted(
+        (key, value) for key, values in request.GET.lists() for value in values
+    ))
+    accept = request.META.get('HTTP_ACCEPT', '')
+    digest = hashlib.sha256(f'{request.path}\n{query}\n{accept}'.encode()).hexdigest()
+    return f'response:{version}:{digest}'
+
+
+def is_shared_cache(cache):
+    """
+    Return whether `cache` is shared by processes, unlike LocMemCache, whose
+    entries and counters are separate for every process.
+    """
+    return not isinstance(cache, LocMemCache)
+
+
+def increment_counter(cache, name):
+    """
+    Increment the counter `name` for `cache`. Counters of per-process caches
+    are kept in this process rather than in the cache, so that eviction and
+    clear() do not reset them. Counters of shared caches are cache keys, which
+    server processes share.
+    """
+    if not is_shared_cache(cache):
+        with _counters_lock:
+            _counters[name] += 1
+        return
+    key = f'response-cache-{name}'
+    try:
+        cache.incr(key)
+    except ValueError:
+        # incr raises ValueError for missing keys
+        cache.add(key, 1, timeout=None)
+
+
+def get_response_cache_stats():
+    """
+    Return a dictionary with response cache hits and misses. With a
+    per-process backend such as LocMemCache, counts are for this process.
+    """
+    cache = get_response_cache()
+    if cache is None:
+        return {'hits': 0, 'misses': 0}
+    if not is_shared_cache(cache):
+        with _counters_lock:
+            return {name: _counters[name] for name in ('hits', 'misses')}
+    return {name: cache.get(f'response-cache-{name}', 0) for name in ('hits', 'misses')}
+
+
+def reset_response_cache_stats():
+    """
+    Reset the response cache hits and misses to zero.
+    """
+    cache = get_response_cache()
+    if cache is None:
+        return
+    if not is_shared_cache(cache):
+        with _counters_lock:
+            _counters.clear()
+        return
+    cache.delete_many([f'response-cache-{name}' for name in ('hits', 'misses')])
+
+
+def get_etag(cache_key):
+    """
+    Return a strong ETag for the response to a request with `cache_key`.
+    Responses are determined by the request and the dataset version, so the
+    ETag is computed without rendering the response.
+    """
+    return '"{}"'.format(hashlib.sha256(cache_key.encode()).hexdigest()[:32])
+
+
+def get_cache_control():
+    """
+    Return the Cache-Control header for data endpoints, or None if
+    HTTP_CACHE_MAX_AGE disables HTTP caching headers.
+    """
+    max_age = getattr(settings, 'HTTP_CACHE_MAX_AGE', None)
+    if max_age is None:
+        return None
+    return f'public, max-age={max_age}'
+
+
+class ResponseCacheMixin:
+    """
+    Mixin for read-only API views that caches GET responses by dataset version.
+    Responses carry an ETag and Cache-Control header, requests whose
+    If-None-Match contains the ETag are answered with 304 Not Modified before
+    the view runs, and successful JSON responses are served from the response
+    cache. Set cache_responses to False for views whose responses vary between
+    identical requests, which are sent with `Cache-Control: no-store` instead.
+    Set store_responses to False for views that cache their own results, which
+    keep ETags and Cache-Control but are not stored in the response cache.
+    """
+    cache_responses = True
+    store_responses = True
+
+    def dispatch(self, request, *args, **kwargs):
+        if request.method != 'GET':
+            return super().dispatch(request, *args, **kwargs)
+        cache_control = get_cache_control()
+        if not self.cache_responses:
+            response = super().dispatch(request, *args, **kwargs)
+            if cache_control is not None:
+                response['Cache-Control'] = 'no-store'
+            return response
+        cache = get_response_cache() if self.store_responses else None
+        if cache is None and cache_control is None:
+            return super().dispatch(request, *args, **kwargs)
+        key = get_response_cache_key(request, get_dataset_version())
+        etag = get_etag(key)
+        if cache_control is not None:
+            if_none_match = parse_etags(request.META.get('HTTP_IF_NONE_MATCH', ''))
+            if etag in if_none_match or '*' in if_none_match:
+                return self._set_cache_headers(HttpResponseNotModified(), etag, cache_control)
+        cached = None if cache is None else cache.get(key)
+        if cached is not None:
+            increment_counter(cache, 'hits')
+            content, content_type = cached
+            response = HttpResponse(zlib.decompress(content), content_type=content_type)
+            response['X-Response-Cache'] = 'hit'
+            return self._set_cache_headers(response, etag, cache_control)
+        response = super().dispatch(request, *args, **kwargs)
+        if response.status_code != 200:
+            return response
+        if cache is not None:
+            increment_counter(cache, 'misses')
+            # The browsable API embeds request-specific markup, so only JSON is cached
+            response.render()
+            if response['Content-Type'].startswith('application/json'):
+                cache.set(key, (zlib.compress(response.content), response['Content-Type']))
+            response['X-Response-Cache'] = 'miss'
+        return self._set_cache_headers(response, etag, cache_control)
+
+    @staticmethod
+    def _set_cache_headers(response, etag, cache_control):
+        response['Vary'] = 'Accept'
+        if cache_control is not None:
+            response['ETag'] = etag
+            response['Cache-Control'] = cache_control
+        return response
+
+
+class ByteLimitedLocMemCache(LocMemCache):
+    """
+    LocMemCache that also evicts the least recently used entries once the
+    total size of the pickled values exceeds the MAX_BYTES option, so that
+    memory is bounded for responses of any size rather than only their
+    number. Values larger than MAX_BYTES are not kept.
+    """
+
+    def __init__(self, name, params):
+        super().__init__(name, params)
+        self._max_bytes = params.get('OPTIONS', {}).get('MAX_BYTES')
+        self._sizes = _entry_sizes.setdefault(name, _EntrySizes())
+
+    def _set(self, key, value, timeout=DEFAULT_TIMEOUT):
+        self._sizes.remove(key)
+        super()._set(key, value, timeout)
+        self._sizes.add(key, len(value))
+        # The least recently used entry is last
+        while self._max_bytes is not None and self._sizes.n_bytes > self._max_bytes and self._cache:
+            evicted, _ = self._cache.popitem()
+            del self._expire_info[evicted]
+            self._sizes.remove(evicted)
+
+    def _cull(self):
+        super()._cull()
+        for key in set(self._sizes.sizes) - set(self._cache):
+            self._sizes.remove(key)
+
+    def _delete(self, key):
+        self._sizes.remove(key)
+        return super()._delete(key)
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+            self._expire_info.clear()
+            self._sizes.clear()
+
+    def get_n_bytes(self):
+        """
+        Return the total size of the pickled values in the cache.
+        """
+        return self._sizes.n_bytes
+
+
+class _EntrySizes:
+    """
+    Sizes of the entries of a ByteLimitedLocMemCache, shared like the
+    entries by the cache instances of a process with the same name.
+    """
+
+    def __init__(self):
+        self.sizes = dict()
+        self.n_bytes = 0
+
+    def add(self, key, size):
+        self.sizes[key] = size
+        self.n_bytes += size
+
+    def remove(self, key):
+        self.n_bytes -= self.sizes.pop(key, 0)
+
+    def clear(self):
+        self.sizes.clear()
+        self.n_bytes = 0
+
+
+_entry_sizes = dict()
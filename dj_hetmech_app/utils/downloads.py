@@ -0,0 +1,64 @@
+"""
+Download files over HTTP, resuming partial downloads and computing checksums
+while streaming.
+"""
+
+import concurrent.futures
+import hashlib
+import pathlib
+
+import requests
+
+
+def download_file(url, path, expected_md5=None, chunk_size=2 ** 20, timeout=60):
+    """
+    Download `url` to `path` and return the md5 hex digest of the file.
+    Data is written to `path` with a `.part` suffix until the download completes.
+    If a partial download exists, it is resumed with an HTTP Range request.
+    The checksum is computed while streaming, so the file is not read again.
+    If `expected_md5` is specified and does not match, the partial download is
+    deleted and a ValueError is raised.
+    """
+    path = pathlib.Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    part_path = path.with_name(path.name + '.part')
+    file_hash = hashlib.md5()
+    headers = dict()
+    if part_path.exists():
+        # Hash the bytes already downloaded and request the remainder
+        with part_path.open(mode='rb') as read_file:
+            while chunk := read_file.read(chunk_size):
+                file_hash.update(chunk)
+        headers['Range'] = f'bytes={part_path.stat().st_size}-'
+    with requests.get(url, headers=headers, stream=True, timeout=timeout) as response:
+        # 416 Range Not Satisfiable means the partial download is already complete
+        if response.status_code != 416:
+            response.raise_for_status()
+            if response.status_code != 206:
+                # Server ignored the Range header, so restart from the beginning
+                file_hash = hashlib.md5()
+            mode = 'ab' if response.status_code == 206 else 'wb'
+            with part_path.open(mode=mode) as write_file:
+                for chunk in response.iter_content(chunk_size=chunk_size):
+                    write_file.write(chunk)
+                    file_hash.update(chunk)
+    checksum = file_hash.hexdigest()
+    if expected_md5 is not None and checksum != expected_md5:
+        part_path.unlink()
+        raise ValueError(
+            f"Downloading {url} produced a checksum of {checksum}, "
+            f"expected {expected_md5}."
+        )
+    part_path.replace(path)
+    return checksum
+
+
+def download_files(func, args_list, n_threads=4):
+    """
+    Call func(*args) for each args in args_list on a pool of `n_threads`
+    threads and return the results in order. Intended for a download function
+    such as Command.zenodo_download.
+    """
+    with concurrent.futures.ThreadPoolExecutor(max_workers=n_threads) as executor:
+        futures = [executor.submit(func, *args) for args in args_list]
+        return [future.result() for future in futures]
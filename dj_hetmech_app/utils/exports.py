@@ -0,0 +1,139 @@
+"""
+Streaming export of PathCount rows for a single metapath.
+
+Rows are read with a server-side cursor in the order of the
+(metapath, node_low, node_high, inverted) unique index, so exports of any size
+run in constant memory, and an export can resume after its last row with
+keyset pagination rather than an OFFSET.
+"""
+
+import csv
+import io
+import itertools
+import json
+
+export_fields = [
+    'source_id',
+    'source_identifier',
+    'source_name',
+    'target_id',
+    'target_identifier',
+    'target_name',
+    'path_count',
+    'dwpc',
+    'p_value',
+    'adjusted_p_value',
+]
+
+content_types = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+    'tsv': 'text/tab-separated-values',
+}
+
+
+def get_stored_metapath(abbreviation):
+    """
+    Return the Metapath record storing `abbreviation` in either orientation
+    and whether rows must be flipped to run in the requested orientation.
+    Raises ValueError for an invalid abbreviation and Metapath.DoesNotExist
+    if neither orientation is in the database.
+    """
+    from dj_hetmech_app.models import Metapath
+    from dj_hetmech_app.utils import metapath_from_abbrev
+    try:
+        metapath = metapath_from_abbrev(abbreviation)
+    except Exception:
+        raise ValueError(f'invalid metapath abbreviation: {abbreviation}')
+    inverse = metapath.inverse.abbrev
+    record = Metapath.objects.filter(abbreviation__in=[metapath.abbrev, inverse]).first()
+    if record is None:
+        raise Metapath.DoesNotExist(f'metapath not in database: {abbreviation}')
+    return record, record.abbreviation != metapath.abbrev
+
+
+def get_export_cursor(source_id, target_id, flipped=False):
+    """
+    Return the (node_low, node_high, inverted) key of the PathCount row that
+    runs from source_id to target_id in an export, which keyset pagination
+    resumes after. `flipped` is whether the export runs opposite to the
+    stored metapath. Self-pairs are stored once, with inverted false.
+    """
+    node_low, node_high = sorted((source_id, target_id))
+    # Stored rows run from node_high when inverted, and flipped rows reverse that
+    if flipped:
+        source_id, target_id = target_id, source_id
+    return node_low, node_high, source_id > target_id
+
+
+def get_export_rows(abbreviation, max_adjusted_p_value=None, after=None, limit=None, chunk_size=2_000):
+    """
+    Yield PathCount rows for a metapath as dictionaries with `export_fields`,
+    running from source to target in the orientation of `abbreviation`.
+
+    Rows are ordered by canonical node pair. `after` is the (source_id,
+    target_id) of the last row of a previous export, which resumes the export
+    from the following row. `max_adjusted_p_value` restricts to rows whose
+    adjusted p-value is at most the cutoff. `chunk_size` sets the number of
+    rows fetched per round trip of the server-side cursor.
+    """
+    from django.db.models import Q
+    from dj_hetmech_app.models import PathCount
+    metapath, flipped = get_stored_metapath(abbreviation)
+    query_set = PathCount.objects.filter(metapath=metapath)
+    if max_adjusted_p_value is not None:
+        query_set = query_set.filter(adjusted_p_value__lte=max_adjusted_p_value)
+    if after is not None:
+        node_low, node_high, inverted = get_export_cursor(*after, flipped=flipped)
+        query_set = query_set.filter(
+            Q(node_low__gt=node_low)
+            | Q(node_low=node_low, node_high__gt=node_high)
+            | Q(node_low=node_low, node_high=node_high, inverted__gt=inverted)
+        )
+    query_set = query_set.order_by('node_low', 'node_high', 'inverted')
+    if limit is not None:
+        query_set = query_set[:limit]
+    values = query_set.values(
+        'node_low', 'node_low__identifier', 'node_low__name',
+        'node_high', 'node_high__identifier', 'node_high__name',
+        'inverted', 'path_count', 'dwpc', 'p_value', 'adjusted_p_value',
+    )
+    for row in values.iterator(chunk_size=chunk_size):
+        source, target = ('node_high', 'node_low') if row['inverted'] != flipped else ('node_low', 'node_high')
+        yield {
+            'source_id': row[source],
+            'source_identifier': row[f'{source}__identifier'],
+            'source_name': row[f'{source}__name'],
+            'target_id': row[target],
+            'target_identifier': row[f'{target}__identifier'],
+            'target_name': row[f'{target}__name'],
+            'path_count': row['path_count'],
+            'dwpc': row['dwpc'],
+            'p_value': row['p_value'],
+            'adjusted_p_value': row['adjusted_p_value'],
+        }
+
+
+def format_export_rows(rows, output='ndjson', chunk_size=2_000):
+    """
+    Yield strings of `chunk_size` rows formatted as newline-delimited JSON,
+    CSV, or TSV. CSV and TSV start with a header line.
+    """
+    if output not in content_types:
+        raise ValueError(f"output must be one of {', '.join(content_types)}")
+    rows = iter(rows)
+    chunks = iter(lambda: list(itertools.islice(rows, chunk_size)), [])
+    if output == 'ndjson':
+        for chunk in chunks:
+            yield ''.join(json.dumps(row) + '\n' for row in chunk)
+        return
+    delimiter = ',' if output == 'csv' else '\t'
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=export_fields, delimiter=delimiter, lineterminator='\n')
+    writer.writeheader()
+    for chunk in itertools.chain(chunks, [[]]):
+        writer.writerows(chunk)
+        if buffer.tell():
+            yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
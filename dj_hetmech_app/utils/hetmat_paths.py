@@ -0,0 +1,410 @@
+"""
+Path enumeration on the Hetionet hetmat as an alternative to the Neo4j PDP query.
+
+HetmatPathEngine returns the paths of a metapath between two nodes with their
+path degree products (PDP) and percent_of_DWPC, as computed by the Cypher
+query of `hetnetpy.neo4j.construct_pdp_query`, from the hetmat adjacency
+matrices that populate_database downloads. Adjacency matrices are converted
+once to CSR arrays saved as `.npy` files next to the hetmat, which every
+process memory maps.
+
+Paths are extended one metaedge at a time from the source node, only into
+nodes from which the target node can be reached, so every extended path is
+either discarded for repeating a node or completes a path. The path count and
+DWPC of a node pair are read from the hetmat's DWPC matrices, so with a
+`limit`, partial paths are discarded once the largest PDP they can reach falls
+below the PDP of the `limit`-th best path found so far, and the most promising
+partial paths are extended first. Without DWPC matrices, all paths are
+enumerated to sum their PDPs.
+
+Node ids are Node table ids, which are Neo4j node ids. The hetmat does not
+store relationship ids or properties, so relationships are identified by
+strings like `1234:BINDS_CbG:5678` of their start node id, Neo4j relationship
+type, and end node id.
+"""
+
+import functools
+import pathlib
+
+import numpy
+
+from dj_hetmech_app.utils import get_hetionet_metagraph
+from dj_hetmech_app.utils.cache import cached_per_dataset_version
+
+
+@cached_per_dataset_version
+def get_hetmat_path_engine():
+    """
+    Return the HetmatPathEngine for settings.HETMAT_PATH and the current
+    dataset version.
+    """
+    from django.conf import settings
+    return HetmatPathEngine.from_database(settings.HETMAT_PATH)
+
+
+class HetmatPathEngine:
+    """
+    Path enumeration over the adjacency matrices of a hetmat. `node_ids` is a
+    dictionary of metanode identifier to an array of the Node id of each
+    hetmat node position, with -1 for nodes that are not in the Node table.
+    CSR arrays are written to `csr_directory`, which defaults to the
+    `adjacency-csr` directory of the hetmat.
+    """
+
+    def __init__(self, hetmat, node_ids, csr_directory=None, chunk_size=100_000):
+        self.hetmat = hetmat
+        self.metagraph = get_hetionet_metagraph()
+        self.node_ids = {metanode: numpy.asarray(ids, dtype=numpy.int64) for metanode, ids in node_ids.items()}
+        self.csr_directory = pathlib.Path(csr_directory or hetmat.directory.joinpath('adjacency-csr'))
+        self.chunk_size = chunk_size
+
+    @classmethod
+    def from_database(cls, hetmat_path, **kwargs):
+        """
+        Return a HetmatPathEngine for the hetmat at `hetmat_path` whose node
+        positions are mapped to Node ids by metanode and identifier.
+        """
+        import hetmatpy.hetmat
+        import pandas
+        from dj_hetmech_app.models import Node
+        hetmat = hetmatpy.hetmat.HetMat(hetmat_path)
+        node_ids = dict()
+        for metanode in hetmat.metagraph.get_nodes():
+            node_df = pandas.read_csv(hetmat.get_nodes_path(metanode), sep='\t', dtype={'identifier': str})
+            identifier_to_id = dict(
+                Node.objects.filter(metanode=metanode.identifier).values_list('identifier', 'id'))
+            node_ids[metanode.identifier] = [identifier_to_id.get(x, -1) for x in node_df.identifier]
+        return cls(hetmat, node_ids, **kwargs)
+
+    @functools.lru_cache(maxsize=None)
+    def get_csr(self, metaedge):
+        """
+        Return memory-mapped (indptr, indices) CSR arrays of the adjacency
+        matrix of `metaedge`, with rows for its source nodes.
+        """
+        metaedge = self.metagraph.get_metaedge(metaedge)
+        paths = [self.csr_directory.joinpath(f'{metaedge.get_abbrev()}.{name}.npy') for name in ('indptr', 'indices')]
+        if not all(path.exists() for path in paths):
+            import scipy.sparse
+            _, _, matrix = self.hetmat.metaedge_to_adjacency_matrix(metaedge, dtype=bool, dense_threshold=1)
+            matrix = scipy.sparse.csr_matrix(matrix)
+            matrix.sort_indices()
+            self.csr_directory.mkdir(parents=True, exist_ok=True)
+            for path, array in zip(paths, (matrix.indptr, matrix.indices)):
+                # Write to a temporary path so that other processes never read a partial file
+                temp_path = path.with_name(f'{path.stem}.tmp.npy')
+                numpy.save(temp_path, array.astype(numpy.int32))
+                temp_path.replace(path)
+        return tuple(numpy.load(path, mmap_mode='r') for path in paths)
+
+    @functools.lru_cache(maxsize=None)
+    def get_degrees(self, metaedge):
+        """
+        Return the degree of each source node of `metaedge`.
+        """
+        indptr, _ = self.get_csr(metaedge)
+        return numpy.diff(indptr)
+
+    @functools.lru_cache(maxsize=None)
+    def get_id_to_position(self, metanode):
+        """
+        Return a dictionary of Node id to hetmat node position for `metanode`.
+        """
+        ids = self.node_ids[self.metagraph.get_metanode(metanode).identifier]
+        return {node_id: position for position, node_id in enumerate(ids.tolist()) if node_id >= 0}
+
+    def get_position(self, metanode, node_id):
+        """
+        Return the hetmat node position of a Node id. Raises KeyError if the
+        node is not in the hetmat.
+        """
+        return self.get_id_to_position(metanode)[node_id]
+
+    def get_node_degree(self, node_id, metaedge):
+        """
+        Return the degree of a node for `metaedge`, where the node is of its
+        source metanode. Equivalent to `dj_hetmech_app.utils.paths.get_node_degree`.
+        """
+        metaedge = self.metagraph.get_metaedge(metaedge)
+        position = self.get_position(metaedge.source, node_id)
+        return int(self.get_degrees(metaedge)[position])
+
+    def get_neighbors(self, metaedge, positions):
+        """
+        Return the positions of nodes adjacent to `positions` by `metaedge`,
+        with one entry per edge, and the index in `positions` of each edge.
+        """
+        indptr, indices = self.get_csr(metaedge)
+        starts = indptr[positions].astype(numpy.int64)
+        counts = indptr[positions + 1] - starts
+        rows = numpy.repeat(numpy.arange(len(positions)), counts)
+        offsets = numpy.arange(counts.sum()) - numpy.repeat(numpy.cumsum(counts) - counts, counts)
+        return indices[starts[rows] + offsets], rows
+
+    def get_degree_weights(self, metaedge, damping=0.5):
+        """
+        Return the degree of each source node of `metaedge` raised to the
+        power of -damping, the factor of a path's PDP for leaving that node
+        by `metaedge`. Nodes without edges have weight 1.
+        """
+        return numpy.maximum(self.get_degrees(metaedge), 1).astype(numpy.float64) ** -damping
+
+    def get_suffix_bounds(self, metapath, target, damping=0.5):
+        """
+        Return an array for each node of `metapath`, from source to target,
+        of the largest product of degree weights over walks from each node
+        position to the target node position. This bounds the PDP factor of
+        the remainder of any path through the node, since paths are walks
+        that do not repeat nodes. Nodes from which the target is not
+        reachable have a bound of 0.
+        """
+        bounds = [None] * len(metapath) + [numpy.zeros(self.hetmat.count_nodes(metapath.target()))]
+        bounds[-1][target] = 1.0
+        for i in reversed(range(len(metapath))):
+            metaedge = metapath[i]
+            # Only edges into nodes from which the target is reachable are read
+            reachable = numpy.flatnonzero(bounds[i + 1])
+            weights = self.get_degree_weights(metaedge.inverse, damping)[reachable] * bounds[i + 1][reachable]
+            neighbors, rows = self.get_neighbors(metaedge.inverse, reachable)
+            bounds[i] = numpy.zeros(self.hetmat.count_nodes(metaedge.source))
+            numpy.maximum.at(bounds[i], neighbors, weights[rows])
+            bounds[i][neighbors] *= self.get_degree_weights(metaedge, damping)[neighbors]
+        return bounds
+
+    def iter_paths(self, metapath, source, target, damping=0.5, get_threshold=None):
+        """
+        Yield (paths, pdps) for the paths of `metapath` from the source to the
+        target node position, where paths are arrays of node positions with
+        one path per row. Paths do not repeat nodes, as with the
+        `unique_nodes='labeled'` Cypher clause. Arrays have at most about
+        `chunk_size` rows.
+
+        `get_threshold` is a function returning the smallest PDP of interest,
+        which is called as paths are extended, so that partial paths that
+        cannot reach it are discarded. Partial paths with the largest bound
+        on their PDP are extended first.
+        """
+        bounds = self.get_suffix_bounds(metapath, target, damping)
+        if not bounds[0][source]:
+            return
+        metanodes = metapath.get_nodes()
+        # Earlier nodes of each path that the node at each index must differ from
+        repeat_indices = [
+            [j for j in range(i) if metanodes[j] == metanodes[i]]
+            for i in range(len(metanodes))
+        ]
+        stack = [(numpy.array([[source]], dtype=numpy.int64), numpy.ones(1), 0)]
+        while stack:
+            paths, pdps, i = stack.pop()
+            if get_threshold is not None:
+                # Allow for rounding, so that paths tied with the threshold are kept
+                keep = pdps * bounds[i][paths[:, i]] >= get_threshold() * (1 - 1e-9)
+                paths, pdps = paths[keep], pdps[keep]
+                if not len(pdps):
+                    continue
+            if i == len(metapath):
+                yield paths, pdps
+                continue
+            metaedge = metapath[i]
+            source_weights = self.get_degree_weights(metaedge, damping)
+            target_weights = self.get_degree_weights(metaedge.inverse, damping)
+            # Split paths so that extending each part yields about chunk_size paths
+            indptr, _ = self.get_csr(metaedge)
+            counts = numpy.cumsum(indptr[paths[:, i] + 1] - indptr[paths[:, i]])
+            splits = numpy.searchsorted(counts, numpy.arange(self.chunk_size, counts[-1], self.chunk_size))
+            extended = list()
+            for part, part_pdps in zip(*(numpy.split(x, numpy.unique(splits[splits > 0])) for x in (paths, pdps))):
+                neighbors, rows = self.get_neighbors(metaedge, part[:, i])
+                keep = bounds[i + 1][neighbors] > 0
+                for j in repeat_indices[i + 1]:
+                    keep &= part[rows, j] != neighbors
+                if not keep.any():
+                    continue
+                rows, neighbors = rows[keep], neighbors[keep]
+                # Multiply in the order of get_path_degree_products, for identical PDPs
+                extended_pdps = part_pdps[rows] * source_weights[part[rows, i]]
+                extended_pdps *= target_weights[neighbors]
+                extended.append((numpy.column_stack([part[rows], neighbors]), extended_pdps))
+            if not extended:
+                continue
+            paths, pdps = (numpy.concatenate(x) for x in zip(*extended))
+            if get_threshold is not None:
+                # Push the paths with the largest bounds last, so that they are extended first
+                order = numpy.argsort(pdps * bounds[i + 1][paths[:, i + 1]], kind='stable')
+                paths, pdps = paths[order], pdps[order]
+            for start in range(0, len(pdps), self.chunk_size):
+                stack.append((paths[start:start + self.chunk_size], pdps[start:start + self.chunk_size], i + 1))
+
+    def get_path_degree_products(self, metapath, paths, damping=0.5):
+        """
+        Return the PDP of each path, the product of the source and target
+        degree of each edge raised to the power of -damping.
+        """
+        pdps = numpy.ones(len(paths))
+        for i, metaedge in enumerate(metapath):
+            pdps *= self.get_degree_weights(metaedge, damping)[paths[:, i]]
+            pdps *= self.get_degree_weights(metaedge.inverse, damping)[paths[:, i + 1]]
+        return pdps
+
+    @functools.lru_cache(maxsize=16)
+    def get_path_count_matrix(self, metapath, damping):
+        """
+        Return (matrix, transpose) for the DWPCs of the metapath abbreviation
+        `metapath` with `damping`, which are path counts when damping is 0,
+        where transpose is whether the matrix is stored for the inverse
+        metapath. Files are located as by HetMat.read_path_counts. Dense
+        matrices are memory-mapped and sparse matrices are read as CSR.
+        Returns None if the hetmat does not have the matrix.
+        """
+        import itertools
+        import hetmatpy.degree_weight
+        import scipy.sparse
+        metapath = self.metagraph.get_metapath(metapath)
+        metrics = ['dwpc']
+        if hetmatpy.degree_weight.categorize(metapath) == 'no_repeats':
+            metrics.append('dwwc')
+        for file_format, metric, transpose in itertools.product(['npy', 'sparse.npz'], metrics, [False, True]):
+            path = self.hetmat.get_path_counts_path(
+                metapath.inverse if transpose else metapath, metric, damping, file_format)
+            if not path.exists():
+                continue
+            if file_format == 'npy':
+                return numpy.load(path, mmap_mode='r'), transpose
+            return scipy.sparse.load_npz(path).tocsr(), transpose
+        return None
+
+    def get_path_count_value(self, metapath, source, target, damping):
+        """
+        Return the DWPC with `damping` of the node positions source and
+        target for `metapath` from the hetmat's path count matrices, or None
+        if the hetmat does not have the matrix.
+        """
+        matrix = self.get_path_count_matrix(metapath.abbrev, float(damping))
+        if matrix is None:
+            return None
+        matrix, transpose = matrix
+        if transpose:
+            source, target = target, source
+        return float(matrix[source, target])
+
+    def get_pdp_rows(self, metapath, source_id, target_id, limit=None, damping=0.5):
+        """
+        Return (rows, path_count, dwpc) for the paths of `metapath` from
+        the source to the target Node id. `rows` are dictionaries with
+        `node_ids`, `rel_ids`, `PDP`, and `percent_of_DWPC` for up to `limit`
+        paths, ordered by decreasing PDP, like the rows of the Neo4j PDP query.
+        `path_count` and `dwpc` are for all paths, as read from the hetmat's
+        DWPC matrices or summed over all paths if the hetmat does not have
+        them. Nodes that are not in the hetmat as the source or target
+        metanode of `metapath` have no paths.
+        """
+        metapath = self.metagraph.get_metapath(metapath)
+        try:
+            source = self.get_position(metapath.source(), source_id)
+            target = self.get_position(metapath.target(), target_id)
+        except KeyError:
+            return [], 0, 0.0
+        path_count = self.get_path_count_value(metapath, source, target, 0.0)
+        dwpc = self.get_path_count_value(metapath, source, target, damping)
+        stored = path_count is not None and dwpc is not None
+        if stored and limit == 0:
+            return [], round(path_count), dwpc
+        top_paths = numpy.zeros((0, len(metapath) + 1), dtype=numpy.int64)
+        top_pdps = numpy.zeros(0)
+
+        def get_threshold():
+            return top_pdps[-1] if len(top_pdps) >= limit else 0.0
+
+        summed_count, summed_dwpc = 0, 0.0
+        prune = stored and limit is not None
+        for paths, pdps in self.iter_paths(metapath, source, target, damping, get_threshold if prune else None):
+            summed_count += len(pdps)
+            summed_dwpc += float(pdps.sum())
+            top_paths, top_pdps = select_top_paths(
+                numpy.concatenate([top_paths, paths]), numpy.concatenate([top_pdps, pdps]), limit)
+        if stored:
+            path_count = round(path_count)
+        else:
+            path_count, dwpc = summed_count, summed_dwpc
+        node_ids = numpy.column_stack([
+            self.node_ids[metanode.identifier][top_paths[:, i]]
+            for i, metanode in enumerate(metapath.get_nodes())
+        ]).tolist() if len(top_paths) else []
+        rows = list()
+        for path_node_ids, pdp in zip(node_ids, top_pdps.tolist()):
+            rows.append({
+                'node_ids': path_node_ids,
+                'rel_ids': get_rel_ids(metapath, path_node_ids),
+                'PDP': pdp,
+                'percent_of_DWPC': 100 * pdp / dwpc,
+            })
+        return rows, path_count, dwpc
+
+    def get_node_info(self, node_ids):
+        """
+        Return information on nodes in the format of
+        `dj_hetmech_app.utils.paths.get_neo4j_node_info`, from the Node table.
+        """
+        from dj_hetmech_app.models import Node
+        id_to_info = dict()
+        for node in Node.objects.filter(id__in=node_ids).select_related('metanode').order_by('id'):
+            properties = dict(node.properties, identifier=node.get_cast_identifier(), name=node.name)
+            id_to_info[node.id] = {
+                'neo4j_id': node.id,
+                'node_label': node.metanode.identifier,
+                'properties': properties,
+                'metanode': node.metanode.identifier,
+            }
+        return id_to_info
+
+    def get_rel_info(self, rel_ids):
+        """
+        Return information on relationships in the format of
+        `dj_hetmech_app.utils.paths.get_neo4j_rel_info`. Properties are empty,
+        since the hetmat does not store them.
+        """
+        id_to_info = dict()
+        for rel_id in sorted(rel_ids):
+            source_id, rel_type, target_id = rel_id.split(':')
+            metaedge = self.metagraph.get_metaedge(rel_type)
+            id_to_info[rel_id] = {
+                'neo4j_id': rel_id,
+                'rel_type': rel_type,
+                'source_neo4j_id': int(source_id),
+                'target_neo4j_id': int(target_id),
+                'properties': {},
+                'kind': metaedge.kind,
+                'directed': metaedge.direction != 'both',
+            }
+        return id_to_info
+
+
+def select_top_paths(paths, pdps, limit=None):
+    """
+    Return the `limit` paths with the largest PDPs and their PDPs, ordered by
+    decreasing PDP and then by node positions. Returns all paths if `limit`
+    is None.
+    """
+    if limit is not None and len(pdps) > limit:
+        if limit == 0:
+            return paths[:0], pdps[:0]
+        # Keep paths tied with the limit-th PDP so that ties are broken by node positions
+        threshold = numpy.partition(pdps, len(pdps) - limit)[len(pdps) - limit]
+        keep = pdps >= threshold
+        paths, pdps = paths[keep], pdps[keep]
+    order = numpy.lexsort(tuple(paths[:, ::-1].T) + (-pdps,))[:limit]
+    return paths[order], pdps[order]
+
+
+def get_rel_ids(metapath, node_ids):
+    """
+    Return relationship ids for a path of `metapath` through `node_ids`.
+    Relationships start at the source node of the metaedge as stored in
+    Hetionet, which is the target node of the path step for inverted metaedges.
+    """
+    rel_ids = list()
+    for metaedge, source_id, target_id in zip(metapath, node_ids, node_ids[1:]):
+        if metaedge.inverted:
+            source_id, target_id = target_id, source_id
+        rel_ids.append(f'{source_id}:{metaedge.neo4j_rel_type}:{target_id}')
+    return rel_ids
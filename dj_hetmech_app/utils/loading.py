@@ -0,0 +1,210 @@
+"""
+Helpers for writing rows to database tables during populate_database.
+
+Rows are dictionaries keyed by model field attnames (e.g. `metapath_id` rather
+than `metapath`), so the same rows can be written with either loader.
+"""
+
+import csv
+import datetime
+import io
+import itertools
+import json
+
+
+def bulk_create_rows(model, rows, batch_size=5_000):
+    """
+    Write rows to the table for `model` with Django's bulk_create.
+    Returns the number of rows written.
+    """
+    n_rows = 0
+    objs = list()
+    for row in rows:
+        objs.append(model(**row))
+        if len(objs) >= batch_size:
+            model.objects.bulk_create(objs)
+            n_rows += len(objs)
+            objs = list()
+    model.objects.bulk_create(objs)
+    return n_rows + len(objs)
+
+
+def copy_rows(model, rows, batch_size=5_000):
+    """
+    Write rows to the table for `model` with PostgreSQL's `COPY ... FROM STDIN`,
+    streaming `batch_size` rows at a time through an in-memory CSV buffer.
+    Columns are taken from the keys of the first row.
+    Returns the number of rows written.
+    """
+    from django.db import connection
+    rows = iter(rows)
+    first_row = next(rows, None)
+    if first_row is None:
+        return 0
+    fields = [model._meta.get_field(name) for name in first_row]
+    sql = get_copy_sql(model, fields)
+    n_rows = 0
+    chunks = iter(lambda: list(itertools.islice(rows, batch_size)), [])
+    with connection.cursor() as cursor:
+        for chunk in itertools.chain([[first_row]], chunks):
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            for row in chunk:
+                writer.writerow(map(format_copy_value, row.values()))
+            buffer.seek(0)
+            cursor.copy_expert(sql, buffer)
+            n_rows += len(chunk)
+    return n_rows
+
+
+def copy_dataframe(model, df):
+    """
+    Write a DataFrame, whose columns are field attnames, to the table for
+    `model` with a single `COPY ... FROM STDIN`. Missing values are written as
+    NULL for nullable fields and as NaN for other float fields.
+    Returns the number of rows written.
+    """
+    from django.db import connection
+    if df.empty:
+        return 0
+    fields = [model._meta.get_field(name) for name in df.columns]
+    df = df.copy()
+    for field in fields:
+        column = df[field.attname]
+        if field.get_internal_type().endswith('IntegerField') and column.dtype.kind == 'f':
+            # Integer counts computed as floats would be written as '2.0'
+            df[field.attname] = column.astype('Int64')
+        elif not field.null and field.get_internal_type() == 'FloatField':
+            column = df[field.attname]
+            df[field.attname] = column.where(column.notna(), 'NaN')
+    buffer = io.StringIO()
+    df.to_csv(buffer, header=False, index=False)
+    buffer.seek(0)
+    with connection.cursor() as cursor:
+        cursor.copy_expert(get_copy_sql(model, fields), buffer)
+    return len(df)
+
+
+def get_copy_sql(model, fields):
+    """
+    Return the `COPY ... FROM STDIN` statement for writing CSV to the
+    columns of `fields`. Unquoted empty values are read as NULL by PostgreSQL,
+    so FORCE_NOT_NULL is set for non-nullable text columns.
+    """
+    from django.db import connection
+    quote = connection.ops.quote_name
+    columns = ', '.join(quote(field.column) for field in fields)
+    not_null = ', '.join(
+        quote(field.column) for field in fields
+        if not field.null and field.get_internal_type() in {'CharField', 'TextField'}
+    )
+    options = 'FORMAT csv'
+    if not_null:
+        options += f', FORCE_NOT_NULL ({not_null})'
+    return f'COPY {quote(model._meta.db_table)} ({columns}) FROM STDIN WITH ({options})'
+
+
+def format_copy_value(value):
+    """
+    Format a python value for a CSV COPY buffer.
+    """
+    if isinstance(value, (dict, list)):
+        return json.dumps(value)
+    return value
+
+
+def get_deferrable_constraints(model):
+    """
+    Return the unique and foreign key constraints and the secondary indexes
+    of the table for `model` as a list of dictionaries with name, kind, and
+    definition keys. The primary key and indexes that back constraints are
+    excluded. Constraints are listed before indexes.
+    """
+    from django.db import connection
+    table = model._meta.db_table
+    with connection.cursor() as cursor:
+        cursor.execute(
+            """
+            SELECT conname, pg_get_constraintdef(oid)
+            FROM pg_constraint
+            WHERE conrelid = %s::regclass AND contype IN ('u', 'f')
+            ORDER BY contype DESC, conname
+            """,
+            [table],
+        )
+        constraints = [
+            {'name': name, 'kind': 'constraint', 'definition': definition}
+            for name, definition in cursor.fetchall()
+        ]
+        cursor.execute(
+            """
+            SELECT indexname, indexdef
+            FROM pg_indexes
+            WHERE tablename = %s AND indexname NOT IN (
+                SELECT conname FROM pg_constraint WHERE conrelid = %s::regclass
+            )
+            ORDER BY indexname
+            """,
+            [table, table],
+        )
+        indexes = [
+            {'name': name, 'kind': 'index', 'definition': definition}
+            for name, definition in cursor.fetchall()
+        ]
+    return constraints + indexes
+
+
+def drop_constraints(model, constraints):
+    """
+    Drop constraints and indexes, as returned by get_deferrable_constraints,
+    from the table for `model`.
+    """
+    from django.db import connection
+    quote = connection.ops.quote_name
+    table = quote(model._meta.db_table)
+    with connection.cursor() as cursor:
+        for constraint in constraints:
+            name = quote(constraint['name'])
+            if constraint['kind'] == 'constraint':
+                cursor.execute(f'ALTER TABLE {table} DROP CONSTRAINT IF EXISTS {name}')
+            else:
+                cursor.execute(f'DROP INDEX IF EXISTS {name}')
+
+
+def restore_constraints(model, constraints):
+    """
+    Rebuild constraints and indexes, as returned by get_deferrable_constraints,
+    on the table for `model`. Indexes are built first, so unique and foreign
+    key constraints are validated last. Prints the build time of each and
+    runs ANALYZE on the table afterwards.
+    """
+    import time
+    from django.db import connection
+    quote = connection.ops.quote_name
+    table = quote(model._meta.db_table)
+    ordered = sorted(constraints, key=lambda x: x['kind'] != 'index')
+    with connection.cursor() as cursor:
+        for constraint in ordered:
+            start = time.perf_counter()
+            if constraint['kind'] == 'constraint':
+                cursor.execute(
+                    f"ALTER TABLE {table} ADD CONSTRAINT {quote(constraint['name'])} "
+                    f"{constraint['definition']}"
+                )
+            else:
+                cursor.execute(constraint['definition'])
+            seconds = time.perf_counter() - start
+            print(f"built {constraint['kind']} {constraint['name']} in {datetime.timedelta(seconds=round(seconds))}")
+        start = time.perf_counter()
+        cursor.execute(f'ANALYZE {table}')
+        seconds = time.perf_counter() - start
+        print(f'analyzed {model._meta.db_table} in {datetime.timedelta(seconds=round(seconds))}')
+
+
+def report_throughput(label, n_rows, seconds):
+    """
+    Print the number of rows written to a table and the rows per second.
+    """
+    rate = n_rows / seconds if seconds else float('nan')
+    timedelta = datetime.timedelta(seconds=round(seconds))
+    print(f'{label}: wrote {n_rows:,} rows in {timedelta} ({rate:,.0f} rows/s)')
@@ -0,0 +1,306 @@
+"""
+Two-tier cache of get_paths results for the paths endpoint.
+
+Results are stored as zlib-compressed JSON in an in-process LRU cache bounded
+by PATHS_CACHE_MAX_BYTES, backed by an SQLite database at PATHS_CACHE_PATH
+that all processes share and that persists across restarts. The database keeps
+up to PATHS_CACHE_MAX_DISK_BYTES of results, evicting the least recently used,
+and holds the hit and miss counters of all processes. Entries are keyed by
+dataset version, path engine, metapath, source, and target, and record the
+limit they were computed with. A result computed with a larger limit, or with
+all paths, answers requests for smaller limits. The paths endpoint is not also
+stored in the response cache.
+"""
+
+import collections
+import functools
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+import zlib
+
+from dj_hetmech_app.utils.cache import get_dataset_version
+
+
+def get_path_cache():
+    """
+    Return the PathResultCache for the PATHS_CACHE_MAX_BYTES,
+    PATHS_CACHE_PATH, and PATHS_CACHE_MAX_DISK_BYTES settings.
+    """
+    from django.conf import settings
+    return _get_path_cache(
+        getattr(settings, 'PATHS_CACHE_MAX_BYTES', 0),
+        getattr(settings, 'PATHS_CACHE_PATH', None),
+        getattr(settings, 'PATHS_CACHE_MAX_DISK_BYTES', None),
+    )
+
+
+@functools.lru_cache()
+def _get_path_cache(max_bytes, path, max_disk_bytes):
+    return PathResultCache(max_bytes, path, max_disk_bytes)
+
+
+def get_cached_paths(metapath, source_id, target_id, limit=None, engine=None):
+    """
+    Return (json_obj, tier) for `dj_hetmech_app.utils.paths.get_paths`, where
+    tier is 'memory' or 'disk' for results read from the cache and 'miss' for
+    results computed by get_paths. Cached results are as after JSON
+    serialization, so `nodes` and `relationships` have string keys.
+    """
+    from django.conf import settings
+    from dj_hetmech_app.utils import get_hetionet_metagraph
+    from dj_hetmech_app.utils.paths import get_paths
+    engine = engine or settings.PATHS_ENGINE
+    metapath = get_hetionet_metagraph().get_metapath(metapath).abbrev
+    cache = get_path_cache()
+    version = get_dataset_version()
+    key = cache.get_key(version, engine, metapath, source_id, target_id)
+    json_obj, tier = cache.get(key, limit)
+    if json_obj is None:
+        json_obj = get_paths(metapath, source_id, target_id, limit=limit, engine=engine)
+        cache.set(key, version, json_obj, limit)
+    return json_obj, tier
+
+
+def limit_paths(json_obj, limit=None):
+    """
+    Return a get_paths result restricted to its first `limit` paths and the
+    nodes and relationships on them.
+    """
+    if limit is None or limit >= len(json_obj['paths']):
+        return dict(json_obj, query=dict(json_obj['query'], limit=limit))
+    paths = json_obj['paths'][:limit]
+    node_ids = {str(node_id) for path in paths for node_id in path['node_ids']}
+    rel_ids = {str(rel_id) for path in paths for rel_id in path['rel_ids']}
+    return dict(
+        json_obj,
+        query=dict(json_obj['query'], limit=limit),
+        paths=paths,
+        nodes={key: value for key, value in json_obj['nodes'].items() if str(key) in node_ids},
+        relationships={key: value for key, value in json_obj['relationships'].items() if str(key) in rel_ids},
+    )
+
+
+class PathResultCache:
+    """
+    Cache of get_paths results in an in-process LRU of up to `max_bytes` of
+    compressed results, backed by an SQLite database at `path` unless `path`
+    is None. The database keeps up to `max_disk_bytes` of results, or any
+    amount if None, and is pruned to that size every `prune_interval` results
+    it stores. Hits and misses are counted in process and added to the
+    database every `flush_interval` requests and when stats are read, so
+    memory hits do not write to the database.
+    """
+
+    prune_interval = 100
+    flush_interval = 100
+
+    def __init__(self, max_bytes=0, path=None, max_disk_bytes=None):
+        self.max_bytes = max_bytes
+        self.path = path
+        self.max_disk_bytes = max_disk_bytes
+        self.entries = collections.OrderedDict()
+        self.n_bytes = 0
+        self.counts = collections.Counter()
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.pruned_version = None
+        self.n_stored = 0
+        self.n_counted = 0
+
+    @staticmethod
+    def get_key(version, engine, metapath, source_id, target_id):
+        return hashlib.sha256(f'{version}\n{engine}\n{metapath}\n{source_id}\n{target_id}'.encode()).hexdigest()
+
+    @staticmethod
+    def covers(entry_limit, complete, limit):
+        """
+        Return whether an entry computed with `entry_limit` answers a request
+        for `limit`. Complete entries contain every path.
+        """
+        return bool(complete) or (limit is not None and limit <= entry_limit)
+
+    def get_connection(self):
+        """
+        Return this thread's connection to the SQLite database, creating the
+        tables on first use.
+        """
+        connection = getattr(self.local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            # Write-ahead logging lets processes read while another writes. A
+            # power failure can lose the latest writes, which a cache can afford.
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            connection.execute('''
+                CREATE TABLE IF NOT EXISTS path_results (
+                  key TEXT PRIMARY KEY,
+                  version TEXT NOT NULL,
+                  path_limit INTEGER,
+                  complete INTEGER NOT NULL,
+                  payload BLOB NOT NULL,
+                  last_used REAL NOT NULL
+                )
+            ''')
+            # Databases written before entries recorded their last use
+            columns = {row[1] for row in connection.execute('PRAGMA table_info(path_results)')}
+            if 'last_used' not in columns:
+                connection.execute('ALTER TABLE path_results ADD COLUMN last_used REAL NOT NULL DEFAULT 0')
+            connection.execute('CREATE INDEX IF NOT EXISTS path_results_last_used ON path_results (last_used)')
+            connection.execute('''
+                CREATE TABLE IF NOT EXISTS counters (
+                  name TEXT PRIMARY KEY,
+                  value INTEGER NOT NULL
+                )
+            ''')
+            self.local.connection = connection
+        return connection
+
+    def get(self, key, limit=None):
+        """
+        Return (json_obj, tier) for `key` restricted to `limit` paths, or
+        (None, 'miss') if no entry answers the request. Disk hits mark the
+        entry on disk as recently used.
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+        tier = 'memory'
+        if (entry is None or not self.covers(*entry[:2], limit)) and self.path is not None:
+            entry = self.get_connection().execute(
+                'SELECT path_limit, complete, payload FROM path_results WHERE key = ?', (key,)).fetchone()
+            tier = 'disk'
+            if entry is not None and self.covers(*entry[:2], limit):
+                self._remember(key, tuple(entry))
+        if entry is None or not self.covers(*entry[:2], limit):
+            self.increment_counter('misses')
+            return None, 'miss'
+        self.increment_counter(f'{tier}-hits')
+        if tier == 'disk':
+            self.get_connection().execute(
+                'UPDATE path_results SET last_used = ? WHERE key = ?', (time.time(), key))
+        json_obj = json.loads(zlib.decompress(entry[2]))
+        return limit_paths(json_obj, limit), tier
+
+    def set(self, key, version, json_obj, limit=None):
+        """
+        Store a get_paths result computed with `limit` for `key`. Entries on
+        disk for other dataset versions are deleted the first time a result
+        is stored for a new version.
+        """
+        complete = limit is None or len(json_obj['paths']) < limit
+        entry = limit, complete, zlib.compress(json.dumps(json_obj).encode())
+        self._remember(key, entry)
+        if self.path is None:
+            return
+        connection = self.get_connection()
+        if self.pruned_version != version:
+            connection.execute('DELETE FROM path_results WHERE version != ?', (version,))
+            self.pruned_version = version
+        connection.execute(
+            'INSERT OR REPLACE INTO path_results VALUES (?, ?, ?, ?, ?, ?)', (key, version, *entry, time.time()))
+        self.n_stored += 1
+        if self.n_stored % self.prune_interval == 0:
+            self.prune()
+
+    def prune(self):
+        """
+        Delete the least recently used entries on disk beyond max_disk_bytes.
+        """
+        if self.path is None or self.max_disk_bytes is None:
+            return
+        connection = self.get_connection()
+        disk_bytes, = connection.execute(
+            'SELECT coalesce(sum(length(payload)), 0) FROM path_results').fetchone()
+        if disk_bytes <= self.max_disk_bytes:
+            return
+        # Count the entries outside the most recently used max_disk_bytes
+        n_evicted, = connection.execute('''
+            SELECT count(*) FROM (
+              SELECT sum(length(payload)) OVER (ORDER BY last_used DESC, key DESC) AS n_bytes
+              FROM path_results
+            ) WHERE n_bytes > ?
+        ''', (self.max_disk_bytes,)).fetchone()
+        connection.execute('''
+            DELETE FROM path_results WHERE key IN (
+              SELECT key FROM path_results ORDER BY last_used, key LIMIT ?
+            )
+        ''', (n_evicted,))
+
+    def _remember(self, key, entry):
+        """
+        Store an entry in memory, evicting the least recently used entries
+        beyond max_bytes. Entries larger than max_bytes are not stored.
+        """
+        size = len(entry[2])
+        with self.lock:
+            old_entry = self.entries.pop(key, None)
+            if old_entry is not None:
+                self.n_bytes -= len(old_entry[2])
+            if size > self.max_bytes:
+                return
+            self.entries[key] = entry
+            self.n_bytes += size
+            while self.n_bytes > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.n_bytes -= len(evicted[2])
+
+    def increment_counter(self, name):
+        with self.lock:
+            self.counts[name] += 1
+            self.n_counted += 1
+            flush = self.n_counted % self.flush_interval == 0
+        if flush:
+            self.flush_counters()
+
+    def flush_counters(self):
+        """
+        Add the counts of this process to the counters in the database.
+        """
+        if self.path is None:
+            return
+        with self.lock:
+            counts = list(self.counts.items())
+            self.counts.clear()
+        if not counts:
+            return
+        self.get_connection().executemany(
+            'INSERT INTO counters VALUES (?, ?) ON CONFLICT (name) DO UPDATE SET value = value + excluded.value',
+            counts,
+        )
+
+    def get_counters(self):
+        """
+        Return a dictionary of counter values, which cover all processes
+        sharing the database up to their latest flush, or only this process if
+        path is None.
+        """
+        if self.path is None:
+            with self.lock:
+                return dict(self.counts)
+        self.flush_counters()
+        return dict(self.get_connection().execute('SELECT name, value FROM counters'))
+
+    def get_stats(self):
+        """
+        Return a dictionary with hits per tier, misses, and the hit rate, the
+        entries and bytes in this process's memory, and the entries and bytes
+        on disk.
+        """
+        counters = self.get_counters()
+        stats = {
+            name.replace('-', '_'): counters.get(name, 0)
+            for name in ('memory-hits', 'disk-hits', 'misses')
+        }
+        n_requests = sum(stats.values())
+        stats['hit_rate'] = (n_requests - stats['misses']) / n_requests if n_requests else None
+        stats['memory_entries'] = len(self.entries)
+        stats['memory_bytes'] = self.n_bytes
+        stats['disk_entries'], stats['disk_bytes'] = 0, 0
+        if self.path is not None:
+            stats['disk_entries'], stats['disk_bytes'] = self.get_connection().execute(
+                'SELECT count(*), coalesce(sum(length(payload)), 0) FROM path_results').fetchone()
+        return stats
@@ -1,5 +1,4 @@
 import collections
-import logging
 
 from django.db.models import Q
 import hetnetpy.neo4j
@@ -8,6 +7,7 @@ from dj_hetmech_app.utils import (
     get_hetionet_metagraph,
     get_neo4j_driver,
 )
+from dj_hetmech_app.utils.cache import cached_per_dataset_version
 
 
 cypher_degree_query = '''\
@@ -33,35 +33,34 @@ def get_node_degree(node_id, rel_type):
     return result['degree'] if result else 0
 
 
-def get_pathcount_record(metapath, source_id, target_id, path_count, raw_dwpc):
+def get_pathcount_record(metapath, source_id, target_id, path_count, raw_dwpc, get_degree=get_node_degree):
     """
     Return the record from the PathCount table for a given metapath, source node,
     and target node. If the record does not exist in the PathCount table, check
     whether the DegreeGroupedPermutation table contains the corresponding null DWPC
     information and use raw_dwpc to create a PathCount record on the fly. If no
-    null DWPC information exists, return None.
+    null DWPC information exists, return None. Node degrees are looked up with
+    `get_degree(node_id, metaedge)`.
     """
     from dj_hetmech_app.models import DegreeGroupedPermutation, Metapath, Node, PathCount
 
-    # Return the PathCount record if it is stored in the database 
-    pathcounts_qs = PathCount.objects.filter(
-        Q(metapath=metapath.abbrev, source=source_id, target=target_id) |
-        Q(metapath=metapath.inverse.abbrev, source=target_id, target=source_id)
-    )
-    pathcount_record = pathcounts_qs.first()
-    pathcounts_qs_count = pathcounts_qs.count()
-    if pathcounts_qs_count > 1:
-        # see https://github.com/greenelab/connectivity-search-backend/issues/43
-        import pandas
-        qs_df = pandas.DataFrame.from_records(pathcounts_qs.all().values())
-        logging.warning(
-            f'get_paths returned {pathcounts_qs_count} results, '
-            'but database should not have more than one row (including inverse orientation) for '
-            f'{metapath.abbrev} from {source_id} to {target_id}.\n'
-            + qs_df.to_string(index=False)
+    # Return the PathCount record if it is stored in the database
+    node_low, node_high = sorted((source_id, target_id))
+    pathcount_record = (
+        PathCount.objects
+        .filter(node_low=node_low, node_high=node_high)
+        .filter(
+            Q(metapath=metapath.abbrev, inverted=source_id > target_id) |
+            Q(metapath=metapath.inverse.abbrev, inverted=target_id > source_id)
         )
+        .select_related('metapath', 'dgp', 'node_low', 'node_high')
+        .first()
+    )
     if pathcount_record:
-        pathcount_record.reversed = pathcount_record.metapath.abbreviation != metapath.abbrev
+        if source_id == target_id:
+            pathcount_record.reversed = pathcount_record.metapath_id != metapath.abbrev
+        else:
+            pathcount_record.reversed = pathcount_record.source_id != source_id
         return pathcount_record
 
     # Compute the PathCount record on-the-fly 
@@ -74,8 +73,8 @@ def get_pathcount_record(metapath, source_id, target_id, path_count, raw_dwpc):
         metapath = metapath.inverse
         source_id, target_id = target_id, source_id
         assert metapath_record.abbreviation == metapath.abbrev
-    source_degree = get_node_degree(source_id, metapath[0])
-    target_degree = get_node_degree(target_id, metapath[-1])
+    source_degree = get_degree(source_id, metapath[0])
+    target_degree = get_degree(target_id, metapath[-1].inverse)
     import numpy
     dwpc = numpy.arcsinh(raw_dwpc / metapath_record.dwpc_raw_mean)
     dgp_record = DegreeGroupedPermutation.objects.get(
@@ -91,8 +90,9 @@ def get_pathcount_record(metapath, source_id, target_id, path_count, raw_dwpc):
     p_value = calculate_p_value(hetmatpy_info)
     pathcount_record = PathCount(
         metapath=metapath_record,
-        source=Node.objects.get(pk=source_id),
-        target=Node.objects.get(pk=target_id),
+        node_low=Node.objects.get(pk=min(source_id, target_id)),
+        node_high=Node.objects.get(pk=max(source_id, target_id)),
+        inverted=source_id > target_id,
         dgp=dgp_record,
         path_count=path_count,
         dwpc=dwpc,
@@ -102,10 +102,14 @@ def get_pathcount_record(metapath, source_id, target_id, path_count, raw_dwpc):
     return pathcount_record
 
 
-def get_paths(metapath, source_id, target_id, limit=None):
+def get_paths(metapath, source_id, target_id, limit=None, engine=None):
     """
     Return JSON-serializeable object with paths between two nodes for a given metapath.
+    `engine` is 'neo4j' to query the Hetionet Neo4j database or 'hetmat' to
+    enumerate paths on the hetmat with HetmatPathEngine, and defaults to
+    settings.PATHS_ENGINE.
     """
+    from django.conf import settings
     metagraph = get_hetionet_metagraph()
     metapath = metagraph.get_metapath(metapath)
 
@@ -115,27 +119,30 @@ def get_paths(metapath, source_id, target_id, limit=None):
     source_identifier = source_record.get_cast_identifier()
     target_identifier = target_record.get_cast_identifier()
 
-    query = hetnetpy.neo4j.construct_pdp_query(
-        metapath, property='identifier', path_style='id_lists', aggregate_columns=True)
     if limit is not None:
         assert isinstance(limit, int) and limit >= 0
-        # when limit is 0, we still need to return at least 1 row to sniff path_count and raw_dwpc
-        query += f'\nLIMIT {max(1, limit)}'
-    driver = get_neo4j_driver()
-    neo4j_params = {
-        'source': source_identifier,
-        'target': target_identifier,
-        'w': 0.5,
-    }
-    with driver.session() as session:
-        results = session.run(query, neo4j_params)
-        results = [dict(record) for record in results]
+    engine = engine or settings.PATHS_ENGINE
+    if engine == 'hetmat':
+        from dj_hetmech_app.utils.hetmat_paths import get_hetmat_path_engine
+        path_engine = get_hetmat_path_engine()
+        results, path_count, raw_dwpc = path_engine.get_pdp_rows(metapath, source_id, target_id, limit=limit)
+        get_degree = path_engine.get_node_degree
+        get_node_info = path_engine.get_node_info
+        get_rel_info = path_engine.get_rel_info
+    else:
+        results = get_neo4j_pdp_rows(metapath, source_identifier, target_identifier, limit=limit)
+        path_count = results[0].pop('PC') if results else 0
+        raw_dwpc = results[0].pop('DWPC') if results else 0.0
+        get_degree = get_node_degree
+        get_node_info = get_neo4j_node_info
+        get_rel_info = get_neo4j_rel_info
 
     metapath_score = None
     pathcount_record = get_pathcount_record(
         metapath, source_id, target_id,
-        path_count=results[0].pop('PC') if results else 0,
-        raw_dwpc=results[0].pop('DWPC') if results else 0.0,
+        path_count=path_count,
+        raw_dwpc=raw_dwpc,
+        get_degree=get_degree,
     )
     if pathcount_record:
         import math
@@ -156,8 +163,8 @@ def get_paths(metapath, source_id, target_id, limit=None):
         neo4j_rel_ids.update(row['rel_ids'])
         paths_obj.append(row)
 
-    node_id_to_info = get_neo4j_node_info(neo4j_node_ids)
-    rel_id_to_info = get_neo4j_rel_info(neo4j_rel_ids)
+    node_id_to_info = get_node_info(neo4j_node_ids)
+    rel_id_to_info = get_rel_info(neo4j_rel_ids)
     # TODO return better path_count_info when pathcount_record=None
     from dj_hetmech_app.serializers import PathCountDgpSerializer
     path_count_info = PathCountDgpSerializer(pathcount_record).data if pathcount_record else {}
@@ -185,6 +192,28 @@ def get_paths(metapath, source_id, target_id, limit=None):
     return json_obj
 
 
+def get_neo4j_pdp_rows(metapath, source_identifier, target_identifier, limit=None):
+    """
+    Return rows of the Neo4j PDP query for paths of a metapath between two
+    nodes, ordered by decreasing percent_of_DWPC. Rows have `node_ids`,
+    `rel_ids`, `PDP`, `percent_of_DWPC`, `PC`, and `DWPC`.
+    """
+    query = hetnetpy.neo4j.construct_pdp_query(
+        metapath, property='identifier', path_style='id_lists', aggregate_columns=True)
+    if limit is not None:
+        # when limit is 0, we still need to return at least 1 row to sniff path_count and raw_dwpc
+        query += f'\nLIMIT {max(1, limit)}'
+    driver = get_neo4j_driver()
+    neo4j_params = {
+        'source': source_identifier,
+        'target': target_identifier,
+        'w': 0.5,
+    }
+    with driver.session() as session:
+        results = session.run(query, neo4j_params)
+        return [dict(record) for record in results]
+
+
 cypher_node_query = '''\
 MATCH (node)
 WHERE id(node) IN $node_ids
@@ -245,38 +274,45 @@ def get_neo4j_rel_info(rel_ids):
     return id_to_info
 
 
-def get_metapath_counts_for_node(node, metanodes: list = None):
+def get_metapath_counts_for_node(node, metanodes: list = None, other_nodes: list = None):
     """
     Return a dictionary (collections.Counter) of the number of metapaths from
-    the input node to each other node in the PathCounts table.
+    the input node to each other node in the PathCounts table, as precomputed
+    in the NodeConnection table.
 
-    `metanodes` is a list of metanode abbreviations, like `['G', 'MF']`, to subset 
+    `metanodes` is a list of metanode abbreviations, like `['G', 'MF']`, to subset
     other nodes by metanode. The default `metanodes=None` does not filter by metanode.
+    `other_nodes` is a list of node ids to restrict the counts to.
     """
-    from django.db.models import Count, F
-    from dj_hetmech_app.models import PathCount
-    query_set = (
-        PathCount.objects
-        .annotate(search_against=F('source'), node=F('target'))
-        .filter(search_against=node)
-        .values('node')
-        .annotate(n_metapaths=Count('node'))
-        .filter(**({} if metanodes is None else {'target__metanode__abbreviation__in': metanodes}))
-        .order_by('-n_metapaths')
-    ).union((
-        PathCount.objects
-        .annotate(search_against=F('target'), node=F('source'))
-        .filter(search_against=node)
-        .values('node')
-        .annotate(n_metapaths=Count('node'))
-        .filter(**({} if metanodes is None else {'source__metanode__abbreviation__in': metanodes}))
-        .order_by('-n_metapaths')
-    ), all=True)
+    from dj_hetmech_app.models import NodeConnection
+    query_set = NodeConnection.objects.filter(node=node)
+    if metanodes is not None:
+        query_set = query_set.filter(other_metanode__abbreviation__in=metanodes)
+    if other_nodes is not None:
+        query_set = query_set.filter(other_node__in=other_nodes)
+    return collections.Counter(dict(query_set.values_list('other_node', 'n_metapaths')))
+
 
-    counter = collections.Counter()
-    for result in query_set:
-        counter[result['node']] += result['n_metapaths']
-    return counter
+def get_node_connections(node, metanodes: list = None, sort='p_value'):
+    """
+    Return a queryset of NodeConnection rows from the input node to other
+    nodes with PathCount rows, ranked by `sort`. `sort='p_value'` orders by
+    the smallest adjusted p-value across metapaths, and `sort='score'` by the
+    combined score across metapaths, descending.
+
+    `metanodes` is a list of metanode abbreviations, like `['D']`, to subset
+    other nodes by metanode, as for get_metapath_counts_for_node.
+    """
+    from django.db.models import F
+    from dj_hetmech_app.models import NodeConnection
+    orderings = {
+        'p_value': (F('min_adjusted_p_value').asc(nulls_last=True), '-score', 'other_node'),
+        'score': ('-score', F('min_adjusted_p_value').asc(nulls_last=True), 'other_node'),
+    }
+    query_set = NodeConnection.objects.filter(node=node)
+    if metanodes is not None:
+        query_set = query_set.filter(other_metanode__abbreviation__in=metanodes)
+    return query_set.select_related('other_node').order_by(*orderings[sort])
 
 
 def get_metapath_queryset(source_metanode, target_metanode, extra_filters=None):
@@ -309,24 +345,188 @@ def get_pathcount_queryset(source_node, target_node, extra_filters=None):
     """
     Find pathcount records between a source and target node.
     Get back Pathcount table records, with an added reversed field.
+    Since records are stored by canonical node pair, both orientations are
+    found with a single lookup on (node_low, node_high).
     """
     from dj_hetmech_app.models import PathCount
-    from django.db.models import Value, BooleanField
+    from django.db.models import Case, Value, BooleanField, When
     if extra_filters is None:
         from django.db.models import Q
         extra_filters = Q()
+    source_node, target_node = int(source_node), int(target_node)
+    node_low, node_high = sorted((source_node, target_node))
+    # A record is reversed when its metapath starts at target_node
     pathcount_qs = (
-        PathCount.objects.filter(extra_filters, source=source_node, target=target_node)
-        .annotate(reversed=Value(False, output_field=BooleanField()))
+        PathCount.objects.filter(extra_filters, node_low=node_low, node_high=node_high)
+        .select_related('metapath', 'dgp', 'node_low', 'node_high')
+        .annotate(reversed=Case(
+            When(inverted=source_node == node_low, then=Value(True)),
+            default=Value(False),
+            output_field=BooleanField(),
+        ))
     )
-    if source_node != target_node:
-        pathcount_qs = pathcount_qs.union(
-            PathCount.objects.filter(extra_filters, source=target_node, target=source_node)
-            .annotate(reversed=Value(True, output_field=BooleanField()))
-        )
     return pathcount_qs
 
 
+def get_metapath_rows(pathcounts, limit=None):
+    """
+    Serialize a PathCount queryset, which has a reversed annotation, to rows
+    for the metapaths endpoint, without Cypher queries. Rows are sorted by
+    adjusted p-value, p-value, and metapath abbreviation. Uses a single query
+    regardless of the number of rows. Ordering and `limit` are applied in SQL,
+    where ties are broken by the stored rather than the oriented abbreviation.
+    """
+    from dj_hetmech_app.serializers import pathcount_value_lookups, serialize_pathcount_values
+    pathcounts = pathcounts.order_by('adjusted_p_value', 'p_value', 'metapath')
+    if limit is not None:
+        pathcounts = pathcounts[:limit]
+    rows = [serialize_pathcount_values(values) for values in pathcounts.values(*pathcount_value_lookups)]
+    rows.sort(key=metapath_row_sort_key)
+    return rows
+
+
+def metapath_row_sort_key(row):
+    return row['adjusted_p_value'], row['p_value'], row['metapath_abbreviation']
+
+
+def get_node_pair_metapaths(source_id, target_id, limit=None):
+    """
+    Return metapaths endpoint rows from source to target from the
+    NodePairMetapaths table, or None if the pair does not have a stored row.
+    With `limit`, only the first rows of the stored array are read.
+    """
+    from dj_hetmech_app.models import NodePairMetapaths
+    node_low, node_high = sorted((source_id, target_id))
+    queryset = NodePairMetapaths.objects.filter(node_low=node_low, node_high=node_high)
+    rows = queryset.values_list(get_limited_metapaths(limit), flat=True).first()
+    if rows is None:
+        return rows
+    return serialize_node_pair_values(map(get_node_pair_values, rows), source_id, node_low)
+
+
+def get_limited_metapaths(limit=None):
+    """
+    Return an expression for the first `limit` stored rows of the
+    NodePairMetapaths.metapaths array, or all rows if limit is None.
+    """
+    from django.contrib.postgres.fields import JSONField
+    from django.db.models import F
+    from django.db.models.expressions import RawSQL
+    if limit is None:
+        return F('metapaths')
+    rows_sql = ('jsonb_path_query_array(metapaths, %s)', [f'$[0 to {limit - 1}]']) if limit else ("'[]'::jsonb", [])
+    return RawSQL(*rows_sql, output_field=JSONField())
+
+
+def get_node_pair_values(row):
+    """
+    Return a dictionary of node_pair_metapath_lookups for a row of a stored
+    NodePairMetapaths.metapaths array.
+    """
+    from dj_hetmech_app.serializers import node_pair_metapath_lookups
+    return dict(zip(node_pair_metapath_lookups, row))
+
+
+@cached_per_dataset_version
+def get_metapath_values():
+    """
+    Return a dictionary from metapath abbreviation to the metapath values of
+    serialize_pathcount_values, read from the Metapath table once per dataset
+    version, which NodePairMetapaths rows are combined with when served.
+    """
+    from dj_hetmech_app.models import Metapath
+    from dj_hetmech_app.serializers import metapath_value_fields
+    return {
+        row['abbreviation']: {f'metapath__{field}': row[field] for field in metapath_value_fields}
+        for row in Metapath.objects.values(*metapath_value_fields)
+    }
+
+
+def serialize_node_pair_values(values, source_id, node_low):
+    """
+    Return metapaths endpoint rows from source_id to the other node of a pair
+    for `values` with node_pair_metapath_lookups, such as the stored rows of
+    a NodePairMetapaths array, whose inverted field is relative to node_low.
+    """
+    from dj_hetmech_app.serializers import serialize_pathcount_values
+    metapaths = get_metapath_values()
+    from_high = source_id != node_low
+    rows = [
+        serialize_pathcount_values({
+            **row, **metapaths[row['metapath__abbreviation']],
+            'reversed': row['inverted'] != from_high,
+        })
+        for row in values
+    ]
+    rows.sort(key=metapath_row_sort_key)
+    return rows
+
+
+def get_node_pairs_metapaths(pairs, limit=None):
+    """
+    Return a dictionary from each (source_id, target_id) pair in `pairs` to
+    its metapaths endpoint rows, which are empty for pairs without path counts.
+    Stored NodePairMetapaths rows are read with a single query filtered to
+    the canonical pairs by filter_node_pairs. Pairs without a stored row are
+    read from PathCount with a second such query.
+    """
+    from dj_hetmech_app.models import NodePairMetapaths, PathCount
+    from dj_hetmech_app.serializers import node_pair_metapath_lookups
+    canonical_pairs = sorted({tuple(sorted(pair)) for pair in pairs})
+    if not canonical_pairs:
+        return {}
+    stored = dict()
+    queryset = filter_node_pairs(NodePairMetapaths.objects.all(), canonical_pairs)
+    for node_low, node_high, rows in queryset.values_list('node_low', 'node_high', get_limited_metapaths(limit)):
+        stored[node_low, node_high] = list(map(get_node_pair_values, rows))
+    missing_pairs = [pair for pair in canonical_pairs if pair not in stored]
+    if missing_pairs:
+        pathcounts = (
+            filter_node_pairs(PathCount.objects.all(), missing_pairs)
+            .order_by('node_low', 'node_high', 'adjusted_p_value', 'p_value', 'metapath')
+            .values('node_low', 'node_high', *node_pair_metapath_lookups)
+        )
+        for pair in missing_pairs:
+            stored[pair] = []
+        for values in pathcounts:
+            stored[values['node_low'], values['node_high']].append(values)
+        if limit is not None:
+            for pair in missing_pairs:
+                stored[pair] = stored[pair][:limit]
+    metapaths = dict()
+    for source_id, target_id in pairs:
+        node_low, node_high = sorted((source_id, target_id))
+        metapaths[source_id, target_id] = serialize_node_pair_values(stored[node_low, node_high], source_id, node_low)
+    return metapaths
+
+
+def filter_node_pairs(queryset, pairs, max_q_pairs=100):
+    """
+    Filter a queryset of a model with node_low and node_high fields to
+    canonical `pairs`. Up to `max_q_pairs` pairs are matched with an OR of
+    conditions. Larger batches are matched against a subquery that unnests
+    arrays of node ids, which PostgreSQL plans as a single set-based lookup
+    with two bound parameters regardless of the number of pairs.
+    """
+    from django.db import connection
+    from django.db.models import BooleanField, Q
+    from django.db.models.expressions import RawSQL
+    if len(pairs) <= max_q_pairs:
+        condition = Q(pk__in=[])
+        for node_low, node_high in pairs:
+            condition |= Q(node_low=node_low, node_high=node_high)
+        return queryset.filter(condition)
+    table = connection.ops.quote_name(queryset.model._meta.db_table)
+    node_lows, node_highs = zip(*pairs)
+    condition = RawSQL(
+        f'({table}."node_low_id", {table}."node_high_id") IN '
+        '(SELECT * FROM unnest(%s::integer[], %s::integer[]))',
+        [list(node_lows), list(node_highs)],
+        output_field=BooleanField(),
+    )
+    return queryset.filter(condition)
+
+
 def get_metapath_instance(metapath):
     from dj_hetmech_app.models import Metapath
     from django.db.models import Value, BooleanField
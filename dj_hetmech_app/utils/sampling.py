@@ -0,0 +1,150 @@
+"""
+Random node pairs for the random-node-pair and random metapaths endpoints.
+
+Pairs are drawn with probability proportional to their number of metapaths,
+as when drawing a random PathCount row, from arrays held in memory, so a
+sample does not query the database. populate_database saves the arrays for
+each dataset version to NODE_PAIR_SAMPLER_PATH, from which processes
+memory-map them rather than reading every node pair from the database.
+"""
+
+import pathlib
+import random
+import shutil
+
+import numpy
+
+from dj_hetmech_app.utils.cache import cached_per_dataset_version, get_dataset_version
+
+
+@cached_per_dataset_version
+def get_node_pair_sampler():
+    """
+    Return the NodePairSampler for the current dataset version, loading it
+    on first use and after populate_database runs. Arrays saved by
+    populate_database are memory-mapped, so worker processes share their
+    pages. Otherwise, the sampler is built from the database.
+    """
+    directory = get_node_pair_sampler_directory(get_dataset_version())
+    if directory is not None and directory.is_dir():
+        return NodePairSampler.load(directory)
+    return NodePairSampler.from_database()
+
+
+def get_node_pair_sampler_directory(version):
+    """
+    Return the directory of the sampler arrays for a dataset version, or None
+    if NODE_PAIR_SAMPLER_PATH is None.
+    """
+    from django.conf import settings
+    path = getattr(settings, 'NODE_PAIR_SAMPLER_PATH', None)
+    if path is None:
+        return None
+    return pathlib.Path(path).joinpath(version)
+
+
+def save_node_pair_sampler(version):
+    """
+    Build the sampler from the database and save it for dataset `version`,
+    removing the arrays saved for other versions. Only directories of saved
+    samplers are removed, so other files and the temporary directories of
+    samplers being saved are kept. Returns the directory or None if
+    NODE_PAIR_SAMPLER_PATH is None.
+    """
+    directory = get_node_pair_sampler_directory(version)
+    if directory is None:
+        return None
+    NodePairSampler.from_database().save(directory)
+    for other in directory.parent.iterdir():
+        if other == directory or other.suffix == '.tmp' or not other.is_dir():
+            continue
+        if all(other.joinpath(f'{name}.npy').exists() for name in NodePairSampler.array_names):
+            shutil.rmtree(other)
+    return directory
+
+
+class NodePairSampler:
+    """
+    Weighted sampler over node pairs from arrays of node_low and node_high
+    ids and their number of metapaths. A sample draws a uniform integer below
+    the total number of metapaths and looks up its pair in the cumulative
+    weights with a binary search, which takes under a microsecond even for
+    tens of millions of pairs.
+    """
+
+    array_names = ['node_low', 'node_high', 'n_metapaths', 'cumulative']
+
+    def __init__(self, node_low, node_high, n_metapaths, cumulative=None):
+        self.node_low = numpy.asanyarray(node_low, dtype=numpy.int32)
+        self.node_high = numpy.asanyarray(node_high, dtype=numpy.int32)
+        self.n_metapaths = numpy.asanyarray(n_metapaths, dtype=numpy.int32)
+        if cumulative is None:
+            cumulative = numpy.cumsum(self.n_metapaths, dtype=numpy.int64)
+        self.cumulative = numpy.asanyarray(cumulative, dtype=numpy.int64)
+
+    @classmethod
+    def from_database(cls, chunk_size=100_000):
+        """
+        Build a sampler from the NodePairMetapaths table, or from PathCount
+        for databases loaded before NodePairMetapaths was added.
+        """
+        from django.db.models import Count
+        from dj_hetmech_app.models import NodePairMetapaths, PathCount
+        rows = NodePairMetapaths.objects.values_list('node_low', 'node_high', 'n_metapaths')
+        if not NodePairMetapaths.objects.exists():
+            rows = (
+                PathCount.objects
+                .values_list('node_low', 'node_high')
+                .annotate(n_metapaths=Count('*'))
+                .order_by()
+            )
+        array = numpy.fromiter(
+            (value for row in rows.iterator(chunk_size=chunk_size) for value in row),
+            dtype=numpy.int64,
+        ).reshape(-1, 3)
+        return cls(array[:, 0], array[:, 1], array[:, 2])
+
+    def save(self, directory):
+        """
+        Save the arrays as .npy files in `directory`, which must not exist.
+        Files are written to a temporary directory that is then renamed, so
+        processes never load a partially written sampler.
+        """
+        directory = pathlib.Path(directory)
+        temporary = directory.with_name(f'{directory.name}.tmp')
+        if temporary.exists():
+            shutil.rmtree(temporary)
+        temporary.mkdir(parents=True)
+        for name in self.array_names:
+            numpy.save(temporary.joinpath(f'{name}.npy'), getattr(self, name))
+        temporary.rename(directory)
+
+    @classmethod
+    def load(cls, directory, mmap_mode='r'):
+        """
+        Load a sampler saved by `save`, memory-mapping its arrays by default.
+        """
+        directory = pathlib.Path(directory)
+        return cls(*(
+            numpy.load(directory.joinpath(f'{name}.npy'), mmap_mode=mmap_mode)
+            for name in cls.array_names
+        ))
+
+    def __len__(self):
+        return len(self.n_metapaths)
+
+    def sample(self, rng=random):
+        """
+        Return a random (source_id, target_id, n_metapaths) tuple. Pairs are
+        weighted by their number of metapaths, and source and target are
+        assigned to the nodes of the pair at random. Raises ValueError if
+        there are no pairs.
+        """
+        if not len(self):
+            raise ValueError('no node pairs to sample from')
+        draw = rng.randrange(int(self.cumulative[-1]))
+        i = int(numpy.searchsorted(self.cumulative, draw, side='right'))
+        source_id, target_id = int(self.node_low[i]), int(self.node_high[i])
+        if rng.random() < 0.5:
+            source_id, target_id = target_id, source_id
+        return source_id, target_id, int(self.n_metapaths[i])
@@ -0,0 +1,234 @@
+"""
+In-memory node search for the nodes endpoint.
+
+NodeSearchIndex reproduces the SQL search of NodeViewSet.get_queryset, which
+matches identifier prefixes, name substrings, and name trigram similarity with
+pg_trgm, without querying the Node table for every search. The index is built
+once per process and rebuilt when the dataset version changes.
+"""
+
+import bisect
+import re
+
+import numpy
+
+from dj_hetmech_app.utils.cache import cached_per_dataset_version
+
+
+@cached_per_dataset_version
+def get_node_search_index():
+    """
+    Return the NodeSearchIndex for the current dataset version, building it
+    from the Node table on first use and after populate_database runs.
+    """
+    return NodeSearchIndex.from_database()
+
+
+def get_trigrams(text):
+    """
+    Return the set of trigrams in `text` as extracted by pg_trgm. Words are
+    runs of alphanumeric characters, lowercased and padded with two spaces
+    before and one space after.
+    """
+    trigrams = set()
+    for word in re.findall(r'[^\W_]+', text.lower()):
+        word = f'  {word} '
+        trigrams.update(word[i:i + 3] for i in range(len(word) - 2))
+    return trigrams
+
+
+class NodeSearchIndex:
+    """
+    Search index over nodes, from lists of node ids, identifiers, names, and
+    metanode abbreviations. Consists of a sorted identifier index for prefix
+    matches, an inverted index from short name substrings to nodes for
+    substring matches, and an inverted index from pg_trgm trigrams to nodes
+    for similarity.
+
+    Matching is case-insensitive as with the SQL istartswith and icontains
+    lookups, which compare upper-cased strings. Ties in similarity are ordered
+    by name as in `name_order`, a list of node ids sorted by name in the
+    database, so ties follow the database collation. Without `name_order`,
+    names are sorted in code point order, which matches the C collation.
+    """
+
+    def __init__(self, ids, identifiers, names, metanodes, name_order=None):
+        self.ids = numpy.asarray(ids, dtype=numpy.int64)
+        self.names = list(names)
+        self.metanode_codes = {metanode: code for code, metanode in enumerate(sorted(set(metanodes)))}
+        self.metanodes = numpy.array([self.metanode_codes[x] for x in metanodes], dtype=numpy.int32)
+        n_nodes = len(self.ids)
+
+        # Rank of each node when sorted by name, for tie-breaking
+        self.name_ranks = numpy.empty(n_nodes, dtype=numpy.int64)
+        if name_order is None:
+            name_positions = sorted(range(n_nodes), key=self.names.__getitem__)
+        else:
+            id_order = numpy.argsort(self.ids)
+            name_positions = id_order[numpy.searchsorted(self.ids, name_order, sorter=id_order)]
+        self.name_ranks[name_positions] = numpy.arange(n_nodes)
+
+        # Identifier prefix index: upper-cased identifiers in sorted order
+        identifiers = [identifier.upper() for identifier in identifiers]
+        self.identifier_order = numpy.array(sorted(range(n_nodes), key=identifiers.__getitem__), dtype=numpy.int64)
+        self.sorted_identifiers = [identifiers[i] for i in self.identifier_order]
+
+        # Name substring index: nodes containing each upper-cased substring of up to three characters
+        self.upper_names = [name.upper() for name in self.names]
+        substring_postings = dict()
+        for i, name in enumerate(self.upper_names):
+            substrings = {name[j:j + k] for k in (1, 2, 3) for j in range(len(name) - k + 1)}
+            for substring in substrings:
+                substring_postings.setdefault(substring, []).append(i)
+        self.substring_postings = {
+            substring: numpy.array(nodes, dtype=numpy.int32) for substring, nodes in substring_postings.items()
+        }
+
+        # Trigram inverted index
+        postings = dict()
+        self.n_trigrams = numpy.zeros(n_nodes, dtype=numpy.int64)
+        for i, name in enumerate(self.names):
+            trigrams = get_trigrams(name)
+            self.n_trigrams[i] = len(trigrams)
+            for trigram in trigrams:
+                postings.setdefault(trigram, []).append(i)
+        self.postings = {trigram: numpy.array(nodes, dtype=numpy.int32) for trigram, nodes in postings.items()}
+
+    @classmethod
+    def from_database(cls):
+        from dj_hetmech_app.models import Node
+        rows = Node.objects.order_by('id').values_list('id', 'identifier', 'name', 'metanode__abbreviation')
+        columns = list(zip(*rows)) or [[], [], [], []]
+        name_order = list(Node.objects.order_by('name', 'id').values_list('id', flat=True))
+        return cls(*columns, name_order=name_order)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def identifier_prefix_matches(self, search_str):
+        """
+        Return a boolean array of nodes whose identifier starts with search_str.
+        """
+        prefix = search_str.upper()
+        start = bisect.bisect_left(self.sorted_identifiers, prefix)
+        stop = bisect.bisect_left(self.sorted_identifiers, prefix + '\U0010ffff', lo=start)
+        matches = numpy.zeros(len(self), dtype=bool)
+        matches[self.identifier_order[start:stop]] = True
+        return matches
+
+    def name_substring_matches(self, search_str):
+        """
+        Return a boolean array of nodes whose name contains search_str.
+        Names containing a string of up to three characters are read from the
+        index. Longer strings are checked against the names that contain all
+        of their three-character substrings.
+        """
+        substring = search_str.upper()
+        matches = numpy.zeros(len(self), dtype=bool)
+        if not substring:
+            matches[:] = True
+            return matches
+        empty = numpy.array([], dtype=numpy.int32)
+        if len(substring) <= 3:
+            matches[self.substring_postings.get(substring, empty)] = True
+            return matches
+        postings = sorted(
+            (self.substring_postings.get(substring[i:i + 3], empty) for i in range(len(substring) - 2)),
+            key=len,
+        )
+        candidates = postings[0]
+        for posting in postings[1:]:
+            if len(candidates) <= 32:
+                break
+            candidates = numpy.intersect1d(candidates, posting, assume_unique=True)
+        names = self.upper_names
+        matches[[i for i in candidates.tolist() if substring in names[i]]] = True
+        return matches
+
+    def similarities(self, search_str):
+        """
+        Return a float32 array of the pg_trgm similarity of each node name to search_str.
+        """
+        trigrams = get_trigrams(search_str)
+        postings = [self.postings[trigram] for trigram in trigrams if trigram in self.postings]
+        similarity = numpy.zeros(len(self), dtype=numpy.float32)
+        if not postings:
+            return similarity
+        n_shared = numpy.bincount(numpy.concatenate(postings), minlength=len(self))
+        nodes = numpy.flatnonzero(n_shared)
+        n_shared = n_shared[nodes]
+        n_union = len(trigrams) + self.n_trigrams[nodes] - n_shared
+        similarity[nodes] = n_shared.astype(numpy.float32) / n_union.astype(numpy.float32)
+        return similarity
+
+    def search(self, search_str, similarity=0.3, metanodes=None):
+        """
+        Return NodeSearchResults for nodes whose identifier starts with
+        search_str, whose name contains search_str, or whose name has a
+        trigram similarity to search_str above `similarity`. Results are
+        ordered by prefix match, substring match, similarity, and name.
+        `metanodes` is a list of metanode abbreviations to restrict results.
+        """
+        prefix = self.identifier_prefix_matches(search_str)
+        substring = self.name_substring_matches(search_str)
+        similarities = self.similarities(search_str)
+        matches = prefix | substring | (similarities.astype(numpy.float64) > similarity)
+        if metanodes is not None:
+            codes = [self.metanode_codes[x] for x in metanodes if x in self.metanode_codes]
+            matches &= numpy.isin(self.metanodes, codes)
+        nodes = numpy.flatnonzero(matches)
+        # Pack the ordering into one integer per node. Non-negative float32
+        # bit patterns sort like their values.
+        group = 3 - (2 * prefix[nodes] + substring[nodes]).astype(numpy.int64)
+        similarity_bits = similarities[nodes].view(numpy.int32).astype(numpy.int64)
+        keys = (group << 61) | ((0x7FFFFFFF - similarity_bits) << 30) | self.name_ranks[nodes]
+        return NodeSearchResults(self.ids[nodes], keys, similarities[nodes])
+
+
+class NodeSearchResults:
+    """
+    Lazy sequence of Node records for search results, which supports len()
+    and slicing as used by pagination. Only the nodes of a requested slice are
+    sorted and fetched from the database, with a single query.
+    """
+
+    def __init__(self, ids, keys, similarities):
+        self.ids = ids
+        self.keys = keys
+        self.similarities = similarities
+
+    def __len__(self):
+        return len(self.ids)
+
+    def get_ordered_positions(self, stop):
+        """
+        Return the positions of the first `stop` results in order.
+        """
+        stop = min(stop, len(self))
+        if stop <= 0:
+            return numpy.array([], dtype=numpy.int64)
+        positions = numpy.arange(len(self))
+        if stop < len(self):
+            positions = numpy.argpartition(self.keys, stop - 1)[:stop]
+        return positions[numpy.argsort(self.keys[positions], kind='stable')]
+
+    def get_ids(self, start=0, stop=None):
+        """
+        Return the ordered node ids of results from start to stop.
+        """
+        stop = len(self) if stop is None else stop
+        return self.ids[self.get_ordered_positions(stop)[start:]].tolist()
+
+    def __getitem__(self, item):
+        from dj_hetmech_app.models import Node
+        if isinstance(item, int):
+            return self[item:item + 1][0]
+        start, stop, step = item.indices(len(self))
+        positions = self.get_ordered_positions(stop)[start::step]
+        nodes = Node.objects.in_bulk(self.ids[positions].tolist())
+        results = list()
+        for position in positions:
+            node = nodes[int(self.ids[position])]
+            node.similarity = float(self.similarities[position])
+            results.append(node)
+        return results
@@ -8,8 +8,9 @@ from rest_framework.reverse import reverse
 from rest_framework.views import APIView
 from rest_framework.viewsets import ReadOnlyModelViewSet
 
-from .models import Node, PathCount
-from .serializers import NodeSerializer, MetapathSerializer, PathCountDgpSerializer
+from .models import Node
+from .serializers import NodeSerializer, MetapathSerializer
+from .utils.cache import ResponseCacheMixin
 
 
 @api_view(['GET'])
@@ -25,11 +26,14 @@ def api_root(request):
         reverse('random-node-pair', request=request),
         reverse('metapaths', request=request, kwargs={'source': 17054, 'target': 6602}),
         reverse('metapaths-random-nodes', request=request),
+        reverse('metapaths-batch', request=request) + '?pairs=17054-6602',
         reverse('paths', request=request, kwargs={'source': 17054, 'target': 6602, 'metapath': 'CbGeAlD'}),
+        reverse('connections', request=request, kwargs={'node': 17054}) + '?metanodes=D',
+        reverse('export', request=request, kwargs={'metapath': 'CtD'}) + '?limit=100',
     ])
 
 
-class NodeViewSet(ReadOnlyModelViewSet):
+class NodeViewSet(ResponseCacheMixin, ReadOnlyModelViewSet):
     """
     Return nodes, sorted by similarity to the search term.
     Use `search=<str>` to search `identifier` for prefix match, and `name` for substring and trigram searches (similarity defaults to 0.3);
@@ -39,7 +43,7 @@ class NodeViewSet(ReadOnlyModelViewSet):
     For example, `metanodes=C,D` will restrict to Compound and Disease nodes.
 
     Set `other-node=<node_id>` to return non-null values for `metapath_count`.
-    `metapath_counts` measures the number of metapaths stored in the database between the result node and other node.
+    `metapath_count` measures the number of metapaths stored in the database between the result node and other node.
     If `search` and `other-node` and both specified, results are sorted by search similarity and results with `metapath_count == 0` are returned.
     If `other-node` is specified but not `search`, results are sorted by `metapath_count` (descending) and only results with `metapath_count > 0` are returned.
     """
@@ -47,23 +51,43 @@ class NodeViewSet(ReadOnlyModelViewSet):
     serializer_class = NodeSerializer
     filter_backends = (filters.SearchFilter, )
 
-    @functools.lru_cache()
-    def get_serializer_context(self):
+    def get_other_node(self):
         """
-        Add metapath_counts to context if "other-node" was specified.
-        https://stackoverflow.com/a/52859696/4651668
+        Return the node id specified by "other-node", or None if not specified.
         """
-        context = super().get_serializer_context()
-        search_against = context['request'].query_params.get('other-node')
-        if search_against is None:
-            return context
+        other_node = self.request.query_params.get('other-node')
+        if other_node is None:
+            return None
         try:
-            search_against = int(search_against)
+            return int(other_node)
         except ValueError:
-            return context
+            from rest_framework.exceptions import ParseError
+            raise ParseError({'error': 'Value of other-node must be a node id'})
+
+    def set_metapath_counts(self, nodes):
+        """
+        Set the metapath_count attribute of nodes to their number of metapaths
+        with "other-node", with a single query for nodes not already annotated.
+        """
+        other_node = self.get_other_node()
+        nodes = [node for node in nodes if 'metapath_count' not in vars(node)]
+        if other_node is None or not nodes:
+            return
         from dj_hetmech_app.utils.paths import get_metapath_counts_for_node
-        context['metapath_counts'] = get_metapath_counts_for_node(search_against)
-        return context
+        metapath_counts = get_metapath_counts_for_node(other_node, other_nodes=[node.id for node in nodes])
+        for node in nodes:
+            node.metapath_count = metapath_counts[node.id]
+
+    def paginate_queryset(self, queryset):
+        page = super().paginate_queryset(queryset)
+        if page is not None:
+            self.set_metapath_counts(page)
+        return page
+
+    def get_object(self):
+        node = super().get_object()
+        self.set_metapath_counts([node])
+        return node
 
     def get_queryset(self):
         """Optionally restricts the returned nodes based on `metanodes` and
@@ -79,9 +103,6 @@ class NodeViewSet(ReadOnlyModelViewSet):
         # 'search' parameter to search 'identifier' and 'name' fields
         search_str = self.request.query_params.get('search', None)
         if search_str is not None:
-            from django.contrib.postgres.search import TrigramSimilarity
-            from django.db.models import Case, When, Value, IntegerField
-
             # 'similarity' defaults to 0.3
             similarity = self.request.query_params.get('similarity', "0.3")
             try:
@@ -94,69 +115,80 @@ class NodeViewSet(ReadOnlyModelViewSet):
                     {'error': 'Value of similarity must be in (0, 1.0]'}
                 )
 
-            queryset = queryset.annotate(
-                similarity=TrigramSimilarity('name', search_str)
-            ).filter(
-                Q(identifier__istartswith=search_str) |  # prefix match of "identifier
-                Q(name__icontains=search_str) |          # substring match of "name"
-                Q(similarity__gt=similarity)             # trigram search of "name"
-            ).annotate(
-                identifier_prefix_match=Case(
-                    When(identifier__istartswith=search_str, then=Value(1)),
-                    default=Value(0),
-                    output_field=IntegerField(),
-                ),
-                name_substr_match=Case(
-                    When(name__icontains=search_str, then=Value(1)),
-                    default=Value(0),
-                    output_field=IntegerField(),
-                )
-            ).order_by(
-                '-identifier_prefix_match', '-name_substr_match', '-similarity', 'name'
+            from django.conf import settings
+            if self.action == 'list' and getattr(settings, 'NODE_SEARCH_INDEX', False):
+                from dj_hetmech_app.utils.search import get_node_search_index
+                queryset = get_node_search_index().search(search_str, similarity, metanodes)
+            else:
+                queryset = search_node_queryset(queryset, search_str, similarity)
+        elif self.get_other_node() is not None:
+            from django.db.models import F
+            # Filter, order, and paginate by metapath count in SQL using NodeConnection
+            queryset = (
+                queryset
+                .filter(connections__other_node=self.get_other_node())
+                .annotate(metapath_count=F('connections__n_metapaths'))
+                .order_by('-metapath_count', 'id')
             )
-        elif 'other-node' in self.request.query_params:
-            metapath_counts = self.get_serializer_context()['metapath_counts']
-            queryset = queryset.filter(pk__in=set(metapath_counts))
-            queryset = sorted(queryset, key=lambda node: metapath_counts[node.pk], reverse=True)
 
         return queryset
 
 
-class RandomNodePairView(APIView):
+def search_node_queryset(queryset, search_str, similarity):
+    """
+    Return Node records from queryset whose identifier starts with search_str,
+    whose name contains search_str, or whose name has a trigram similarity to
+    search_str above `similarity`, ordered by prefix match, substring match,
+    similarity, and name.
+    """
+    from django.contrib.postgres.search import TrigramSimilarity
+    from django.db.models import Case, When, Value, IntegerField
+    return queryset.annotate(
+        similarity=TrigramSimilarity('name', search_str)
+    ).filter(
+        Q(identifier__istartswith=search_str) |  # prefix match of "identifier
+        Q(name__icontains=search_str) |          # substring match of "name"
+        Q(similarity__gt=similarity)             # trigram search of "name"
+    ).annotate(
+        identifier_prefix_match=Case(
+            When(identifier__istartswith=search_str, then=Value(1)),
+            default=Value(0),
+            output_field=IntegerField(),
+        ),
+        name_substr_match=Case(
+            When(name__icontains=search_str, then=Value(1)),
+            default=Value(0),
+            output_field=IntegerField(),
+        )
+    ).order_by(
+        '-identifier_prefix_match', '-name_substr_match', '-similarity', 'name'
+    )
+
+
+class RandomNodePairView(ResponseCacheMixin, APIView):
     """
     Return a random source and target node for which at least one metapath with path count information exists in the database.
-    The implementation chooses a random row from the PathCount table,
+    Source-target pairs are weighted by their number of metapaths,
     such that source-target pairs with many metapaths are more likely to be selected than source-target pairs with few metapaths.
+    Pairs are sampled from memory without querying the database.
     """
     http_method_names = ['get']
+    cache_responses = False
 
     def get(self, request):
-        import random
-        # More info on random row lookup at https://stackoverflow.com/a/56119397/4651668
-        max_id = PathCount.objects.last().id
-        random_id = random.randint(0, max_id)
-        pathcount_row = PathCount.objects.get(pk=random_id)
-        n_metapaths = PathCount.objects.filter(source=pathcount_row.source, target=pathcount_row.target).count()
+        return Response(get_random_node_pair())
 
-        data = {
-            'source_id': pathcount_row.source.id,
-            'target_id': pathcount_row.target.id,
-            'n_metapaths': n_metapaths,
-            'pathcount_table_random_id': random_id,
-            'pathcount_table_max_id': max_id,
-        }
-        return Response(data)
 
-
-class QueryMetapathsView(APIView):
+class QueryMetapathsView(ResponseCacheMixin, APIView):
     """
     Return metapaths between a given source and target node whose path count information is stored in the database.
     Specify `complete` to also return metapaths of unknown significance whose path count information is not stored in the database.
     If not specified, `limit` defaults to returning all metapaths (i.e. without limit).
+    Specify `include=cypher_query` to add a Hetionet Neo4j Browser query for the paths of each metapath.
 
     The database only stores a single orientation of a metapath.
     For example, if GpPpGaD is stored between the given source and target node, DaGpPpG would not also be stored.
-    Therefore, both orientations of a metapath are searched against the PathCount table.
+    PathCount rows are keyed by the unordered node pair, so both orientations are found with a single lookup.
     """
     http_method_names = ['get']
 
@@ -165,18 +197,25 @@ class QueryMetapathsView(APIView):
         target_node = get_object_or_404(Node, pk=target)
         limit = get_limit(request, default=None)
 
-        from .utils.paths import get_pathcount_queryset, get_metapath_queryset
-        pathcounts = get_pathcount_queryset(source, target)
-        pathcounts = PathCountDgpSerializer(pathcounts, many=True).data
-        pathcounts.sort(key=lambda x: (x['adjusted_p_value'], x['p_value'], x['metapath_abbreviation']))
-        if limit is not None:
-            pathcounts = pathcounts[:limit]
-
-        if 'complete' in request.query_params:
+        from .utils.paths import (
+            get_metapath_queryset,
+            get_metapath_rows,
+            get_node_pair_metapaths,
+            get_pathcount_queryset,
+        )
+        # Read precomputed rows, falling back to PathCount for pairs without a stored row
+        pathcounts = get_node_pair_metapaths(source, target, limit=limit)
+        if pathcounts is None:
+            pathcounts = get_metapath_rows(get_pathcount_queryset(source, target), limit=limit)
+        if 'cypher_query' in get_include(request):
+            pathcounts = add_cypher_queries(pathcounts, source_node, target_node)
+
+        # Metapaths without path counts are only needed if path counts do not fill limit
+        if 'complete' in request.query_params and (limit is None or len(pathcounts) < limit):
             metapaths_present = {x['metapath_id'] for x in pathcounts}
             metapath_qs = get_metapath_queryset(
-                source_node.metanode,
-                target_node.metanode,
+                source_node.metanode_id,
+                target_node.metanode_id,
                 extra_filters=~Q(abbreviation__in=metapaths_present),
             )
             if limit is not None:
@@ -186,11 +225,7 @@ class QueryMetapathsView(APIView):
         # `metapath_qs = metapath_qs[:0]` doesn't filter to an empty query set`
         if limit is not None:
             pathcounts = pathcounts[:limit]
-
-        remove_keys = {'source', 'target', 'metapath_source', 'metapath_target'}
-        for dictionary in pathcounts:
-            for key in remove_keys & set(dictionary):
-                del dictionary[key]
+        remove_metapath_row_keys(pathcounts)
 
         data = {
             'source': NodeSerializer(source_node).data,
@@ -200,12 +235,173 @@ class QueryMetapathsView(APIView):
         return Response(data)
 
 
+class QueryMetapathsBatchView(APIView):
+    """
+    Return metapaths for many source and target node pairs in a single request.
+    Specify pairs with `pairs=<source>-<target>,<source>-<target>`, or all combinations of `sources=<ids>` and `targets=<ids>`, which are comma-separated node ids.
+    POST accepts the same as a JSON body, such as `{"pairs": [[17054, 6602]]}` or `{"sources": [17054], "targets": [6602]}`.
+    `limit`, `complete`, and `include=cypher_query` query parameters apply to each pair as for the metapaths endpoint.
+
+    Results are streamed as newline-delimited JSON in the order of the requested pairs,
+    with one object per pair containing the same `source`, `target`, and `path_counts` as the metapaths endpoint.
+    Path counts are read for a chunk of pairs at a time, with a single query against the set of pairs.
+    """
+    http_method_names = ['get', 'post']
+    max_pairs = 10_000
+    chunk_size = 1_000
+
+    def get(self, request):
+        return self.stream_metapaths(request, get_node_pairs(request.query_params, self.max_pairs))
+
+    def post(self, request):
+        return self.stream_metapaths(request, get_node_pairs(request.data, self.max_pairs))
+
+    def stream_metapaths(self, request, pairs):
+        import itertools
+        from django.http import StreamingHttpResponse
+        from rest_framework.exceptions import NotFound
+        from rest_framework.utils.encoders import JSONEncoder
+        from .utils.paths import get_node_pairs_metapaths
+
+        node_ids = {node_id for pair in pairs for node_id in pair}
+        nodes = Node.objects.in_bulk(node_ids)
+        missing = sorted(node_ids - set(nodes))
+        if missing:
+            raise NotFound(f"Node matching query does not exist for ids: {', '.join(map(str, missing))}")
+        node_data = dict(zip(nodes, NodeSerializer(nodes.values(), many=True).data))
+        limit = get_limit(request, default=None)
+        include_cypher = 'cypher_query' in get_include(request)
+        complete = 'complete' in request.query_params
+        encoder = JSONEncoder()
+
+        @functools.lru_cache(maxsize=None)
+        def get_metapath_rows(source_metanode, target_metanode):
+            from .utils.paths import get_metapath_queryset
+            return MetapathSerializer(get_metapath_queryset(source_metanode, target_metanode), many=True).data
+
+        def get_lines():
+            pairs_iter = iter(pairs)
+            chunks = iter(lambda: list(itertools.islice(pairs_iter, self.chunk_size)), [])
+            for chunk in chunks:
+                metapaths = get_node_pairs_metapaths(chunk, limit=limit)
+                for source, target in chunk:
+                    source_node, target_node = nodes[source], nodes[target]
+                    pathcounts = metapaths[source, target]
+                    if include_cypher:
+                        pathcounts = add_cypher_queries(pathcounts, source_node, target_node)
+                    if complete and (limit is None or len(pathcounts) < limit):
+                        metapaths_present = {x['metapath_id'] for x in pathcounts}
+                        pathcounts = pathcounts + [
+                            dict(row) for row in get_metapath_rows(source_node.metanode_id, target_node.metanode_id)
+                            if row['metapath_id'] not in metapaths_present
+                        ]
+                    if limit is not None:
+                        pathcounts = pathcounts[:limit]
+                    remove_metapath_row_keys(pathcounts)
+                    data = {
+                        'source': node_data[source],
+                        'target': node_data[target],
+                        'path_counts': pathcounts,
+                    }
+                    yield encoder.encode(data) + '\n'
+
+        return StreamingHttpResponse(get_lines(), content_type='application/x-ndjson')
+
+
+class QueryConnectionsView(ResponseCacheMixin, APIView):
+    """
+    Return the nodes most strongly connected to a given node across all metapaths whose path count information is stored in the database.
+    Use `sort=p_value` (default) to rank other nodes by their smallest adjusted p-value across metapaths,
+    or `sort=score` to rank by a combined score, the sum of -log10(adjusted p-value) across metapaths.
+    Filter other nodes for select metanodes using `metanodes=<str>`, where `<str>` is a comma-separated list of metanode abbreviations.
+    `limit` defaults to 100.
+    Rankings are precomputed when the database is populated.
+    """
+    http_method_names = ['get']
+
+    def get(self, request, node):
+        from rest_framework.exceptions import ParseError
+        from .utils.paths import get_node_connections
+        node = get_object_or_404(Node, pk=node)
+        sort = request.query_params.get('sort', 'p_value')
+        if sort not in {'p_value', 'score'}:
+            raise ParseError('sort must be p_value or score')
+        limit = get_limit(request, default=100)
+        connections = get_node_connections(node.id, metanodes=get_metanodes(request), sort=sort)
+        if limit is not None:
+            connections = connections[:limit]
+        connections = list(connections)
+        other_nodes = NodeSerializer([x.other_node for x in connections], many=True).data
+        data = {
+            'node': NodeSerializer(node).data,
+            'connections': [
+                {
+                    'other_node': other_node,
+                    'n_metapaths': connection.n_metapaths,
+                    'min_adjusted_p_value': connection.min_adjusted_p_value,
+                    'score': connection.score,
+                }
+                for connection, other_node in zip(connections, other_nodes)
+            ],
+        }
+        return Response(data)
+
+
+class ExportPathCountsView(APIView):
+    """
+    Export the path count information stored in the database for a metapath, oriented as the requested metapath abbreviation.
+    Use `output=<str>` to select `ndjson` (default), `csv`, or `tsv`.
+    Use `max_adjusted_p_value=<float>` to only export rows whose adjusted p-value is at most the cutoff.
+    Rows are ordered by node pair and streamed without limit unless `limit` is specified.
+    To continue an export, set `after=<source_id>-<target_id>` to the source and target of the last row received.
+    """
+    http_method_names = ['get']
+
+    def get(self, request, metapath):
+        from django.http import StreamingHttpResponse
+        from rest_framework.exceptions import NotFound, ParseError
+        from .models import Metapath
+        from .utils.exports import content_types, format_export_rows, get_export_rows, get_stored_metapath
+
+        output = request.query_params.get('output', 'ndjson')
+        if output not in content_types:
+            raise ParseError(f"output must be one of {', '.join(content_types)}")
+        try:
+            max_adjusted_p_value = request.query_params.get('max_adjusted_p_value')
+            if max_adjusted_p_value is not None:
+                max_adjusted_p_value = float(max_adjusted_p_value)
+            after = request.query_params.get('after')
+            if after is not None:
+                after = tuple(int(node_id) for node_id in after.split('-'))
+                if len(after) != 2:
+                    raise ValueError
+        except ValueError:
+            raise ParseError('max_adjusted_p_value must be a number and after must be <source_id>-<target_id>')
+        try:
+            get_stored_metapath(metapath)
+        except ValueError as error:
+            raise ParseError(str(error))
+        except Metapath.DoesNotExist as error:
+            raise NotFound(str(error))
+        rows = get_export_rows(
+            metapath,
+            max_adjusted_p_value=max_adjusted_p_value,
+            after=after,
+            limit=get_limit(request, default=None),
+        )
+        response = StreamingHttpResponse(format_export_rows(rows, output), content_type=content_types[output])
+        response['Content-Disposition'] = f'attachment; filename="{metapath}.{output}"'
+        return response
+
+
 class QueryMetapathsRandomNodesView(QueryMetapathsView):
     """
     Return metapaths for a random source and target node for which at least one metapath with path count information exists in the database.
     """
+    cache_responses = False
+
     def get(self, request):
-        info = RandomNodePairView().get(request=None).data
+        info = get_random_node_pair()
         response = super().get(
             request,
             source=info.pop('source_id'),
@@ -214,14 +410,18 @@ class QueryMetapathsRandomNodesView(QueryMetapathsView):
         return response
 
 
-class QueryPathsView(APIView):
+class QueryPathsView(ResponseCacheMixin, APIView):
     """
     For a given source node, target node, and metapath, return the actual paths comprising the path count / DWPC.
-    These paths have not been pre-computed and are extracted on-the-fly from the Hetionet Neo4j Browser.
-    Therefore, it is advisable to avoid querying a source-target-metapath pair with a path count exceeding 10,000.
+    These paths have not been pre-computed and are extracted on-the-fly from the Hetionet Neo4j Browser,
+    or enumerated on the Hetionet hetmat when the PATHS_ENGINE setting is 'hetmat'.
+    With neo4j, it is advisable to avoid querying a source-target-metapath pair with a path count exceeding 10,000.
     Because results are ordered by PDP / percent_of_DWPC, reducing `limit` does not prevent neo4j from having to exhaustively traverse all paths.
+    Results are cached in memory and on disk per dataset version, and a result for a larger `limit` answers requests with a smaller `limit`.
+    Responses are therefore not also stored in the response cache.
     """
     http_method_names = ['get']
+    store_responses = False
 
     def get(self, request, source, target, metapath):
         source_node = get_object_or_404(Node, pk=source)
@@ -229,9 +429,27 @@ class QueryPathsView(APIView):
         # TODO: validate "metapath" is a valid abbreviation
         limit = get_limit(request, default=100)
 
-        from .utils.paths import get_paths
-        output = get_paths(metapath, source_node.id, target_node.id, limit=limit)
-        return Response(output)
+        from .utils.path_cache import get_cached_paths
+        output, tier = get_cached_paths(metapath, source_node.id, target_node.id, limit=limit)
+        return Response(output, headers={'X-Paths-Cache': tier})
+
+
+def get_random_node_pair():
+    """
+    Return a dictionary with source_id, target_id, and n_metapaths for a random
+    node pair, weighted by number of metapaths.
+    """
+    from rest_framework.exceptions import NotFound
+    from .utils.sampling import get_node_pair_sampler
+    try:
+        source_id, target_id, n_metapaths = get_node_pair_sampler().sample()
+    except ValueError:
+        raise NotFound('No node pairs with path count information exist in the database')
+    return {
+        'source_id': source_id,
+        'target_id': target_id,
+        'n_metapaths': n_metapaths,
+    }
 
 
 def get_object_or_404(klass, *args, **kwargs):
@@ -259,6 +477,74 @@ def get_metanodes(request):
     return metanodes
 
 
+def add_cypher_queries(pathcounts, source_node, target_node):
+    """
+    Return copies of metapaths endpoint rows with a Hetionet Neo4j Browser
+    query for the paths of each metapath from source_node to target_node.
+    """
+    from .serializers import get_cypher_query
+    return [
+        dict(row, cypher_query=get_cypher_query(row['metapath_abbreviation'], source_node, target_node))
+        for row in pathcounts
+    ]
+
+
+def remove_metapath_row_keys(pathcounts):
+    """
+    Remove keys that the metapaths endpoint does not return from its rows.
+    """
+    remove_keys = {'source', 'target', 'metapath_source', 'metapath_target'}
+    for dictionary in pathcounts:
+        for key in remove_keys & set(dictionary):
+            del dictionary[key]
+
+
+def get_node_pairs(params, max_pairs):
+    """
+    Return a list of (source, target) node id pairs for the batch metapaths
+    endpoint from query parameters or a JSON body. `pairs` is either a string
+    like `1-2,3-4` or a list of two-item lists. Otherwise, `sources` and
+    `targets` are comma-separated strings or lists of node ids, whose
+    combinations are returned.
+    """
+    import itertools
+    from rest_framework.exceptions import ParseError
+
+    def get_ids(value):
+        if isinstance(value, str):
+            value = value.split(',')
+        return [int(node_id) for node_id in value]
+
+    try:
+        if 'pairs' in params:
+            pairs = params.get('pairs')
+            if isinstance(pairs, str):
+                pairs = [pair.split('-') for pair in pairs.split(',')]
+            pairs = [tuple(get_ids(pair)) for pair in pairs]
+            if any(len(pair) != 2 for pair in pairs):
+                raise ValueError
+        elif 'sources' in params and 'targets' in params:
+            pairs = list(itertools.product(get_ids(params.get('sources')), get_ids(params.get('targets'))))
+        else:
+            raise ParseError('specify pairs, or sources and targets')
+    except (TypeError, ValueError):
+        raise ParseError('pairs, sources, and targets must contain integer node ids')
+    if len(pairs) > max_pairs:
+        raise ParseError(f'at most {max_pairs:,} pairs are allowed per request, but {len(pairs):,} were specified')
+    return pairs
+
+
+def get_include(request):
+    """
+    Return the set of optional fields requested with `include=<str>`, where
+    `<str>` is a comma-separated list of field names.
+    """
+    include = request.query_params.get('include')
+    if include is None:
+        return set()
+    return set(include.split(','))
+
+
 def get_limit(request, default: int = 100):
     from rest_framework.exceptions import ParseError
     limit = request.query_params.get('limit', default)